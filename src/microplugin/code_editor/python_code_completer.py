@@ -1,4 +1,3 @@
-from jedi import Interpreter
 from qtpy.QtCore import QStringListModel, Qt
 from qtpy.QtWidgets import QCompleter
 
@@ -17,6 +16,9 @@ class PythonCodeCompleter(QCompleter):
         self.interpreter = None
 
     def updateCompletions(self, text):
+        # jedi is slow to import, and only needed once completions are requested:
+        from jedi import Interpreter
+
         if self.interpreter is None:
             self.interpreter = Interpreter(text, [])
         else:
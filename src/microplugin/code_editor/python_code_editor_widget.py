@@ -1,4 +1,3 @@
-import jedi  # Make sure jedi is installed
 from qtpy.QtCore import QStringListModel
 from qtpy.QtCore import Qt
 from qtpy.QtGui import QTextCursor
@@ -103,7 +102,8 @@ class PythonCodeEditor(QPlainTextEdit):
         text_under_cursor = self.textUnderCursor()
         if text_under_cursor != "" or show_completions:
 
-            # Get completions from Jedi:
+            # Get completions from Jedi, imported here as it is slow to import:
+            import jedi
             script = jedi.Script(code=self.toPlainText(), path="temp.py")
             completions = script.complete(
                 line=self.textCursor().blockNumber() + 1,
@@ -1,7 +1,7 @@
 from pathlib import Path
 from typing import Union
 
-from black import FileMode, format_file_in_place, WriteBack
+# Note: black is imported when needed, it is slow to import and not needed to open the editor.
 
 
 def format_code(code: str) -> str:
@@ -25,6 +25,8 @@ def format_file(file_path: Union[str, Path]) -> None:
     """Format the file using black."""
 
     try:
+        from black import FileMode, format_file_in_place, WriteBack
+
         # Ensure file_path is a Path object
         if isinstance(file_path, str):
             file_path = Path(file_path)
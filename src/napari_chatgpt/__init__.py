@@ -2,8 +2,16 @@ try:
     from ._version import version as __version__
 except ImportError:
     __version__ = "unknown"
-from ._widget import OmegaQWidget
 
 __all__ = (
     "OmegaQWidget"
 )
+
+
+def __getattr__(name):
+    # The widget is imported on first access, so that importing any submodule
+    # does not pull in napari and Qt:
+    if name == "OmegaQWidget":
+        from ._widget import OmegaQWidget
+        return OmegaQWidget
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
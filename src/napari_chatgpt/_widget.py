@@ -8,7 +8,7 @@ Replace code below according to your needs.
 """
 import sys
 import traceback
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, List, Optional
 
 from napari.viewer import Viewer
 from qtpy.QtCore import Qt
@@ -24,12 +24,15 @@ from napari_chatgpt.utils.ollama.ollama_server import is_ollama_running, \
 from napari_chatgpt.utils.openai.model_list import get_openai_model_list
 from napari_chatgpt.utils.python.installed_packages import \
     is_package_installed
+from napari_chatgpt.utils.python.package_index import \
+    start_package_index_build
+from napari_chatgpt.utils.python.symbol_index import start_symbol_index_build
 from napari_chatgpt.utils.qt.one_time_disclaimer_dialog import \
     show_one_time_disclaimer_dialog
 from napari_chatgpt.utils.qt.warning_dialog import show_warning_dialog
 
 if TYPE_CHECKING:
-    pass
+    from napari_chatgpt.chat_server.chat_server import NapariChatServer
 
 from arbol import aprint, asection
 
@@ -54,12 +57,15 @@ class OmegaQWidget(QWidget):
         # Get app configuration:
         self.config = AppConfiguration('omega')
 
+        # Start indexing installed packages, and the symbols of common packages, in the background:
+        start_package_index_build()
+        start_symbol_index_build()
+
         # Napari viewer instance:
         self.viewer = napari_viewer
 
-        # Napari chat server instance:
-        from napari_chatgpt.chat_server.chat_server import NapariChatServer
-        self.server: NapariChatServer = None
+        # Napari chat server instance, the chat server module is only imported when Omega is started:
+        self.server: Optional['NapariChatServer'] = None
 
         # Create a QVBoxLayout instance
         self.layout = QVBoxLayout()
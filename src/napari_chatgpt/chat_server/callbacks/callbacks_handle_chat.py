@@ -1,4 +1,3 @@
-import asyncio
 from pprint import pprint
 from typing import Any, Dict, Union, List, Optional
 from uuid import UUID
@@ -9,6 +8,7 @@ from langchain.schema import AgentFinish, AgentAction, LLMResult, BaseMessage
 from starlette.websockets import WebSocket
 
 from napari_chatgpt.chat_server.chat_response import ChatResponse
+from napari_chatgpt.chat_server.chat_stream import ChatStream
 from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
 from napari_chatgpt.utils.strings.camel_case_to_normal import \
     camel_case_to_lower_case
@@ -20,13 +20,18 @@ class ChatCallbackHandler(AsyncCallbackHandler):
     def __init__(self,
                  websocket: WebSocket,
                  notebook: JupyterNotebookFile,
+                 chat_stream: ChatStream = None,
                  verbose: bool = False):
         self.websocket: WebSocket = websocket
+        self.chat_stream: ChatStream = chat_stream or ChatStream(websocket)
         self.notebook: JupyterNotebookFile = notebook
         self.verbose = verbose
         self.last_tool_used = ''
         self.last_tool_input = ''
 
+        # Whether the tokens of the current LLM response are streamed to the client:
+        self._stream_tokens = None
+
     async def on_chat_model_start(
             self,
             serialized: Dict[str, Any],
@@ -47,13 +52,26 @@ class ChatCallbackHandler(AsyncCallbackHandler):
         """Run when LLM starts running."""
         pprint(prompts)
         resp = ChatResponse(sender="agent", message='', type="typing")
-        await self.websocket.send_json(resp.dict())
+        await self.chat_stream.send(resp)
+        self._stream_tokens = None
 
     async def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
         """Run on new LLM token. Only available when streaming is enabled."""
+        if self._stream_tokens is None:
+            # Decide on the first visible characters: JSON blobs and code fences are
+            # agent actions of non function-calling agents, not answers for the user:
+            if not token.strip():
+                return
+            self._stream_tokens = not token.lstrip().startswith(('{', '`'))
+
+        if self._stream_tokens:
+            self.chat_stream.delta('agent', token)
 
     async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
         """Run when LLM ends running."""
+        if self._stream_tokens:
+            await self.chat_stream.done('agent')
+        self._stream_tokens = None
 
     async def on_llm_error(
             self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
@@ -104,7 +122,7 @@ class ChatCallbackHandler(AsyncCallbackHandler):
         error_message = ', '.join(error.args)
         message = f"Failed because:\n'{error_message}'\nException: '{error_type}'\n"
         resp = ChatResponse(sender="agent", message=message, type="error")
-        asyncio.run(self.websocket.send_json(resp.dict()))
+        await self.chat_stream.send(resp)
 
         if self.notebook:
             self.notebook.add_markdown_cell("### Omega:\n"+
@@ -130,7 +148,7 @@ class ChatCallbackHandler(AsyncCallbackHandler):
         #     message += f"\n {action.log}"
 
         resp = ChatResponse(sender="agent", message=message, type="action")
-        await self.websocket.send_json(resp.dict())
+        await self.chat_stream.send(resp)
 
         if self.notebook:
             self.notebook.add_markdown_cell("### Omega:\n"+
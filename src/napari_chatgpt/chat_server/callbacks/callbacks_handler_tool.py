@@ -6,7 +6,7 @@ from langchain.schema import AgentFinish, AgentAction, LLMResult
 from starlette.websockets import WebSocket
 
 from napari_chatgpt.chat_server.chat_response import ChatResponse
-from napari_chatgpt.utils.async_utils.run_async import run_async
+from napari_chatgpt.chat_server.chat_stream import ChatStream
 from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
 
 
@@ -16,31 +16,40 @@ class ToolCallbackHandler(BaseCallbackHandler):
     def __init__(self,
                  websocket: WebSocket,
                  notebook: JupyterNotebookFile,
+                 chat_stream: ChatStream = None,
                  verbose: bool = False):
         self.websocket = websocket
+        self.chat_stream: ChatStream = chat_stream or ChatStream(websocket)
         self.notebook = notebook
         self.verbose = verbose
         self.last_internal_tool_response = None
 
-    async def on_llm_start(
+    def on_llm_start(
             self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
     ) -> Any:
         """Run when LLM starts running."""
         pass
 
-    async def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
         """Run on new LLM token. Only available when streaming is enabled."""
-        pass
+        # Called from the tool's thread, tokens are buffered and sent from the server's event loop:
+        self.chat_stream.delta('tool', token)
 
-    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
         """Run when LLM ends running."""
-        pass
+        self.chat_stream.done_threadsafe('tool', wait=False)
 
-    async def on_llm_error(
+    def on_llm_error(
             self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
     ) -> Any:
         """Run when LLM errors."""
-        pass
+        self.chat_stream.done_threadsafe('tool', wait=False)
+
+    def on_tool_phase(self, tool_name: str, phase: str):
+        """Run when a tool enters a new phase, for example: 'generating_code', 'preparing_code', or 'executing'."""
+        if self.verbose:
+            aprint(f"TOOL on_tool_phase: tool_name={tool_name}, phase={phase}")
+        self.chat_stream.tool_phase_threadsafe(tool_name, phase)
 
     def on_chain_start(
             self, serialized: Dict[str, Any], inputs: Dict[str, Any],
@@ -60,7 +69,7 @@ class ToolCallbackHandler(BaseCallbackHandler):
         resp = ChatResponse(sender="agent",
                             message=tool_response,
                             type="tool_result")
-        run_async(self.websocket.send_json, resp.dict())
+        self.chat_stream.send_threadsafe(resp)
 
         if self.notebook:
             self.notebook.add_markdown_cell("### Omega:\n"+
@@ -96,14 +105,14 @@ class ToolCallbackHandler(BaseCallbackHandler):
             aprint(f"TOOL on_tool_end: {output}")
         if output.startswith('Error:') or 'Failure' in output:
             resp = ChatResponse(sender="agent", message=output, type="error")
-            run_async(self.websocket.send_json, resp.dict())
+            self.chat_stream.send_threadsafe(resp)
             if self.notebook:
                 self.notebook.add_markdown_cell("### Omega:\n" +
                                                 "Error:\n" +
                                                 output)
         else:
             resp = ChatResponse(sender="agent", message=output, type="tool_result")
-            run_async(self.websocket.send_json, resp.dict())
+            self.chat_stream.send_threadsafe(resp)
             if self.notebook:
                 self.notebook.add_markdown_cell("### Omega:\n" +
                                                 "Tool result:\n" +
@@ -120,7 +129,7 @@ class ToolCallbackHandler(BaseCallbackHandler):
         error_message = ', '.join(error.args)
         message = f"Failed because:\n'{error_message}'\nException: '{error_type}'\n"
         resp = ChatResponse(sender="agent", message=message, type="error")
-        run_async(self.websocket.send_json, resp.dict())
+        self.chat_stream.send_threadsafe(resp)
         if self.notebook:
             self.notebook.add_markdown_cell("### Omega:\n" +
                                             "Error:\n" +
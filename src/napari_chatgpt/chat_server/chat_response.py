@@ -10,8 +10,12 @@ class ChatResponse:
     message: str = ''
     type: str = ''
 
+    # Name of the stream for 'delta', 'tool_phase', and 'done' messages, see ChatStream:
+    stream: str = ''
+
     def dict(self):
         return {'sender': self.sender,
                 'message': self.message,
-                'type': self.type
+                'type': self.type,
+                'stream': self.stream
                 }
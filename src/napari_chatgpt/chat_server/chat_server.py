@@ -1,17 +1,17 @@
 """Main entrypoint for the app."""
+import asyncio
 import os
 import traceback
 import webbrowser
 from threading import Thread
 from time import sleep
+from typing import Dict
 
 import napari
 from arbol import aprint, asection
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.templating import Jinja2Templates
-from langchain.memory import ConversationTokenBufferMemory, \
-    ConversationBufferMemory
-from langchain.schema import get_buffer_string, BaseMemory
+from langchain.schema import get_buffer_string
 from qtpy.QtCore import QTimer
 from starlette.staticfiles import StaticFiles
 from uvicorn import Config, Server
@@ -23,14 +23,17 @@ from napari_chatgpt.chat_server.callbacks.callbacks_handle_chat import \
 from napari_chatgpt.chat_server.callbacks.callbacks_handler_tool import \
     ToolCallbackHandler
 from napari_chatgpt.chat_server.chat_response import ChatResponse
-from napari_chatgpt.llm.llms import instantiate_LLMs
-from napari_chatgpt.omega.memory.memory import OmegaMemory
-from napari_chatgpt.omega.napari_bridge import NapariBridge, _set_viewer_info
-from napari_chatgpt.omega.omega_init import initialize_omega_agent
+from napari_chatgpt.chat_server.chat_stream import ChatStream
+from napari_chatgpt.omega.memory.long_term_memory import LongTermMemory, \
+    default_long_term_memory_path
+from napari_chatgpt.omega.napari_bridge import NapariBridge
+from napari_chatgpt.omega.omega_agent_factory import OmegaAgentFactory
+from napari_chatgpt.omega.omega_session import OmegaSession
 from napari_chatgpt.utils.api_keys.api_key import set_api_key
 from napari_chatgpt.utils.configuration.app_configuration import \
     AppConfiguration
-from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
+from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile, \
+    flush_notebook_writes
 from napari_chatgpt.utils.openai.default_model import \
     get_default_openai_model_name
 from napari_chatgpt.utils.python.installed_packages import is_package_installed
@@ -40,7 +43,7 @@ class NapariChatServer:
     def __init__(self,
                  notebook: JupyterNotebookFile,
                  napari_bridge: NapariBridge,
-                 main_llm_model_name: str = get_default_openai_model_name(),
+                 main_llm_model_name: str = None,
                  tool_llm_model_name: str = None,
                  temperature: float = 0.01,
                  tool_temperature: float = 0.01,
@@ -55,16 +58,25 @@ class NapariChatServer:
                  verbose: bool = False
                  ):
 
+        # Default model, resolved here and not at import time as this requires a network request:
+        main_llm_model_name = main_llm_model_name or get_default_openai_model_name()
+
+        # Verbosity:
+        self.verbose = verbose
+
         # Flag to keep server running, or stop it:
         self.running = True
         self.uvicorn_server = None
 
-        # Notebook:
+        # Notebook, each session records its chat in its own notebook spawned from it:
         self.notebook: JupyterNotebookFile = notebook
 
         # Napari bridge:
         self.napari_bridge: NapariBridge = napari_bridge
 
+        # Active chat sessions, one per websocket connection, keyed by session ID:
+        self.sessions: Dict[str, OmegaSession] = {}
+
         # Instantiate FastAPI:
         self.app = FastAPI()
 
@@ -87,10 +99,39 @@ class NapariChatServer:
         # Load Jinja2 templates:
         templates = Jinja2Templates(directory=templates_files_path)
 
+        # Long-term memory of past conversations, generated code, and tool outputs, shared by all sessions.
+        # Opt-in, as everything is persisted to: ~/.omega/long_term_memory/long_term_memory.jsonl
+        # Enable it by setting 'long_term_memory: true' in the 'omega' configuration file,
+        # and clear it with a DELETE request to the '/long_term_memory' path:
+        self.long_term_memory = LongTermMemory(default_long_term_memory_path(),
+                                               max_items=config.get('long_term_memory_max_items', 10000)) \
+            if config.get('long_term_memory', False) else None
+
+        # Agent factory, LLMs and tools are built once and shared by all sessions:
+        self.agent_factory = OmegaAgentFactory(
+            napari_bridge=napari_bridge,
+            # Tools are bound to the notebook of each session:
+            notebook=None,
+            main_llm_model_name=main_llm_model_name,
+            tool_llm_model_name=tool_llm_model_name,
+            temperature=temperature,
+            tool_temperature=tool_temperature,
+            memory_type=memory_type,
+            agent_personality=agent_personality,
+            fix_imports=fix_imports,
+            install_missing_packages=install_missing_packages,
+            fix_bad_calls=fix_bad_calls,
+            autofix_mistakes=autofix_mistakes,
+            autofix_widget=autofix_widget,
+            be_didactic=be_didactic,
+            long_term_memory=self.long_term_memory,
+            verbose=verbose)
+
         # Server startup event:
         @self.app.on_event("startup")
         async def startup_event():
-            pass
+            # Build LLMs and tools in the background, ready for the first connection:
+            self.agent_factory.start_prebuild()
 
         # Default path:
         @self.app.get("/")
@@ -98,150 +139,164 @@ class NapariChatServer:
             return templates.TemplateResponse("index.html",
                                               {"request": request})
 
+        # Sessions path, reports the active sessions and their napari request queue metrics:
+        @self.app.get("/sessions")
+        async def get_sessions():
+            return self.session_metrics()
+
+        # Long-term memory path, forgets all items and deletes the memory's file:
+        @self.app.delete("/long_term_memory")
+        async def clear_long_term_memory():
+            if self.long_term_memory is None:
+                return {'cleared': False}
+            self.long_term_memory.clear()
+            aprint("Long-term memory cleared.")
+            return {'cleared': True}
+
         # Chat path:
         @self.app.websocket("/chat")
         async def websocket_endpoint(websocket: WebSocket):
             await websocket.accept()
 
-            # restart a notebook:
+            # New session for this connection, with its own notebook:
+            session = OmegaSession()
             if self.notebook:
-                self.notebook.restart()
-
-            # Chat callback handler:
-            chat_callback_handler = ChatCallbackHandler(websocket=websocket,
-                                                        notebook=self.notebook,
-                                                        verbose=verbose)
-
-            # Tool callback handler:
-            tool_callback_handler = ToolCallbackHandler(websocket=websocket,
-                                                        notebook=self.notebook,
-                                                        verbose=verbose)
-
-            # Memory callback handler:
-            memory_callback_handler = ArbolCallbackHandler('Memory')
-
-            main_llm, memory_llm, tool_llm, max_token_limit = instantiate_LLMs(
-                main_llm_model_name=main_llm_model_name,
-                tool_llm_model_name=tool_llm_model_name,
-                temperature=temperature,
-                tool_temperature=tool_temperature,
-                chat_callback_handler=chat_callback_handler,
-                tool_callback_handler=tool_callback_handler,
-                memory_callback_handler=memory_callback_handler
-            )
-
-            # Instantiate Memory:
-            memory: BaseMemory = None
-            if memory_type == 'bounded':
-                memory = ConversationTokenBufferMemory(
-                    memory_key="chat_history",
-                    return_messages=True,
-                    max_token_limit=max_token_limit)
-            elif memory_type == 'infinite':
-                memory = ConversationBufferMemory(
-                    memory_key="chat_history",
-                    return_messages=True)
-            elif memory_type == 'hybrid':
-                memory = OmegaMemory(
-                    llm=memory_llm,
-                    memory_key="chat_history",
-                    return_messages=True,
-                    max_token_limit=max_token_limit)
-            else:
-                raise ValueError('Invalid Memory parameter!')
-
-            # Agent
-            agent_chain = initialize_omega_agent(
-                to_napari_queue=napari_bridge.to_napari_queue,
-                from_napari_queue=napari_bridge.from_napari_queue,
-                main_llm_model_name=main_llm_model_name,
-                main_llm=main_llm,
-                tool_llm=tool_llm,
-                is_async=True,
+                session.notebook = self.notebook.spawn(name=f'omega_notebook_{session.session_id}')
+            self.sessions[session.session_id] = session
+            aprint(f"New chat session: {session.session_id} ({len(self.sessions)} active sessions)")
+
+            try:
+                await self._chat_loop(websocket, session)
+            finally:
+                # Forget the session:
+                self.sessions.pop(session.session_id, None)
+                if session.notebook and session.notebook.notebook.cells:
+                    session.notebook.write()
+                if self.napari_bridge:
+                    self.napari_bridge.end_session(session.session_id)
+                aprint(f"Chat session ended: {session.session_id} ({len(self.sessions)} active sessions)")
+
+    async def _chat_loop(self, websocket: WebSocket, session: OmegaSession):
+
+        verbose = self.verbose
+
+        # Notebook of this session:
+        notebook = session.notebook
+
+        # All messages to the client go through the chat stream, which preserves their order
+        # and buffers the tokens streamed by the LLMs:
+        chat_stream = ChatStream(websocket)
+
+        # Chat callback handler:
+        chat_callback_handler = ChatCallbackHandler(websocket=websocket,
+                                                    notebook=notebook,
+                                                    chat_stream=chat_stream,
+                                                    verbose=verbose)
+
+        # Tool callback handler:
+        tool_callback_handler = ToolCallbackHandler(websocket=websocket,
+                                                    notebook=notebook,
+                                                    chat_stream=chat_stream,
+                                                    verbose=verbose)
+
+        # Memory callback handler:
+        memory_callback_handler = ArbolCallbackHandler('Memory')
+
+        # Agent, bound to this session's callback handlers, with its own memory.
+        # Created off the event loop, as it waits for the prebuild if still in progress:
+        agent_chain = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: self.agent_factory.create_agent(
                 chat_callback_handler=chat_callback_handler,
                 tool_callback_handler=tool_callback_handler,
-                notebook=self.notebook,
-                has_human_input_tool=False,
-                memory=memory,
-                agent_personality=agent_personality,
-                fix_imports=fix_imports,
-                install_missing_packages=install_missing_packages,
-                fix_bad_calls=fix_bad_calls,
-                autofix_mistakes=autofix_mistakes,
-                autofix_widget=autofix_widget,
-                be_didactic=be_didactic,
-                verbose=verbose
-            )
-
-            dialog_counter = 0
-
-            # Dialog Loop:
-            while True:
-                with asection(f"Dialog iteration {dialog_counter}:"):
-                    try:
-                        # Receive and send back the client message
-                        question = await websocket.receive_text()
-                        resp = ChatResponse(sender="user",
-                                            message=question)
-                        await websocket.send_json(resp.dict())
-                        if self.notebook:
-                            self.notebook.add_markdown_cell("### User:\n" + question)
-
-                        aprint(f"Human Question/Request:\n{question}\n\n")
-
-                        # Initiates a response -- empty for now:
-                        start_resp = ChatResponse(sender="agent",
-                                                  type="start")
-                        await websocket.send_json(start_resp.dict())
-
-                        # get napari viewer info::
-                        viewer_info = self.napari_bridge.get_viewer_info()
-                        _set_viewer_info(viewer_info)
-
-                        # call LLM:
-                        result = await agent_chain.ainvoke(question)
-
-                        aprint(
-                            f"Agent response:\n{result['chat_history'][-1]}\n\n")
-
-                        # finalise agent response:
-                        end_resp = ChatResponse(sender="agent",
-                                                message=result['output'],
-                                                type="final")
-                        await websocket.send_json(end_resp.dict())
-
-                        if self.notebook:
-                            # Add agent response to notebook:
-                            self.notebook.add_markdown_cell("### Omega:\n" + result['output'])
-
-                            # Add snapshot to notebook:
-                            self.notebook.take_snapshot()
-
-                            # write notebook:
-                            self.notebook.write()
-
-                        # Current chat history:
-                        current_chat_history = get_buffer_string(
-                            result['chat_history'])
-
-                        with asection(
-                                f"Current chat history of {len(result['chat_history'])} messages:"):
-                            aprint(current_chat_history)
-
-
-                    except WebSocketDisconnect:
-                        aprint("websocket disconnect")
-                        break
-
-                    except Exception as e:
-                        traceback.print_exc()
-                        resp = ChatResponse(
-                            sender="agent",
-                            message=f"Sorry, something went wrong ({type(e).__name__}: {str(e)}).",
-                            type="error",
-                        )
-                        await websocket.send_json(resp.dict())
-                dialog_counter += 1
+                memory_callback_handler=memory_callback_handler,
+                session=session
+            ))
+
+        dialog_counter = 0
+
+        # Dialog Loop:
+        while True:
+            with asection(f"Dialog iteration {dialog_counter}:"):
+                try:
+                    # Receive and send back the client message
+                    question = await websocket.receive_text()
+                    resp = ChatResponse(sender="user",
+                                        message=question)
+                    await chat_stream.send(resp)
+                    if notebook:
+                        notebook.add_markdown_cell("### User:\n" + question)
+
+                    aprint(f"Human Question/Request:\n{question}\n\n")
+
+                    # Initiates a response -- empty for now:
+                    start_resp = ChatResponse(sender="agent",
+                                              type="start")
+                    await chat_stream.send(start_resp)
+
+                    session.touch()
+
+                    # get napari viewer info for this session without blocking the event loop:
+                    session.viewer_info = await self.napari_bridge.aget_viewer_info(session_id=session.session_id)
+
+                    # call LLM:
+                    result = await agent_chain.ainvoke(question)
+
+                    aprint(
+                        f"Agent response:\n{result['chat_history'][-1]}\n\n")
+
+                    # finalise agent response:
+                    end_resp = ChatResponse(sender="agent",
+                                            message=result['output'],
+                                            type="final")
+                    await chat_stream.send(end_resp)
+
+                    if notebook:
+                        # Add agent response to notebook:
+                        notebook.add_markdown_cell("### Omega:\n" + result['output'])
+
+                        # Add snapshot to notebook, without blocking the event loop while the viewer is grabbed:
+                        await asyncio.get_running_loop().run_in_executor(None, notebook.take_snapshot)
+
+                        # write notebook, in the background:
+                        notebook.write()
+
+                    # Current chat history:
+                    current_chat_history = get_buffer_string(
+                        result['chat_history'])
+
+                    with asection(
+                            f"Current chat history of {len(result['chat_history'])} messages:"):
+                        aprint(current_chat_history)
+
+                    aprint(f"Napari request queue metrics for session {session.session_id}: "
+                           f"{self.napari_bridge.session_metrics().get(session.session_id)}")
+
+
+                except WebSocketDisconnect:
+                    aprint("websocket disconnect")
+                    break
+
+                except Exception as e:
+                    traceback.print_exc()
+                    resp = ChatResponse(
+                        sender="agent",
+                        message=f"Sorry, something went wrong ({type(e).__name__}: {str(e)}).",
+                        type="error",
+                    )
+                    await chat_stream.send(resp)
+            dialog_counter += 1
+
+    def session_metrics(self) -> Dict[str, Dict]:
+        """
+        Returns, for each active session, its napari request queue metrics:
+        current and maximal queue depth, number of requests, and time waited for napari's QT thread.
+        """
+        queue_metrics = self.napari_bridge.session_metrics() if self.napari_bridge else {}
+        return {session_id: dict(created=session.created,
+                                 last_activity=session.last_activity,
+                                 **queue_metrics.get(session_id, {}))
+                for session_id, session in list(self.sessions.items())}
 
     def _start_uvicorn_server(self, app):
         config = Config(app, port=self.port)
@@ -255,11 +310,19 @@ class NapariChatServer:
         self.running = False
         if self.uvicorn_server:
             self.uvicorn_server.should_exit = True
+        if self.napari_bridge:
+            self.napari_bridge.stop()
+        if self.notebook:
+            # Write the notebooks of active sessions, and wait for all notebooks to be written:
+            for session in list(self.sessions.values()):
+                if session.notebook and session.notebook.notebook.cells:
+                    session.notebook.write()
+            flush_notebook_writes(timeout=10)
         sleep(2)
 
 
 def start_chat_server(viewer: napari.Viewer = None,
-                      main_llm_model_name: str = get_default_openai_model_name(),
+                      main_llm_model_name: str = None,
                       tool_llm_model_name: str = None,
                       temperature: float = 0.01,
                       tool_temperature: float = 0.01,
@@ -280,6 +343,10 @@ def start_chat_server(viewer: napari.Viewer = None,
         # get configuration:
         config = AppConfiguration('omega')
 
+        # Default models, resolved here and not at import time as this requires a network request:
+        main_llm_model_name = main_llm_model_name or get_default_openai_model_name()
+        tool_llm_model_name = tool_llm_model_name or main_llm_model_name
+
         # Set OpenAI key if necessary:
         if ('gpt' in main_llm_model_name or 'gpt' in tool_llm_model_name )and is_package_installed(
                 'openai'):
@@ -0,0 +1,147 @@
+"""Streaming of chat messages to the websocket."""
+import asyncio
+import threading
+from concurrent.futures import TimeoutError
+from typing import Dict, List, Optional
+
+from arbol import aprint
+from starlette.websockets import WebSocket
+
+from napari_chatgpt.chat_server.chat_response import ChatResponse
+
+
+class ChatStream:
+    """
+    Sends chat messages to a websocket, from the server's event loop or from any other thread.
+
+    Besides regular messages, the stream carries three message types:
+    - 'delta': a chunk of text generated by a LLM, to be appended to the text already received for the same stream,
+    - 'tool_phase': the phase a tool is in, for example: 'generating_code', 'preparing_code', or 'executing',
+    - 'done': the LLM generating text for the given stream is done.
+    Streams are named, 'agent' for the agent's answer and 'tool' for the code generated by tools.
+
+    Tokens are not sent one by one: they are buffered and coalesced into 'delta' messages that
+    are flushed at most every flush interval. While a send is in progress, for example because the client is slow,
+    new tokens accumulate in the buffer instead of piling up as queued messages.
+    Message order is preserved: pending deltas are always flushed before any other message.
+    """
+
+    def __init__(self,
+                 websocket: WebSocket,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 flush_interval: float = 0.05,
+                 send_timeout: float = 10.0):
+        """
+        Parameters
+        ----------
+        websocket : WebSocket
+            Websocket to send messages to.
+        loop : Optional[asyncio.AbstractEventLoop]
+            Event loop of the websocket, by default the running loop.
+        flush_interval : float
+            Maximal delay in seconds before buffered tokens are sent.
+        send_timeout : float
+            Timeout in seconds when waiting for messages sent from other threads.
+        """
+        self.websocket = websocket
+        self.loop = loop or asyncio.get_running_loop()
+        self.flush_interval = flush_interval
+        self.send_timeout = send_timeout
+
+        # Set once the websocket is closed, nothing is sent after that:
+        self.closed = False
+
+        # Pending tokens per stream, shared across threads:
+        self._buffers: Dict[str, List[str]] = {}
+        self._buffers_lock = threading.Lock()
+        self._flush_scheduled = False
+
+        # Serialises sends on the event loop:
+        self._send_lock = asyncio.Lock()
+
+    def delta(self, stream: str, token: str):
+        """
+        Buffers a token for the given stream, can be called from any thread and never blocks.
+        """
+        if not token or self.closed:
+            return
+
+        with self._buffers_lock:
+            self._buffers.setdefault(stream, []).append(token)
+            schedule_flush = not self._flush_scheduled
+            self._flush_scheduled = True
+
+        if schedule_flush:
+            self.loop.call_soon_threadsafe(self._schedule_flush)
+
+    async def send(self, response: ChatResponse):
+        """
+        Sends a message, after all pending deltas.
+        """
+        async with self._send_lock:
+            await self._send_pending_deltas()
+            await self._send_json(response)
+
+    async def flush(self):
+        """
+        Sends all pending deltas.
+        """
+        async with self._send_lock:
+            await self._send_pending_deltas()
+
+    async def done(self, stream: str):
+        await self.send(ChatResponse(sender='agent', type='done', stream=stream))
+
+    async def tool_phase(self, tool_name: str, phase: str):
+        await self.send(ChatResponse(sender='agent', type='tool_phase', stream='tool', message=f'{tool_name}:{phase}'))
+
+    def send_threadsafe(self, response: ChatResponse, wait: bool = True):
+        """
+        Sends a message from any thread. Waits until it is sent, unless wait is False
+        or when called from the event loop's thread.
+        """
+        if self.closed:
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self.send(response), self.loop)
+
+        if wait and not self._in_loop_thread():
+            try:
+                future.result(timeout=self.send_timeout)
+            except TimeoutError:
+                aprint(f"Timeout while sending message of type '{response.type}' to chat client.")
+
+    def done_threadsafe(self, stream: str, wait: bool = True):
+        self.send_threadsafe(ChatResponse(sender='agent', type='done', stream=stream), wait=wait)
+
+    def tool_phase_threadsafe(self, tool_name: str, phase: str, wait: bool = False):
+        self.send_threadsafe(ChatResponse(sender='agent', type='tool_phase', stream='tool', message=f'{tool_name}:{phase}'), wait=wait)
+
+    def _schedule_flush(self):
+        # Coalesces the tokens received during the flush interval:
+        self.loop.call_later(self.flush_interval, lambda: self.loop.create_task(self.flush()))
+
+    async def _send_pending_deltas(self):
+        with self._buffers_lock:
+            buffers = self._buffers
+            self._buffers = {}
+            self._flush_scheduled = False
+
+        for stream, tokens in buffers.items():
+            await self._send_json(ChatResponse(sender='agent', type='delta', stream=stream, message=''.join(tokens)))
+
+    async def _send_json(self, response: ChatResponse):
+        if self.closed:
+            return
+        try:
+            await self.websocket.send_json(response.dict())
+        except Exception as e:
+            # Websocket closed or broken, the chat loop handles the disconnection:
+            aprint(f"Could not send message to chat client: {type(e).__name__}: {e}")
+            self.closed = True
+
+    def _in_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
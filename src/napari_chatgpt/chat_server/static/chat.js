@@ -57,6 +57,78 @@ var ws = new WebSocket(endpoint);
 // Default subtitle:
 default_subtitle = " Ask a question, ask for a widget, ask to process images, or control the napari viewer ! ";
 
+// Text streamed by the agent ('agent') and by tools ('tool'), keyed by stream name:
+var streams = {};
+
+// Last agent message rendered from streamed text, the final response replaces it:
+var last_streamed_agent_message = null;
+
+// Subtitles for the phases of tools:
+var tool_phase_subtitles = {
+    "generating_code": "Writing code... please wait!",
+    "preparing_code": "Checking code... please wait!",
+    "computing": "Computing... please wait!",
+    "executing": "Running in napari... please wait!"
+};
+
+// Creates a new server message entry and returns its paragraph:
+function new_server_message(messages, className)
+{
+    var div = document.createElement('div');
+    div.className = className;
+    var p = document.createElement('p');
+    div.appendChild(p);
+    messages.appendChild(div);
+    return p;
+}
+
+// Renders streamed text, at most once per animation frame:
+function render_stream(stream)
+{
+    if (stream.render_scheduled) {
+        return;
+    }
+    stream.render_scheduled = true;
+    window.requestAnimationFrame(function () {
+        stream.render_scheduled = false;
+        stream.render();
+        var messages = document.getElementById('messages');
+        messages.scrollTop = messages.scrollHeight;
+    });
+}
+
+// Appends a delta to a stream, creating the stream's element if needed:
+function append_delta(messages, name, text)
+{
+    var stream = streams[name];
+    if (!stream)
+    {
+        if (name === "agent")
+        {
+            var p = new_server_message(messages, 'server-message');
+            stream = {element: p, text: '', render_scheduled: false};
+            stream.render = function () {
+                this.element.innerHTML = "<strong>" + "Omega: " + "</strong>" + parse_markdown(this.text);
+            };
+        }
+        else
+        {
+            // Tool output is shown as raw text below the last message, until the tool is done:
+            var pre = document.createElement('pre');
+            pre.className = 'stream-preview';
+            var parent = messages.lastChild ? messages.lastChild : messages;
+            parent.appendChild(pre);
+            stream = {element: pre, text: '', render_scheduled: false};
+            stream.render = function () {
+                this.element.textContent = this.text;
+            };
+        }
+        streams[name] = stream;
+    }
+    stream.text += text;
+    render_stream(stream);
+}
+
 // Receive message from server and process it:
 ws.onmessage = function (event)
 {
@@ -67,6 +139,13 @@ ws.onmessage = function (event)
     // JSON parsingof message data:
     var data = JSON.parse(event.data);
 
+    // Streamed text is handled without logging, there are many such messages:
+    if (data.type === "delta")
+    {
+        append_delta(messages, data.stream, data.message);
+        return;
+    }
+
     // Log event on the console for debugging:
     console.log("__________________________________________________________________");
     console.log("data.sender ="+data.sender+'\n');
@@ -83,6 +162,36 @@ ws.onmessage = function (event)
             var header = document.getElementById('header');
             header.innerHTML = "Thinking... please wait!";
 
+            // New response, nothing streamed yet:
+            streams = {};
+            last_streamed_agent_message = null;
+        }
+        // A stream is done:
+        else if (data.type === "done")
+        {
+            var stream = streams[data.stream];
+            if (stream)
+            {
+                if (data.stream === "agent")
+                {
+                    // Render the complete text, the final response will replace it:
+                    stream.render();
+                    last_streamed_agent_message = stream.element;
+                }
+                else
+                {
+                    // The tool result is sent separately, the preview is not needed anymore:
+                    stream.element.remove();
+                }
+                delete streams[data.stream];
+            }
+        }
+        // A tool entered a new phase:
+        else if (data.type === "tool_phase")
+        {
+            var phase = data.message.split(':').pop();
+            var header = document.getElementById('header');
+            header.innerHTML = tool_phase_subtitles[phase] || "Using a tool... please wait!";
         }
         // agent is typing:
         else if (data.type === "typing")
@@ -147,17 +256,13 @@ ws.onmessage = function (event)
         // end message, this is sent once the agent has a final response:
         else if (data.type === "final")
         {
-            // Create a new message entry:
-            var div = document.createElement('div');
-            div.className = 'server-message';
-            var p = document.createElement('p');
-
-            // Add message to message list:
-            div.appendChild(p);
-            messages.appendChild(div);
-
-            // Current (last) message:
-            var p = messages.lastChild.lastChild;
+            // Reuse the message of the streamed answer if there is one, otherwise create a new message entry:
+            var p = last_streamed_agent_message;
+            if (!p)
+            {
+                p = new_server_message(messages, 'server-message');
+            }
+            last_streamed_agent_message = null;
 
             // Set background color:
             p.parentElement.className = 'server-message';
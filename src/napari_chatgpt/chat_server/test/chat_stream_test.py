@@ -0,0 +1,46 @@
+import asyncio
+from threading import Thread
+
+from napari_chatgpt.chat_server.chat_response import ChatResponse
+from napari_chatgpt.chat_server.chat_stream import ChatStream
+
+
+class _SlowWebSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_json(self, data):
+        # Slow client:
+        await asyncio.sleep(0.01)
+        self.messages.append(data)
+
+
+def test_chat_stream_coalesces_deltas_and_preserves_order():
+
+    async def _test():
+        websocket = _SlowWebSocket()
+        chat_stream = ChatStream(websocket, flush_interval=0.02)
+
+        # Tokens from the event loop, and from another thread:
+        for i in range(100):
+            chat_stream.delta('agent', f'{i} ')
+        thread = Thread(target=lambda: [chat_stream.delta('tool', 'x') for _ in range(1000)])
+        thread.start()
+        thread.join()
+
+        await chat_stream.done('agent')
+        await chat_stream.send(ChatResponse(sender='agent', type='final', message='answer'))
+        return websocket.messages
+
+    messages = asyncio.run(_test())
+
+    deltas = [m for m in messages if m['type'] == 'delta']
+    assert ''.join(m['message'] for m in deltas if m['stream'] == 'agent') == ''.join(f'{i} ' for i in range(100))
+    assert ''.join(m['message'] for m in deltas if m['stream'] == 'tool') == 'x' * 1000
+
+    # Tokens are coalesced, not sent one by one:
+    assert len(deltas) < 10
+
+    # Deltas are sent before the messages that follow them:
+    assert [m['type'] for m in messages[-2:]] == ['done', 'final']
+    assert messages[-2]['stream'] == 'agent'
@@ -33,6 +33,14 @@ def instantiate_LLMs(main_llm_model_name: str,
     return main_llm, memory_llm, tool_llm, max_token_limit
 
 
+def bind_llm_callbacks(llm, callback_handler):
+    """
+    Returns a shallow copy of the LLM that uses the given callback handler.
+    The copy shares the LLM's client, this is much cheaper than instantiating a new LLM.
+    """
+    return llm.copy(update={'callbacks': [callback_handler] if callback_handler else None})
+
+
 def _instantiate_single_llm(llm_model_name: str,
                             verbose: bool = False,
                             temperature: float = 0.0,
@@ -53,7 +61,7 @@ def _instantiate_single_llm(llm_model_name: str,
             verbose=verbose,
             streaming=streaming,
             temperature=temperature,
-            callbacks=[callback_handler]
+            callbacks=[callback_handler] if callback_handler else None
         )
 
         max_token_limit = openai_max_token_limit(llm_model_name)
@@ -81,7 +89,7 @@ def _instantiate_single_llm(llm_model_name: str,
             streaming=streaming,
             temperature=temperature,
             max_tokens_to_sample=max_tokens_to_sample,
-            callbacks=[callback_handler])
+            callbacks=[callback_handler] if callback_handler else None)
 
         return llm, max_token_limit
 
@@ -125,7 +133,7 @@ def _instantiate_single_llm(llm_model_name: str,
             verbose=verbose,
             #streaming=streaming,
             temperature=temperature,
-            callbacks=[callback_handler]
+            callbacks=[callback_handler] if callback_handler else None
         )
 
         return llm, max_token_limit
@@ -0,0 +1,242 @@
+import json
+import math
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from arbol import aprint
+
+# Words that are too common to help retrieval:
+_stop_words = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from', 'have', 'i', 'if',
+               'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'please', 'so', 'that', 'the', 'this', 'to',
+               'was', 'we', 'what', 'with', 'you', 'your'}
+
+
+class LongTermMemory:
+    """
+    Long-term memory of past conversation turns, generated code, and tool outputs,
+    searchable with the BM25 ranking function, which runs offline and needs no embedding model.
+
+    Items are appended to a JSON lines file, so that adding an item never rewrites the whole memory,
+    and the index is rebuilt in memory when the file is loaded. Only the most recent items are kept.
+    """
+
+    def __init__(self,
+                 file_path: Optional[str] = None,
+                 max_items: int = 10000,
+                 k1: float = 1.5,
+                 b: float = 0.75):
+        """
+        Parameters
+        ----------
+        file_path : Optional[str]
+            Path of the file in which items are persisted, None for a memory that is not persisted.
+        max_items : int
+            Maximum number of items kept, older items are forgotten.
+        k1 : float
+            BM25 term frequency saturation parameter.
+        b : float
+            BM25 document length normalisation parameter.
+        """
+        self.file_path = file_path
+        self.max_items = max_items
+        self.k1 = k1
+        self.b = b
+
+        self._lock = Lock()
+
+        # Items, and for each item its term frequencies and length in terms:
+        self._items: Dict[int, dict] = {}
+        self._term_frequencies: Dict[int, Counter] = {}
+        self._lengths: Dict[int, int] = {}
+
+        # Inverted index, term -> ids of items that contain it:
+        self._postings: Dict[str, set] = {}
+        self._total_length = 0
+        self._next_id = 0
+
+        if file_path and os.path.exists(file_path):
+            self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def add(self, kind: str, text: str, **metadata) -> Optional[int]:
+        """
+        Adds an item to the memory.
+
+        Parameters
+        ----------
+        kind : str
+            Kind of item, for example: 'turn', 'code', or 'tool_output'.
+        text : str
+            Text of the item, this is what is searched and returned.
+        metadata
+            Additional JSON serialisable information about the item.
+
+        Returns
+        -------
+        Optional[int]
+            ID of the item, None if the text is empty.
+        """
+        if not text or not text.strip():
+            return None
+
+        item = dict(kind=kind, text=text, time=time.time(), **metadata)
+
+        with self._lock:
+            item_id = self._index(item)
+            self._forget_oldest()
+
+            # Append to file:
+            if self.file_path:
+                try:
+                    os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+                    with open(self.file_path, 'a') as file:
+                        file.write(json.dumps(item) + '\n')
+                except Exception:
+                    traceback.print_exc()
+
+        return item_id
+
+    def search(self,
+               query: str,
+               k: int = 4,
+               kinds: Optional[List[str]] = None,
+               exclude: Optional[Callable[[dict], bool]] = None) -> List[Tuple[float, dict]]:
+        """
+        Returns the k items most relevant to the query, most relevant first, as (score, item) pairs.
+        Only items of the given kinds are returned if kinds is not None,
+        and items for which the exclude function returns True are skipped.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            number_of_items = len(self._items)
+            if number_of_items == 0:
+                return []
+            average_length = self._total_length / number_of_items
+
+            scores = Counter()
+            for term in terms:
+                item_ids = self._postings.get(term)
+                if not item_ids:
+                    continue
+                idf = math.log(1 + (number_of_items - len(item_ids) + 0.5) / (len(item_ids) + 0.5))
+                for item_id in item_ids:
+                    frequency = self._term_frequencies[item_id][term]
+                    normalisation = self.k1 * (1 - self.b + self.b * self._lengths[item_id] / average_length)
+                    scores[item_id] += idf * frequency * (self.k1 + 1) / (frequency + normalisation)
+
+            results = []
+            # Most relevant first, and most recent first for equal scores:
+            for item_id, score in sorted(scores.items(), key=lambda entry: (-entry[1], -entry[0])):
+                item = self._items[item_id]
+                if kinds is not None and item.get('kind') not in kinds:
+                    continue
+                if exclude is not None and exclude(item):
+                    continue
+                results.append((score, item))
+                if len(results) >= k:
+                    break
+
+            return results
+
+    def clear(self):
+        """
+        Forgets all items, and deletes the memory's file.
+        """
+        with self._lock:
+            self._items.clear()
+            self._term_frequencies.clear()
+            self._lengths.clear()
+            self._postings.clear()
+            self._total_length = 0
+            if self.file_path and os.path.exists(self.file_path):
+                os.remove(self.file_path)
+
+    def _index(self, item: dict) -> int:
+        item_id = self._next_id
+        self._next_id += 1
+
+        term_frequencies = Counter(tokenize(item['text']))
+        self._items[item_id] = item
+        self._term_frequencies[item_id] = term_frequencies
+        self._lengths[item_id] = sum(term_frequencies.values())
+        self._total_length += self._lengths[item_id]
+        for term in term_frequencies:
+            self._postings.setdefault(term, set()).add(item_id)
+
+        return item_id
+
+    def _forget_oldest(self):
+        # Item IDs increase with time, dictionaries keep insertion order:
+        while len(self._items) > self.max_items:
+            item_id = next(iter(self._items))
+            del self._items[item_id]
+            for term in self._term_frequencies.pop(item_id):
+                item_ids = self._postings[term]
+                item_ids.discard(item_id)
+                if not item_ids:
+                    del self._postings[term]
+            self._total_length -= self._lengths.pop(item_id)
+
+    def _load(self):
+        try:
+            with open(self.file_path) as file:
+                lines = file.readlines()
+
+            for line in lines:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written line, for example after a crash:
+                    continue
+                if not isinstance(item, dict) or not isinstance(item.get('text'), str):
+                    # Not an item, for example a file edited by hand:
+                    continue
+                self._index(item)
+
+            # Only the most recent items are kept:
+            self._forget_oldest()
+
+            aprint(f"Loaded {len(self._items)} items from long-term memory: {self.file_path}")
+
+            # Compact the file once it holds as many forgotten items as kept items:
+            if len(lines) > 2 * self.max_items:
+                self._rewrite()
+        except Exception:
+            traceback.print_exc()
+
+    def _rewrite(self):
+        with open(self.file_path, 'w') as file:
+            for item in self._items.values():
+                file.write(json.dumps(item) + '\n')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lower case terms, identifiers in code are split too: 'gaussian_filter' gives 'gaussian'
+    and 'filter', and 'StarDist' gives 'stardist', 'star', and 'dist'. Stop words are removed.
+    """
+    terms = []
+    for word in re.findall(r'[A-Za-z0-9]+', text):
+        terms.append(word.lower())
+
+        # Parts of camel case words:
+        parts = re.findall(r'[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])', word)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts)
+
+    return [term for term in terms if term not in _stop_words]
+
+
+def default_long_term_memory_path(name: str = 'long_term_memory') -> str:
+    return os.path.expanduser(os.path.join('~', '.omega', 'long_term_memory', f'{name}.jsonl'))
@@ -1,6 +1,12 @@
-from typing import Any, Dict, List
+import traceback
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from threading import Lock
+from typing import Any, Dict, List, Optional
 from typing import Type
 
+from arbol import aprint
+
 from langchain.chains import LLMChain
 from langchain.memory.chat_memory import BaseChatMemory
 from langchain.memory.prompt import SUMMARY_PROMPT
@@ -8,7 +14,7 @@ from langchain_core.language_models import BaseLanguageModel
 from langchain_core.messages import BaseMessage, get_buffer_string
 from langchain_core.messages import SystemMessage
 from langchain_core.prompts import BasePromptTemplate
-from langchain_core.pydantic_v1 import BaseModel, root_validator
+from langchain_core.pydantic_v1 import BaseModel, root_validator, PrivateAttr
 
 
 ###
@@ -16,6 +22,9 @@ from langchain_core.pydantic_v1 import BaseModel, root_validator
 ### LangChain's license is the MIT License
 ###
 
+# Thread pool for background summarization, shared by all memories:
+_summarization_thread_pool = ThreadPoolExecutor(thread_name_prefix='omega_memory_summarization')
+
 class SummarizerMixin(BaseModel):
     human_prefix: str = "Human"
     ai_prefix: str = "AI"
@@ -43,12 +52,35 @@ class SummarizerMixin(BaseModel):
 
 
 class OmegaMemory(BaseChatMemory, SummarizerMixin):
-    """Buffer with summarizer for storing conversation memory."""
+    """
+    Buffer with summarizer for storing conversation memory.
+
+    Messages pruned from the buffer are summarized in the background, so that saving the context
+    never waits for the memory LLM. Until the summary catches up, pruned messages that are not yet summarized
+    are kept after the summary.
+    """
 
     max_token_limit: int = 2000
     moving_summary_buffer: str = ""
     memory_key: str = "history"
 
+    # If False, pruned messages are summarized before save_context() returns:
+    background_summarization: bool = True
+
+    # Running sums of the token counts of the messages in the buffer, past pruned messages included,
+    # the token count of the buffer's messages i to j is: _token_prefix_sums[j] - _token_prefix_sums[i-1]:
+    _token_prefix_sums: List[int] = PrivateAttr(default_factory=list)
+    # Running sum of the token counts of the pruned messages:
+    _pruned_tokens: int = PrivateAttr(default=0)
+
+    # Pruned messages that are not yet summarized:
+    _pending_messages: List[BaseMessage] = PrivateAttr(default_factory=list)
+    # Background summarization in progress, if any:
+    _summarization_future: Optional[Future] = PrivateAttr(default=None)
+    # Incremented when the memory is cleared, summaries of a previous generation are discarded:
+    _generation: int = PrivateAttr(default=0)
+    _summary_lock: Lock = PrivateAttr(default_factory=Lock)
+
     @property
     def buffer(self) -> List[BaseMessage]:
         return self.chat_memory.messages
@@ -63,10 +95,13 @@ class OmegaMemory(BaseChatMemory, SummarizerMixin):
 
     def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
         """Return history buffer."""
-        buffer = self.buffer
-        if self.moving_summary_buffer != "":
+        # Latest summary, followed by the pruned messages it does not cover yet:
+        with self._summary_lock:
+            moving_summary_buffer = self.moving_summary_buffer
+            buffer = self._pending_messages + self.buffer
+        if moving_summary_buffer != "":
             first_messages: List[BaseMessage] = [
-                self.summary_message_cls(content=self.moving_summary_buffer)
+                self.summary_message_cls(content=moving_summary_buffer)
             ]
             buffer = first_messages + buffer
         if self.return_messages:
@@ -95,21 +130,115 @@ class OmegaMemory(BaseChatMemory, SummarizerMixin):
         super().save_context(inputs, outputs)
         self.prune()
 
+    @property
+    def num_tokens(self) -> int:
+        """Number of tokens in the buffer, without the summary."""
+        self._update_token_counts()
+        return self._buffer_tokens()
+
     def prune(self) -> None:
         """Prune buffer if it exceeds max token limit"""
-        buffer = self.chat_memory.messages
-        curr_buffer_length = self.llm.get_num_tokens_from_messages(buffer)
-        if curr_buffer_length > self.max_token_limit:
-            pruned_memory = []
-            while curr_buffer_length > self.max_token_limit:
-                pruned_memory.append(buffer.pop(0))
-                curr_buffer_length = self.llm.get_num_tokens_from_messages(
-                    buffer)
-            self.moving_summary_buffer = self.predict_new_summary(
-                pruned_memory, self.moving_summary_buffer
-            )
+        self._update_token_counts()
+        if self._buffer_tokens() > self.max_token_limit:
+
+            # Number of messages to prune, the shortest prefix of the buffer
+            # such that the remaining messages fit within the limit:
+            total_tokens = self._token_prefix_sums[-1]
+            cut = bisect_left(self._token_prefix_sums, total_tokens - self.max_token_limit) + 1
+
+            buffer = self.chat_memory.messages
+            pruned_memory = buffer[:cut]
+            del buffer[:cut]
+            self._pruned_tokens = self._token_prefix_sums[cut - 1]
+            del self._token_prefix_sums[:cut]
+
+            # Queue pruned messages for summarization:
+            with self._summary_lock:
+                self._pending_messages.extend(pruned_memory)
+
+            if self.background_summarization:
+                self._start_summarization()
+            else:
+                self._summarize_pending_messages()
+
+    def wait_for_summary(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until all pruned messages are summarized. Returns False if the timeout expired.
+        """
+        with self._summary_lock:
+            future = self._summarization_future
+        if future is None:
+            return True
+        done, _ = wait([future], timeout=timeout)
+        return bool(done)
 
     def clear(self) -> None:
         """Clear memory contents."""
         super().clear()
-        self.moving_summary_buffer = ""
+        with self._summary_lock:
+            self.moving_summary_buffer = ""
+            self._pending_messages = []
+            self._generation += 1
+        self._token_prefix_sums = []
+        self._pruned_tokens = 0
+
+    def _start_summarization(self):
+        # At most one summarization in progress per memory, it picks up messages pruned in the meantime:
+        with self._summary_lock:
+            if self._summarization_future is None:
+                self._summarization_future = _summarization_thread_pool.submit(self._summarize_pending_messages,
+                                                                                background=True)
+
+    def _summarize_pending_messages(self, background: bool = False):
+        while True:
+            # All messages pruned so far are summarized at once:
+            with self._summary_lock:
+                messages = list(self._pending_messages)
+                existing_summary = self.moving_summary_buffer
+                generation = self._generation
+                if not messages:
+                    if background:
+                        self._summarization_future = None
+                    return
+
+            try:
+                # The LLM call is made without holding the lock:
+                new_summary = self.predict_new_summary(messages, existing_summary)
+            except Exception as e:
+                # Pending messages are kept, and summarized with the messages pruned next:
+                aprint(f"Error: {type(e).__name__} with message: '{str(e)}' occured while summarizing memory.")
+                traceback.print_exc()
+                if background:
+                    with self._summary_lock:
+                        self._summarization_future = None
+                return
+
+            with self._summary_lock:
+                # Discard the summary if the memory was cleared in the meantime:
+                if generation == self._generation:
+                    self.moving_summary_buffer = new_summary
+                    del self._pending_messages[:len(messages)]
+
+    def _buffer_tokens(self) -> int:
+        return self._token_prefix_sums[-1] - self._pruned_tokens if self._token_prefix_sums else 0
+
+    def _update_token_counts(self):
+        # Messages are only ever added at the end of the buffer, so only new messages need to be counted:
+        buffer = self.chat_memory.messages
+        if len(buffer) < len(self._token_prefix_sums):
+            # The buffer was modified from outside, start over:
+            self._token_prefix_sums = []
+            self._pruned_tokens = 0
+
+        total_tokens = self._token_prefix_sums[-1] if self._token_prefix_sums else self._pruned_tokens
+        for message in buffer[len(self._token_prefix_sums):]:
+            total_tokens += self._message_tokens(message)
+            self._token_prefix_sums.append(total_tokens)
+
+    def _message_tokens(self, message: BaseMessage) -> int:
+        # Each message is tokenised once, its token count is cached on the message:
+        num_tokens = message.additional_kwargs.get('num_tokens')
+        if num_tokens is None:
+            num_tokens = self.llm.get_num_tokens_from_messages([message])
+            message.additional_kwargs['num_tokens'] = num_tokens
+        return num_tokens
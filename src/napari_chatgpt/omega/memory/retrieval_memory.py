@@ -0,0 +1,92 @@
+from typing import Any, Dict, List
+
+from langchain.schema import BaseMemory
+from langchain_core.messages import SystemMessage
+
+from napari_chatgpt.omega.memory.long_term_memory import LongTermMemory
+
+
+class RetrievalMemory(BaseMemory):
+    """
+    Wraps a conversation memory and adds, when loading the memory, the items of the long-term memory
+    that are most relevant to the current input: past turns that are no longer in the conversation buffer,
+    generated code, and tool outputs. Each saved turn is also added to the long-term memory.
+    """
+
+    # Conversation memory, for example a token buffer or hybrid memory:
+    memory: BaseMemory
+    long_term_memory: LongTermMemory
+
+    # Number of items retrieved:
+    k: int = 4
+
+    # Retrieved items longer than this are truncated:
+    max_item_length: int = 1200
+
+    input_key: str = 'input'
+    output_key: str = 'output'
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return self.memory.memory_variables
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        variables = self.memory.load_memory_variables(inputs)
+
+        query = inputs.get(self.input_key)
+        if not query or not self.memory_variables:
+            return variables
+
+        memory_key = self.memory_variables[0]
+        history = variables.get(memory_key)
+
+        # Turns which output is still in the conversation buffer need not be retrieved:
+        if isinstance(history, list):
+            buffer_texts = {message.content for message in history if isinstance(message.content, str)}
+        else:
+            buffer_texts = set()
+
+        results = self.long_term_memory.search(query,
+                                               k=self.k,
+                                               exclude=lambda item: item.get('output') in buffer_texts)
+        if not results:
+            return variables
+
+        recollection = self._format(results)
+        if isinstance(history, list):
+            variables[memory_key] = [SystemMessage(content=recollection,
+                                                   additional_kwargs=dict(system_message_type="long_term_memory"))] + history
+        else:
+            variables[memory_key] = recollection + '\n' + (history or '')
+
+        return variables
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        self.memory.save_context(inputs, outputs)
+
+        input_text = inputs.get(self.input_key, '')
+        output_text = outputs.get(self.output_key, '')
+        self.long_term_memory.add('turn',
+                                  _turn_text(input_text, output_text),
+                                  output=output_text)
+
+    def clear(self) -> None:
+        # The long-term memory outlives conversations:
+        self.memory.clear()
+
+    def _format(self, results) -> str:
+        recollection = "For reference, below are items from earlier conversations, generated code, " \
+                       "and tool outputs, that might be relevant to the current request:\n"
+        for _, item in results:
+            text = item['text']
+            if len(text) > self.max_item_length:
+                text = text[:self.max_item_length] + '... [truncated]'
+            recollection += f"\n[{item['kind']}]\n{text}\n"
+        return recollection
+
+
+def _turn_text(input_text: str, output_text: str) -> str:
+    return f"User: {input_text}\nOmega: {output_text}"
@@ -0,0 +1,80 @@
+import os
+
+from langchain.memory import ConversationTokenBufferMemory
+from langchain_community.llms.fake import FakeListLLM
+
+from napari_chatgpt.omega.memory.long_term_memory import LongTermMemory, \
+    tokenize
+from napari_chatgpt.omega.memory.retrieval_memory import RetrievalMemory
+
+
+class _WordCountingLLM(FakeListLLM):
+    # One token per word:
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+
+
+def test_tokenize():
+    assert tokenize('Apply gaussian_filter with sigma=2') == ['apply', 'gaussian', 'filter', 'sigma', '2']
+    assert tokenize('StarDist') == ['stardist', 'star', 'dist']
+
+
+def test_long_term_memory(tmp_path):
+    file_path = os.path.join(tmp_path, 'memory.jsonl')
+    memory = LongTermMemory(file_path, max_items=3)
+
+    memory.add('code', 'Widget to threshold images with Otsu', tool='widget_maker')
+    memory.add('turn', 'User: open the cells image\nOmega: Done, the image is opened.')
+    memory.add('tool_output', 'Segmented the nuclei with StarDist: 42 nuclei found.')
+
+    # Most relevant first:
+    results = memory.search('threshold widget')
+    assert results[0][1]['text'] == 'Widget to threshold images with Otsu'
+    assert results[0][1]['tool'] == 'widget_maker'
+
+    # Filtering by kind, and exclusion:
+    assert memory.search('nuclei', kinds=['turn']) == []
+    assert memory.search('nuclei', exclude=lambda item: item['kind'] == 'tool_output') == []
+
+    # Oldest items are forgotten:
+    memory.add('turn', 'User: denoise it\nOmega: Denoised.')
+    assert len(memory) == 3
+    assert memory.search('threshold') == []
+
+    # Persistence:
+    reloaded_memory = LongTermMemory(file_path, max_items=3)
+    assert len(reloaded_memory) == 3
+    assert reloaded_memory.search('stardist')[0][1]['kind'] == 'tool_output'
+
+    # Lines that are not items are skipped:
+    with open(file_path, 'a') as file:
+        file.write('[1, 2]\n"text"\n{"text": 3}\n{"kind": "turn", "text": "User: count the nu')
+    reloaded_memory = LongTermMemory(file_path, max_items=3)
+    assert len(reloaded_memory) == 3
+
+
+def test_retrieval_memory():
+    long_term_memory = LongTermMemory()
+    buffer_memory = ConversationTokenBufferMemory(llm=_WordCountingLLM(responses=['...']),
+                                                  memory_key="chat_history",
+                                                  return_messages=True,
+                                                  max_token_limit=12)
+    memory = RetrievalMemory(memory=buffer_memory, long_term_memory=long_term_memory)
+
+    memory.save_context({'input': 'make a widget for otsu thresholding'}, {'output': 'widget done'})
+
+    # The turn is still in the buffer, nothing to recall:
+    messages = memory.load_memory_variables({'input': 'fix the otsu widget'})['chat_history']
+    assert len(messages) == 2
+
+    # Once out of the buffer, the turn is recalled when relevant:
+    memory.save_context({'input': 'open image'}, {'output': 'image opened'})
+    memory.save_context({'input': 'denoise image'}, {'output': 'image denoised'})
+    messages = memory.load_memory_variables({'input': 'fix the otsu widget'})['chat_history']
+    assert messages[0].additional_kwargs['system_message_type'] == 'long_term_memory'
+    assert 'make a widget for otsu thresholding' in messages[0].content
+    assert all('otsu' not in message.content for message in messages[1:])
+
+    # Not relevant, not recalled:
+    messages = memory.load_memory_variables({'input': 'zoom'})['chat_history']
+    assert all(message.type != 'system' for message in messages)
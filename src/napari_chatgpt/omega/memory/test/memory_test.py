@@ -0,0 +1,84 @@
+from threading import Event
+from typing import List
+
+from langchain_community.llms.fake import FakeListLLM
+
+from napari_chatgpt.omega.memory.memory import OmegaMemory
+
+
+class _WordCountingLLM(FakeListLLM):
+    # One token per word, and keeps track of the tokenised texts:
+    tokenised_texts: List[str] = []
+
+    def get_num_tokens(self, text: str) -> int:
+        self.tokenised_texts.append(text)
+        return len(text.split())
+
+
+def test_omega_memory_prune():
+    llm = _WordCountingLLM(responses=['summary 1', 'summary 2'])
+    memory = OmegaMemory(llm=llm,
+                         memory_key="chat_history",
+                         return_messages=True,
+                         max_token_limit=20)
+
+    # 'Human: one two three' is 4 tokens, 'AI: four five six' is 4 tokens:
+    memory.save_context({'input': 'one two three'}, {'output': 'four five six'})
+    memory.save_context({'input': 'one two three'}, {'output': 'four five six'})
+    assert memory.num_tokens == 16
+    assert memory.moving_summary_buffer == ''
+
+    # Exceeding the limit prunes the oldest messages, just enough to fit:
+    memory.save_context({'input': 'one two three'}, {'output': 'four five six'})
+    assert memory.num_tokens == 20
+    assert len(memory.buffer) == 5
+    assert memory.wait_for_summary(timeout=10)
+    assert memory.moving_summary_buffer == 'summary 1'
+
+    # Each message is tokenised once, summaries aside:
+    assert len([t for t in llm.tokenised_texts if t.startswith(('Human', 'AI'))]) == 6
+
+    # Summary comes first:
+    variables = memory.load_memory_variables({})
+    assert variables['chat_history'][0].content == 'summary 1'
+
+    memory.clear()
+    assert memory.num_tokens == 0
+    assert memory.moving_summary_buffer == ''
+
+
+# Set to let the summarizing LLM answer:
+_summary_requested = Event()
+_summary_allowed = Event()
+
+
+class _BlockingLLM(_WordCountingLLM):
+
+    def _call(self, *args, **kwargs) -> str:
+        _summary_requested.set()
+        _summary_allowed.wait(timeout=10)
+        return super()._call(*args, **kwargs)
+
+
+def test_omega_memory_background_summarization():
+    llm = _BlockingLLM(responses=['summary'])
+    memory = OmegaMemory(llm=llm,
+                         memory_key="chat_history",
+                         return_messages=True,
+                         max_token_limit=8)
+
+    # Saving the context does not wait for the summary:
+    memory.save_context({'input': 'one two three'}, {'output': 'four five six'})
+    memory.save_context({'input': 'seven eight'}, {'output': 'nine ten'})
+    assert _summary_requested.wait(timeout=10)
+    assert memory.moving_summary_buffer == ''
+
+    # While the summary is not ready, pruned messages are kept:
+    messages = memory.load_memory_variables({})['chat_history']
+    assert [m.content for m in messages] == ['one two three', 'four five six', 'seven eight', 'nine ten']
+
+    # Once ready, the summary replaces the pruned messages:
+    _summary_allowed.set()
+    assert memory.wait_for_summary(timeout=10)
+    messages = memory.load_memory_variables({})['chat_history']
+    assert [m.content for m in messages] == ['summary', 'seven eight', 'nine ten']
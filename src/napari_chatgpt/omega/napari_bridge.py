@@ -1,123 +1,301 @@
-from queue import Queue
-from typing import Callable
+import asyncio
+from concurrent.futures import Future, CancelledError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from itertools import count
+from threading import Lock, Semaphore
+from typing import Callable, Dict, Optional, Any
 
 import napari
 import napari.viewer
-from PIL.Image import fromarray
 from arbol import aprint, asection
 from napari import Viewer
 from napari.qt.threading import thread_worker
 
 from napari_chatgpt.omega.tools.special.exception_catcher_tool import \
     enqueue_exception
-from napari_chatgpt.utils.napari.napari_viewer_info import get_viewer_info
+from napari_chatgpt.utils.napari.viewer_state_cache import ViewerStateCache
 from napari_chatgpt.utils.python.exception_guard import ExceptionGuard
+from napari_chatgpt.utils.system.fair_queue import FairQueue
 
-# global Variable to exchange information with the viewer:
-_viewer_info = None
-
-def _set_viewer_info(viewer_info):
-    global _viewer_info
-    _viewer_info = viewer_info
-
-def _get_viewer_info():
-    global _viewer_info
-    return _viewer_info
 
 class NapariBridge():
 
-    def __init__(self, viewer: Viewer):
+    def __init__(self,
+                 viewer: Viewer,
+                 default_timeout: Optional[float] = None):
+        """
+        Bridge between Omega's worker threads and napari's QT thread.
+
+        Each delegated function is tagged with a unique request ID and is
+        paired with its own future, so that concurrent callers never pick up
+        each other's results.
+
+        Requests are also tagged with the ID of the session that sent them.
+        Requests from different sessions are executed in turns, one at a time,
+        so that a session sending many requests cannot starve the others.
+
+        Parameters
+        ----------
+        viewer : Viewer
+            The napari viewer instance.
+        default_timeout : Optional[float]
+            Default timeout in seconds for delegated calls, None for no timeout.
+        """
         self.viewer = viewer
+        self.default_timeout = default_timeout
+
+        # Event-driven cache of the viewer information:
+        self.viewer_state = ViewerStateCache(viewer)
 
-        self.to_napari_queue = Queue(maxsize=16)
-        self.from_napari_queue = Queue(maxsize=16)
+        # Queue of (request_id, session_id, delegated_function) requests sent to napari, served in turns per session:
+        self.to_napari_queue = FairQueue()
+
+        # Released once napari's QT thread is done with a request, so that the next request is picked fairly
+        # from the queue at that time, instead of piling up in QT's event queue:
+        self._request_done = Semaphore(0)
+
+        # Pending futures keyed by request ID:
+        self._pending_futures: Dict[int, Future] = {}
+        self._pending_lock = Lock()
+        self._request_counter = count()
 
         #
-        def qt_code_executor(fun: Callable[[napari.Viewer], None]):
-            with asection(f"qt_code_executor received delegated function."):
-                with ExceptionGuard() as guard:
-                    aprint("Executing now!")
-                    result = fun(viewer)
-                    aprint(result)
-                    self.from_napari_queue.put(result)
-
-                if guard.exception:
-                    aprint(
-                        f"Exception while executing on napari's QT thread:\n{guard.exception_description}")
-                    self.from_napari_queue.put(guard)
-                    enqueue_exception(guard.exception_value)
+        def qt_code_executor(request):
+
+            try:
+                # Unpack request:
+                request_id, session_id, fun = request
+
+                # Get the future for that request, if still pending:
+                future = self._pop_pending_future(request_id)
+
+                # Skip requests that have been cancelled in the meantime:
+                if future is None or not future.set_running_or_notify_cancel():
+                    aprint(f"Request {request_id} was cancelled before execution, skipping.")
+                    return
+
+                with asection(f"qt_code_executor received delegated function (request {request_id}, session {session_id})."):
+                    with ExceptionGuard() as guard:
+                        aprint("Executing now!")
+                        result = fun(viewer)
+                        aprint(result)
+                        future.set_result(result)
+
+                    if guard.exception:
+                        aprint(
+                            f"Exception while executing on napari's QT thread:\n{guard.exception_description}")
+                        future.set_exception(guard.exception_value)
+                        enqueue_exception(guard.exception_value)
+            finally:
+                # Ready for the next request:
+                self._request_done.release()
 
         @thread_worker(connect={'yielded': qt_code_executor})
-        def omega_napari_worker(to_napari_queue: Queue,
-                                from_napari_queue: Queue):
+        def omega_napari_worker(to_napari_queue: FairQueue):
             while True:
 
-                # get code from the queue:
-                code = to_napari_queue.get()
+                # get request from the queue, returns None once the queue is closed:
+                request = to_napari_queue.get()
 
                 # execute code on napari's QT thread:
-                if code is None:
+                if request is None:
                     break  # stops.
 
-                yield code
+                yield request
+
+                # Wait for napari's QT thread to be done with this request before picking the next one:
+                self._request_done.acquire()
 
         # create the worker:
-        self.worker = omega_napari_worker(self.to_napari_queue,
-                                          self.from_napari_queue)
+        self.worker = omega_napari_worker(self.to_napari_queue)
+
+    def submit(self,
+               delegated_function: Callable[[Viewer], Any],
+               session_id: Optional[str] = None) -> Future:
+        """
+        Submits a function for execution on napari's QT thread.
+
+        Parameters
+        ----------
+        delegated_function : Callable[[Viewer], Any]
+            Function that receives the viewer as single argument.
+        session_id : Optional[str]
+            ID of the session sending the request, requests from different sessions are executed in turns.
+
+        Returns
+        -------
+        Future
+            Future for the result, its 'request_id' attribute identifies the request.
+        """
+        # New request ID and future:
+        request_id = next(self._request_counter)
+        future = Future()
+        future.request_id = request_id
+
+        # Register the future before sending the request:
+        with self._pending_lock:
+            self._pending_futures[request_id] = future
+
+        # Send request to napari:
+        self.to_napari_queue.put((request_id, session_id, delegated_function), key=session_id)
+
+        return future
+
+    def execute(self,
+                delegated_function: Callable[[Viewer], Any],
+                timeout: Optional[float] = None,
+                session_id: Optional[str] = None) -> Any:
+        """
+        Executes a function on napari's QT thread and waits for its result.
+        Exceptions raised by the delegated function are re-raised here,
+        and a TimeoutError is raised if the result is not available in time,
+        in which case the request is cancelled if it has not started yet.
+        """
+        future = self.submit(delegated_function, session_id=session_id)
+        timeout = timeout if timeout is not None else self.default_timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.cancel(future.request_id)
+            raise TimeoutError(f"Request {future.request_id} to napari timed out after {timeout} seconds.")
+
+    async def aexecute(self,
+                       delegated_function: Callable[[Viewer], Any],
+                       timeout: Optional[float] = None,
+                       session_id: Optional[str] = None) -> Any:
+        """
+        Awaitable variant of execute(), does not block the event loop.
+        Cancelling the awaiting task cancels the request if it has not started yet.
+        """
+        future = self.submit(delegated_function, session_id=session_id)
+        timeout = timeout if timeout is not None else self.default_timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.cancel(future.request_id)
+            raise TimeoutError(f"Request {future.request_id} to napari timed out after {timeout} seconds.")
+
+    def cancel(self, request_id: int) -> bool:
+        """
+        Cancels a pending request. Requests already running on napari's QT thread cannot be cancelled.
+
+        Returns
+        -------
+        bool
+            True if the request was cancelled.
+        """
+        future = self._pop_pending_future(request_id)
+        if future is None:
+            return False
+        return future.cancel()
+
+    def number_of_pending_requests(self) -> int:
+        with self._pending_lock:
+            return len(self._pending_futures)
+
+    def queue_depths(self) -> Dict[Optional[str], int]:
+        """
+        Number of requests waiting for napari's QT thread, per session.
+        """
+        return self.to_napari_queue.depths()
+
+    def session_metrics(self) -> Dict[Optional[str], Dict[str, float]]:
+        """
+        Queue metrics per session: current and maximal queue depth, number of requests enqueued and dequeued,
+        and mean and maximal time in seconds that requests waited for napari's QT thread.
+        """
+        return self.to_napari_queue.metrics()
+
+    def end_session(self, session_id: str):
+        """
+        Forgets the metrics of a session that has ended.
+        """
+        self.to_napari_queue.forget(session_id)
+
+    def stop(self):
+        # Cancel all pending requests:
+        with self._pending_lock:
+            pending_futures = list(self._pending_futures.values())
+            self._pending_futures.clear()
+        for future in pending_futures:
+            future.cancel()
+
+        # Stop the worker:
+        self.to_napari_queue.close()
+        self._request_done.release()
+
+    def _pop_pending_future(self, request_id: int) -> Optional[Future]:
+        with self._pending_lock:
+            return self._pending_futures.pop(request_id, None)
+
+
+    def get_viewer_info(self, session_id: Optional[str] = None) -> str:
+
+        # Nothing changed since last time, no need to go to napari's QT thread:
+        viewer_info = self.viewer_state.cached_viewer_info()
+        if viewer_info is not None:
+            return viewer_info
+
+        # Setting up delegated function:
+        delegated_function = lambda v: self.viewer_state.get_viewer_info()
+
+        return self._execute_in_napari_context(delegated_function, session_id=session_id)
 
+    async def aget_viewer_info(self, session_id: Optional[str] = None) -> str:
 
-    def get_viewer_info(self) -> str:
+        # Nothing changed since last time, no need to go to napari's QT thread:
+        viewer_info = self.viewer_state.cached_viewer_info()
+        if viewer_info is not None:
+            return viewer_info
 
         # Setting up delegated function:
-        delegated_function = lambda v: get_viewer_info(v)
+        delegated_function = lambda v: self.viewer_state.get_viewer_info()
 
-        return self._execute_in_napari_context(delegated_function)
+        return await self._aexecute_in_napari_context(delegated_function, session_id=session_id)
 
 
-    def take_snapshot(self):
+    def take_snapshot(self, session_id: Optional[str] = None, canvas_only: bool = True):
+        """
+        Takes a snapshot of the viewer, returns it as an RGBA array.
+        Only the pixels are grabbed on the Qt thread, resizing and encoding are left to the caller.
+        """
 
         # Delegated function:
         def _delegated_snapshot_function(viewer: Viewer):
 
-            # Take a screenshot of the whole Napari viewer
-            screenshot = self.viewer.screenshot(canvas_only=False, flash=False)
-
-            # Convert the screenshot (NumPy array) to a PIL image
-            pil_image = fromarray(screenshot)
-
-            return pil_image
+            # Grab the canvas' framebuffer, or the whole viewer window:
+            return self.viewer.screenshot(canvas_only=canvas_only, flash=False)
 
         # Execute delegated function in napari context and return result:
-        return self._execute_in_napari_context(_delegated_snapshot_function)
+        return self._execute_in_napari_context(_delegated_snapshot_function, session_id=session_id)
 
 
-    def _execute_in_napari_context(self, delegated_function):
+    def _execute_in_napari_context(self, delegated_function, session_id: Optional[str] = None):
         try:
+            return self.execute(delegated_function, session_id=session_id)
 
-            # Send code to napari:
-            self.to_napari_queue.put(delegated_function)
-
-            # Get response:
-            response = self.from_napari_queue.get()
-
-            if isinstance(response, ExceptionGuard):
-                exception_guard = response
-                # print stack trace:
-                import traceback
-                traceback.print_exc()
-                # raise exception_guard.exception
-                return f"Error: {exception_guard.exception_type_name} with message: '{str(exception_guard.exception)}' ."
-
-            return response
+        except (TimeoutError, CancelledError) as e:
+            aprint(f"Delegated function did not complete: {type(e).__name__} {str(e)}")
+            return None
 
-        except Exception:
+        except Exception as e:
             # print exception stack trace:
             import traceback
             traceback.print_exc()
 
-            return None
-
+            return f"Error: {type(e).__name__} with message: '{str(e)}' ."
 
+    async def _aexecute_in_napari_context(self, delegated_function, session_id: Optional[str] = None):
+        try:
+            return await self.aexecute(delegated_function, session_id=session_id)
 
+        except (TimeoutError, CancelledError) as e:
+            aprint(f"Delegated function did not complete: {type(e).__name__} {str(e)}")
+            return None
 
+        except Exception as e:
+            # print exception stack trace:
+            import traceback
+            traceback.print_exc()
 
+            return f"Error: {type(e).__name__} with message: '{str(e)}' ."
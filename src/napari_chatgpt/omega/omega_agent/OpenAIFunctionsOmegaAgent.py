@@ -1,5 +1,5 @@
 """Module implements an agent that uses OpenAI's APIs function enabled API."""
-from typing import Any, List, Tuple, Union
+from typing import Any, List, Optional, Tuple, Union
 
 from langchain.agents import OpenAIFunctionsAgent
 from langchain.agents.format_scratchpad.openai_functions import (
@@ -14,8 +14,8 @@ from langchain_core.messages import (
     SystemMessage,
 )
 
-from napari_chatgpt.omega.napari_bridge import _get_viewer_info
 from napari_chatgpt.omega.omega_agent.prompts import DIDACTICS
+from napari_chatgpt.omega.omega_session import OmegaSession
 
 
 class OpenAIFunctionsOmegaAgent(OpenAIFunctionsAgent):
@@ -24,6 +24,12 @@ class OpenAIFunctionsOmegaAgent(OpenAIFunctionsAgent):
 
     be_didactic: bool = False
 
+    # Chat session of this agent, holds the session's viewer information:
+    session: Optional[OmegaSession] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
     async def aplan(
             self,
             intermediate_steps: List[Tuple[AgentAction, str]],
@@ -51,7 +57,7 @@ class OpenAIFunctionsOmegaAgent(OpenAIFunctionsAgent):
         messages = prompt.to_messages()
 
         # Add viewer info to the messages:
-        viewer_info = _get_viewer_info()
+        viewer_info = self.session.viewer_info if self.session else None
         if viewer_info:
             messages.insert(-1, SystemMessage(
                 content="For reference, below is information about the napari viewer instance that is available to some of the tools: \n" + viewer_info,
@@ -0,0 +1,211 @@
+from threading import Lock, Thread
+from typing import List, Optional, Tuple
+
+from arbol import asection, aprint
+from langchain.agents import AgentExecutor
+from langchain.base_language import BaseLanguageModel
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.memory import ConversationTokenBufferMemory, \
+    ConversationBufferMemory
+from langchain.schema import BaseMemory
+from langchain.tools import BaseTool
+
+from napari_chatgpt.llm.llms import instantiate_LLMs, bind_llm_callbacks
+from napari_chatgpt.omega.memory.long_term_memory import LongTermMemory
+from napari_chatgpt.omega.memory.memory import OmegaMemory
+from napari_chatgpt.omega.memory.retrieval_memory import RetrievalMemory
+from napari_chatgpt.omega.napari_bridge import NapariBridge
+from napari_chatgpt.omega.omega_init import build_omega_tools, \
+    create_omega_agent_executor
+from napari_chatgpt.omega.omega_session import OmegaSession
+from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
+from napari_chatgpt.utils.python.package_index import \
+    add_package_index_listener
+
+
+class OmegaAgentFactory:
+    """
+    Creates Omega agents for chat sessions.
+
+    The LLMs and tools are built once, together with the capability probes they need
+    (vision model availability, plugin discovery, ...), possibly in the background at server startup.
+    Each session then gets cheap shallow copies of these, bound to the session's callback handlers and memory.
+    """
+
+    def __init__(self,
+                 napari_bridge: NapariBridge,
+                 notebook: Optional[JupyterNotebookFile],
+                 main_llm_model_name: str,
+                 tool_llm_model_name: str = None,
+                 temperature: float = 0.01,
+                 tool_temperature: float = 0.01,
+                 memory_type: str = 'standard',
+                 agent_personality: str = 'neutral',
+                 fix_imports: bool = True,
+                 install_missing_packages: bool = True,
+                 fix_bad_calls: bool = True,
+                 autofix_mistakes: bool = False,
+                 autofix_widget: bool = False,
+                 be_didactic: bool = False,
+                 long_term_memory: Optional[LongTermMemory] = None,
+                 verbose: bool = False):
+
+        self.napari_bridge = napari_bridge
+        self.notebook = notebook
+        self.main_llm_model_name = main_llm_model_name
+        self.tool_llm_model_name = tool_llm_model_name
+        self.temperature = temperature
+        self.tool_temperature = tool_temperature
+        self.memory_type = memory_type
+        self.agent_personality = agent_personality
+        self.fix_imports = fix_imports
+        self.install_missing_packages = install_missing_packages
+        self.fix_bad_calls = fix_bad_calls
+        self.autofix_mistakes = autofix_mistakes
+        self.autofix_widget = autofix_widget
+        self.be_didactic = be_didactic
+        # Long-term memory shared by all sessions, None to disable:
+        self.long_term_memory = long_term_memory
+        self.verbose = verbose
+
+        # Prebuilt LLMs and tools, see prebuild():
+        self._prebuilt = None
+        self._lock = Lock()
+
+        # Installing packages can add plugins and tools, new sessions then get freshly built tools:
+        add_package_index_listener(self.invalidate)
+
+    def prebuild(self) -> Tuple[BaseLanguageModel, BaseLanguageModel, BaseLanguageModel, int, List[BaseTool]]:
+        """
+        Builds the LLMs and tools shared by all sessions, if not already built.
+        Returns the main, memory, and tool LLMs, the maximum token limit of the main LLM, and the tools.
+        """
+        with self._lock:
+            if self._prebuilt is None:
+                with asection("Prebuilding LLMs and tools for Omega agents"):
+                    main_llm, memory_llm, tool_llm, max_token_limit = instantiate_LLMs(
+                        main_llm_model_name=self.main_llm_model_name,
+                        tool_llm_model_name=self.tool_llm_model_name,
+                        temperature=self.temperature,
+                        tool_temperature=self.tool_temperature,
+                        chat_callback_handler=None,
+                        tool_callback_handler=None,
+                        memory_callback_handler=None,
+                        verbose=self.verbose
+                    )
+
+                    tools = build_omega_tools(napari_bridge=self.napari_bridge,
+                                              tool_llm=tool_llm,
+                                              notebook=self.notebook,
+                                              has_human_input_tool=False,
+                                              fix_imports=self.fix_imports,
+                                              install_missing_packages=self.install_missing_packages,
+                                              fix_bad_calls=self.fix_bad_calls,
+                                              autofix_mistakes=self.autofix_mistakes,
+                                              autofix_widget=self.autofix_widget,
+                                              verbose=self.verbose)
+
+                    aprint(f"Prebuilt {len(tools)} tools: {', '.join(tool.name for tool in tools)}")
+                    self._prebuilt = (main_llm, memory_llm, tool_llm, max_token_limit, tools)
+
+            return self._prebuilt
+
+    def start_prebuild(self):
+        """
+        Prebuilds the LLMs and tools in a background thread.
+        """
+        Thread(target=self.prebuild, name='omega_agent_prebuild', daemon=True).start()
+
+    def invalidate(self, rebuild: bool = True):
+        """
+        Forgets the prebuilt LLMs and tools, for example after installing plugins.
+        They are built again in the background if requested, existing sessions keep their tools.
+        """
+        with self._lock:
+            self._prebuilt = None
+
+        if rebuild:
+            self.start_prebuild()
+
+    def create_agent(self,
+                     chat_callback_handler: BaseCallbackHandler = None,
+                     tool_callback_handler: BaseCallbackHandler = None,
+                     memory_callback_handler: BaseCallbackHandler = None,
+                     session: Optional[OmegaSession] = None) -> AgentExecutor:
+        """
+        Creates an agent for a new session, bound to the session's callback handlers and with a fresh memory.
+        The agent and its tools keep their viewer context, requests to napari, and notebook scoped to the given session.
+        """
+        with asection(f"Creating Omega agent for new session: {session}"):
+            main_llm, memory_llm, tool_llm, max_token_limit, tools = self.prebuild()
+
+            # Bind LLMs to the session's callback handlers:
+            main_llm = bind_llm_callbacks(main_llm, chat_callback_handler)
+            memory_llm = bind_llm_callbacks(memory_llm, memory_callback_handler)
+            tool_llm = bind_llm_callbacks(tool_llm, tool_callback_handler)
+
+            # Bind tools to the session, tools also keep per-session state such as the last generated code:
+            tool_callbacks = [tool_callback_handler] if tool_callback_handler else None
+            session_id = session.session_id if session else None
+            notebook = session.notebook if session and session.notebook is not None else self.notebook
+            tools = [_bind_tool(tool, tool_llm, tool_callbacks, session_id, self.long_term_memory, notebook)
+                     for tool in tools]
+
+            # Instantiate memory:
+            memory = create_memory(self.memory_type, memory_llm, max_token_limit)
+
+            # Recall relevant items from the long-term memory:
+            if self.long_term_memory is not None:
+                memory = RetrievalMemory(memory=memory, long_term_memory=self.long_term_memory)
+
+            return create_omega_agent_executor(tools=tools,
+                                               main_llm_model_name=self.main_llm_model_name,
+                                               main_llm=main_llm,
+                                               chat_callback_handler=chat_callback_handler,
+                                               memory=memory,
+                                               agent_personality=self.agent_personality,
+                                               be_didactic=self.be_didactic,
+                                               session=session,
+                                               verbose=self.verbose)
+
+
+def create_memory(memory_type: str,
+                  memory_llm: BaseLanguageModel,
+                  max_token_limit: int) -> BaseMemory:
+    if memory_type == 'bounded':
+        return ConversationTokenBufferMemory(
+            llm=memory_llm,
+            memory_key="chat_history",
+            return_messages=True,
+            max_token_limit=max_token_limit)
+    elif memory_type == 'infinite':
+        return ConversationBufferMemory(
+            memory_key="chat_history",
+            return_messages=True)
+    elif memory_type == 'hybrid':
+        return OmegaMemory(
+            llm=memory_llm,
+            memory_key="chat_history",
+            return_messages=True,
+            max_token_limit=max_token_limit)
+    else:
+        raise ValueError('Invalid Memory parameter!')
+
+
+def _bind_tool(tool: BaseTool,
+               tool_llm: BaseLanguageModel,
+               tool_callbacks,
+               session_id: Optional[str] = None,
+               long_term_memory: Optional[LongTermMemory] = None,
+               notebook: Optional[JupyterNotebookFile] = None) -> BaseTool:
+    # Shallow copy, the tool's napari bridge and other shared state are not copied:
+    update = {'callbacks': tool_callbacks}
+    if 'notebook' in tool.__fields__:
+        update['notebook'] = notebook
+    if getattr(tool, 'llm', None) is not None:
+        update['llm'] = tool_llm
+    if 'session_id' in tool.__fields__:
+        update['session_id'] = session_id
+    if 'long_term_memory' in tool.__fields__:
+        update['long_term_memory'] = long_term_memory
+    return tool.copy(update=update)
@@ -1,4 +1,4 @@
-from queue import Queue
+from typing import List
 
 import langchain
 from arbol import aprint
@@ -7,10 +7,13 @@ from langchain.agents.conversational_chat.prompt import SUFFIX
 from langchain.base_language import BaseLanguageModel
 from langchain.callbacks.base import BaseCallbackHandler
 from langchain.schema import BaseMemory
+from langchain.tools import BaseTool
 from langchain_core.messages import SystemMessage
 from langchain_core.prompts import MessagesPlaceholder
 
+from napari_chatgpt.omega.napari_bridge import NapariBridge
 from napari_chatgpt.omega.omega_agent.prompts import SYSTEM, PERSONALITY
+from napari_chatgpt.omega.omega_session import OmegaSession
 from napari_chatgpt.omega.tools.napari.cell_nuclei_segmentation_tool import \
     CellNucleiSegmentationTool
 from napari_chatgpt.omega.tools.napari.file_open_tool import \
@@ -53,8 +56,8 @@ from napari_chatgpt.utils.system.is_apple_silicon import is_apple_silicon
 # Default verbosity to False:
 langchain.verbose = False
 
-def initialize_omega_agent(to_napari_queue: Queue = None,
-                           from_napari_queue: Queue = None,
+
+def initialize_omega_agent(napari_bridge: NapariBridge = None,
                            main_llm_model_name: str = None,
                            main_llm: BaseLanguageModel = None,
                            tool_llm: BaseLanguageModel = None,
@@ -74,14 +77,45 @@ def initialize_omega_agent(to_napari_queue: Queue = None,
                            verbose: bool = False
                            ) -> AgentExecutor:
 
-    # Get app configuration:
-    config = AppConfiguration('omega')
+    # Build the tools:
+    tools = build_omega_tools(napari_bridge=napari_bridge,
+                              tool_llm=tool_llm,
+                              tool_callback_handler=tool_callback_handler,
+                              notebook=notebook,
+                              has_human_input_tool=has_human_input_tool,
+                              fix_imports=fix_imports,
+                              install_missing_packages=install_missing_packages,
+                              fix_bad_calls=fix_bad_calls,
+                              autofix_mistakes=autofix_mistakes,
+                              autofix_widget=autofix_widget,
+                              verbose=verbose)
+
+    # Create the agent and its executor:
+    return create_omega_agent_executor(tools=tools,
+                                       main_llm_model_name=main_llm_model_name,
+                                       main_llm=main_llm,
+                                       chat_callback_handler=chat_callback_handler,
+                                       memory=memory,
+                                       agent_personality=agent_personality,
+                                       be_didactic=be_didactic,
+                                       verbose=verbose)
 
-    # Chat callback manager:
-    chat_callbacks = [chat_callback_handler] if chat_callback_handler else None
+
+def build_omega_tools(napari_bridge: NapariBridge = None,
+                      tool_llm: BaseLanguageModel = None,
+                      tool_callback_handler: BaseCallbackHandler = None,
+                      notebook: JupyterNotebookFile = None,
+                      has_human_input_tool: bool = True,
+                      fix_imports: bool = True,
+                      install_missing_packages: bool = True,
+                      fix_bad_calls: bool = True,
+                      autofix_mistakes: bool = False,
+                      autofix_widget: bool = False,
+                      verbose: bool = False
+                      ) -> List[BaseTool]:
 
     # Tool callback manager:
-    tool_callbacks = [tool_callback_handler] if chat_callback_handler else None
+    tool_callbacks = [tool_callback_handler] if tool_callback_handler else None
 
     # Basic list of tools:
     tools = [WikipediaQueryTool(callbacks=tool_callbacks),
@@ -97,17 +131,20 @@ def initialize_omega_agent(to_napari_queue: Queue = None,
         tools.append(HumanInputTool(callbacks=tool_callbacks))
 
     # Adding napari tools if required:
-    if to_napari_queue:
+    if napari_bridge:
+
+        # Get app configuration:
+        config = AppConfiguration('omega')
 
         # Napari tool shared parameters:
         kwargs = {'llm': tool_llm,
-                  'to_napari_queue': to_napari_queue,
-                  'from_napari_queue': from_napari_queue,
+                  'napari_bridge': napari_bridge,
                   'notebook': notebook,
                   'callbacks': tool_callbacks,
                   'fix_imports': fix_imports,
                   'install_missing_packages': install_missing_packages,
                   'fix_bad_calls': fix_bad_calls,
+                  'prompt_token_budget': config.get('tool_prompt_token_budget', 6000),
                   'verbose': verbose
                   }
 
@@ -144,10 +181,28 @@ def initialize_omega_agent(to_napari_queue: Queue = None,
                 prompt=tool_class.description,
                 return_direct=tool_class.return_direct,
                 lm=tool_llm,
-                to_napari_queue=to_napari_queue,
-                from_napari_queue=from_napari_queue,
+                napari_bridge=napari_bridge,
                 callbacks=tool_callbacks))
 
+    return tools
+
+
+def create_omega_agent_executor(tools: List[BaseTool],
+                                main_llm_model_name: str = None,
+                                main_llm: BaseLanguageModel = None,
+                                chat_callback_handler: BaseCallbackHandler = None,
+                                memory: BaseMemory = None,
+                                agent_personality: str = 'neutral',
+                                be_didactic: bool = False,
+                                session: OmegaSession = None,
+                                verbose: bool = False
+                                ) -> AgentExecutor:
+
+    # Get app configuration:
+    config = AppConfiguration('omega')
+
+    # Chat callback manager:
+    chat_callbacks = [chat_callback_handler] if chat_callback_handler else None
 
     # Do this so we can see exactly what's going on under the hood
     from langchain.globals import set_debug
@@ -176,7 +231,8 @@ def initialize_omega_agent(to_napari_queue: Queue = None,
             verbose=verbose,
             callbacks=chat_callbacks,
             extra_prompt_messages=extra_prompt_messages,
-            be_didactic=be_didactic
+            be_didactic=be_didactic,
+            session=session
         )
 
     else:
@@ -0,0 +1,45 @@
+import time
+from typing import Optional
+from uuid import uuid4
+
+from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
+
+
+class OmegaSession:
+    """
+    State of one chat session, for example one browser tab connected to the chat server.
+
+    Several sessions can share the same napari viewer: the session ID tags the requests sent to napari's QT thread,
+    so that the napari bridge can interleave them fairly, and the viewer information is kept per session
+    so that concurrent sessions never overwrite each other's context.
+    Each session also records its chat in its own notebook, if any.
+    """
+
+    def __init__(self,
+                 session_id: Optional[str] = None,
+                 notebook: Optional[JupyterNotebookFile] = None):
+        """
+        Parameters
+        ----------
+        session_id : Optional[str]
+            Unique ID of the session, generated if None.
+        notebook : Optional[JupyterNotebookFile]
+            Notebook of the session, None to not record the chat.
+        """
+        self.session_id = session_id or uuid4().hex[:12]
+
+        # Notebook of this session:
+        self.notebook: Optional[JupyterNotebookFile] = notebook
+
+        # Information about the viewer, as seen by this session at the start of its current request:
+        self.viewer_info: Optional[str] = None
+
+        # Creation and last activity times:
+        self.created = time.time()
+        self.last_activity = self.created
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def __repr__(self):
+        return f"OmegaSession({self.session_id})"
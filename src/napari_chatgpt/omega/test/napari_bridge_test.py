@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from napari_chatgpt.omega.napari_bridge import NapariBridge
+
+
+def test_napari_bridge_concurrent_requests(make_napari_viewer, qtbot):
+    # make viewer using our fixture
+    viewer = make_napari_viewer()
+
+    # Instantiate the bridge:
+    bridge = NapariBridge(viewer=viewer)
+
+    # Submit many requests concurrently, each one must get its own result back:
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = list(executor.map(
+            lambda i: bridge.submit(lambda v: (i, len(v.layers))),
+            range(32)))
+
+    qtbot.waitUntil(lambda: all(f.done() for f in futures), timeout=10000)
+
+    for i, future in enumerate(futures):
+        assert future.result() == (i, 0)
+
+    # Exceptions are propagated through the future:
+    failing_future = bridge.submit(lambda v: 1 / 0)
+    qtbot.waitUntil(failing_future.done, timeout=10000)
+    assert isinstance(failing_future.exception(), ZeroDivisionError)
+
+    bridge.stop()
+
+
+def test_napari_bridge_cancel(make_napari_viewer):
+    viewer = make_napari_viewer()
+
+    # Instantiate the bridge:
+    bridge = NapariBridge(viewer=viewer)
+
+    # Request is not processed until the QT event loop runs, so it can be cancelled:
+    future = bridge.submit(lambda v: 'never')
+    assert bridge.cancel(future.request_id)
+    assert future.cancelled()
+    assert bridge.number_of_pending_requests() == 0
+
+    bridge.stop()
+
+
+def test_napari_bridge_fair_sessions(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+
+    # Instantiate the bridge:
+    bridge = NapariBridge(viewer=viewer)
+
+    # Session 'a' floods the bridge before session 'b' sends its requests:
+    order = []
+    futures = [bridge.submit(lambda v, i=i: order.append(('a', i)), session_id='a') for i in range(8)]
+    futures += [bridge.submit(lambda v, i=i: order.append(('b', i)), session_id='b') for i in range(2)]
+
+    qtbot.waitUntil(lambda: all(f.done() for f in futures), timeout=10000)
+
+    # Requests of each session are executed in order:
+    assert [i for s, i in order if s == 'a'] == list(range(8))
+    assert [i for s, i in order if s == 'b'] == [0, 1]
+
+    # Session 'b' does not wait for all of session 'a' requests:
+    assert order.index(('b', 1)) < 6
+
+    # Per-session queue metrics:
+    metrics = bridge.session_metrics()
+    assert metrics['a']['enqueued'] == 8
+    assert metrics['b']['dequeued'] == 2
+    assert bridge.queue_depths() == {}
+
+    bridge.end_session('b')
+    assert 'b' not in bridge.session_metrics()
+
+    bridge.stop()
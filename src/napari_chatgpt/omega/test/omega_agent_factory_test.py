@@ -0,0 +1,68 @@
+import os
+
+from langchain_community.llms.fake import FakeListLLM
+
+from napari_chatgpt.chat_server.callbacks.callbacks_arbol_stdout import \
+    ArbolCallbackHandler
+from napari_chatgpt.omega.omega_agent_factory import OmegaAgentFactory
+from napari_chatgpt.omega.omega_init import build_omega_tools
+from napari_chatgpt.omega.omega_session import OmegaSession
+from napari_chatgpt.omega.tools.napari.viewer_query_tool import \
+    NapariViewerQueryTool
+from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
+from napari_chatgpt.utils.python import package_index
+
+
+def test_omega_agent_factory_binds_sessions(tmp_path):
+    factory = OmegaAgentFactory(napari_bridge=None,
+                                notebook=None,
+                                main_llm_model_name='fake',
+                                memory_type='infinite')
+
+    # Prebuilt LLMs and tools, without callbacks:
+    llm = FakeListLLM(responses=['...'])
+    tools = build_omega_tools(has_human_input_tool=False) + [NapariViewerQueryTool(llm=llm)]
+    factory._prebuilt = (llm, llm, llm, 4096, tools)
+
+    handler_1 = ArbolCallbackHandler('Session 1')
+    handler_2 = ArbolCallbackHandler('Session 2')
+    session_1 = OmegaSession(notebook=JupyterNotebookFile(notebook_folder_path=str(tmp_path)))
+    session_2 = OmegaSession(notebook=JupyterNotebookFile(notebook_folder_path=str(tmp_path)))
+    agent_1 = factory.create_agent(chat_callback_handler=handler_1, tool_callback_handler=handler_1, session=session_1)
+    agent_2 = factory.create_agent(chat_callback_handler=handler_2, tool_callback_handler=handler_2, session=session_2)
+
+    # Each session has its own tools bound to its own callbacks:
+    assert [t.name for t in agent_1.tools] == [t.name for t in tools]
+    assert all(t.callbacks == [handler_1] for t in agent_1.tools)
+    assert all(t.callbacks == [handler_2] for t in agent_2.tools)
+    assert agent_1.memory is not agent_2.memory
+
+    # Tools that talk to napari are tagged with their session:
+    session_tools = [t for t in agent_1.tools if 'session_id' in t.__fields__]
+    assert session_tools
+    assert all(t.session_id == session_1.session_id for t in session_tools)
+    assert all(t.session_id == session_2.session_id for t in agent_2.tools if 'session_id' in t.__fields__)
+
+    # Tools record code in their session's notebook:
+    assert all(t.notebook is session_1.notebook for t in agent_1.tools if 'notebook' in t.__fields__)
+    assert all(t.notebook is session_2.notebook for t in agent_2.tools if 'notebook' in t.__fields__)
+
+    # Prebuilt tools are left untouched:
+    assert all(t.callbacks is None for t in tools)
+
+
+def test_omega_agent_factory_invalidated_by_package_installs(tmp_path, monkeypatch):
+    factory = OmegaAgentFactory(napari_bridge=None,
+                                notebook=None,
+                                main_llm_model_name='fake',
+                                memory_type='infinite')
+    llm = FakeListLLM(responses=['...'])
+    factory._prebuilt = (llm, llm, llm, 4096, build_omega_tools(has_human_input_tool=False))
+    prebuilds = []
+    monkeypatch.setattr(factory, 'start_prebuild', lambda: prebuilds.append(1))
+
+    # Installing packages invalidates the prebuilt tools, which are built again:
+    monkeypatch.setattr(package_index, '_package_index_path', lambda: os.path.join(tmp_path, 'package_index.json'))
+    package_index.invalidate_package_index(rebuild=False)
+    assert factory._prebuilt is None
+    assert prebuilds == [1]
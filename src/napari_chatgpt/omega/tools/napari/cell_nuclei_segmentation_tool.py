@@ -10,6 +10,7 @@ from napari_chatgpt.omega.tools.napari.delegated_code.signatures import \
     classic_signature, stardist_signature, cellpose_signature
 from napari_chatgpt.omega.tools.napari.napari_base_tool import NapariBaseTool, \
     _get_delegated_code
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
 from napari_chatgpt.utils.python.conda_utils import conda_uninstall
 from napari_chatgpt.utils.python.dynamic_import import dynamic_import
 from napari_chatgpt.utils.python.pip_utils import pip_install, pip_uninstall
@@ -201,60 +202,68 @@ class CellNucleiSegmentationTool(NapariBaseTool):
 
     # generic_codegen_instructions: str = ''
 
-    def _run_code(self, request: str, code: str, viewer: Viewer) -> str:
+    two_phase_execution = True
 
-        try:
-            with asection(f"CellNucleiSegmentationTool: query= {request} "):
-                # prepare code:
-                code = super()._prepare_code(code,
-                                             do_fix_bad_calls=self.fix_bad_calls,
-                                             do_install_missing_packages=False
-                                             )
+    def _compute(self, request: str, code: str, viewer: ReadOnlyViewer):
+
+        with asection(f"CellNucleiSegmentationTool: query= {request} "):
+            # prepare code:
+            code = super()._prepare_code(code,
+                                         do_fix_bad_calls=self.fix_bad_calls,
+                                         do_install_missing_packages=False
+                                         )
 
-                # lower case code:
-                code_lower = code.lower()
+            # lower case code:
+            code_lower = code.lower()
 
-                # Pick the right segmentation code:
-                if 'cellpose_segmentation(' in code_lower:
-                    segmentation_code = _get_delegated_code('cellpose')
-                elif 'stardist_segmentation(' in code_lower:
-                    segmentation_code = _get_delegated_code('stardist')
-                elif 'classic_segmentation(' in code_lower:
-                    segmentation_code = _get_delegated_code('classic')
-                else:
-                    raise ValueError(f"Could not determine the segmentation function used!")
+            # Pick the right segmentation code:
+            if 'cellpose_segmentation(' in code_lower:
+                segmentation_code = _get_delegated_code('cellpose')
+            elif 'stardist_segmentation(' in code_lower:
+                segmentation_code = _get_delegated_code('stardist')
+            elif 'classic_segmentation(' in code_lower:
+                segmentation_code = _get_delegated_code('classic')
+            else:
+                raise ValueError(f"Could not determine the segmentation function used!")
 
 
-                # combine generated code and functions:
-                code = segmentation_code + '\n\n' + code
+            # combine generated code and functions:
+            code = segmentation_code + '\n\n' + code
 
-                with asection(f"Code:"):
-                    aprint(code)
+            with asection(f"Code:"):
+                aprint(code)
 
-                # Load the code as module:
-                loaded_module = dynamic_import(code)
+            # Load the code as module:
+            loaded_module = dynamic_import(code)
 
-                # get the function:
-                segment = getattr(loaded_module, 'segment')
+            # get the function:
+            segment = getattr(loaded_module, 'segment')
 
-                # Run segmentation:
-                with asection(f"Running segmentation..."):
-                    segmented_image = segment(viewer)
+            # Run segmentation, off napari's QT thread:
+            with asection(f"Running segmentation..."):
+                segmented_image = segment(viewer)
 
-                # At this point we assume the code ran successfully and we add it to the notebook:
-                if self.notebook:
-                    self.notebook.add_code_cell(code)
+            return code, segmented_image
 
+    def _commit(self, request: str, result, viewer: Viewer) -> str:
+
+        try:
+            code, segmented_image = result
 
-                # Add to viewer:
-                viewer.add_labels(segmented_image, name='segmented')
+            # At this point we assume the code ran successfully and we add it to the notebook:
+            if self.notebook:
+                self.notebook.add_code_cell(code)
 
-                # Message:
-                message = f"Success: image segmented and added to the viewer as a labels layer named 'segmented'."
 
-                aprint(f"Message: {message}")
+            # Add to viewer:
+            viewer.add_labels(segmented_image, name='segmented')
 
-                return message
+            # Message:
+            message = f"Success: image segmented and added to the viewer as a labels layer named 'segmented'."
+
+            aprint(f"Message: {message}")
+
+            return message
 
         except Exception as e:
             traceback.print_exc()
@@ -1,7 +1,7 @@
 from typing import Optional
 
 from napari.types import ArrayLike
-from numpy import zeros, uint32, ndarray
+from numpy import zeros, uint32, asarray
 from scipy.ndimage import label, distance_transform_edt, gaussian_filter
 from skimage.feature import peak_local_max
 from skimage.filters import (threshold_otsu, threshold_yen, threshold_li,
@@ -12,6 +12,9 @@ from skimage.morphology import closing, disk, ball, remove_small_objects, \
     erosion, opening
 from skimage.segmentation import watershed
 
+# Images with more voxels than this are segmented tile by tile (2 GB as float64):
+_tiling_size_threshold = 2 ** 28
+
 
 ### SIGNATURE
 def classic_segmentation(image: ArrayLike,
@@ -24,7 +27,10 @@ def classic_segmentation(image: ArrayLike,
                          closing_steps: int = 1,
                          opening_steps: int = 0,
                          apply_watershed: bool = False,
-                         min_distance: int = 15) -> ndarray:
+                         min_distance: int = 15,
+                         tiled: Optional[bool] = None,
+                         tile_size: int = 256,
+                         max_workers: Optional[int] = None) -> ArrayLike:
     """
     Classic cell segmentation function.
 
@@ -65,14 +71,44 @@ def classic_segmentation(image: ArrayLike,
     min_distance: Optional[int]
             Minimum number of pixels separating peaks in a region of `2 * min_distance + 1`
 
+    tiled: Optional[bool]
+            If True, the image is segmented tile by tile on a pool of processes, for images that do not fit in memory.
+            If None, tiling is used for large images, whether numpy, zarr, or dask arrays. Tiling does not support watershed.
+
+    tile_size: int
+            Size of the tiles along each dimension, in tiled mode.
+
+    max_workers: Optional[int]
+            Number of processes used in tiled mode, by default the number of CPUs, at most one per tile.
+
     Returns
     -------
     Segmented image as a labels array that can be added to napari as a Labels layer.
 
     """
 
-    # Convert image to float
-    image = image.astype(float, copy=False)
+    # Large images are segmented tile by tile, whatever the type of array:
+    if tiled is None:
+        tiled = not apply_watershed and 2 <= image.ndim <= 3 and image.size > _tiling_size_threshold
+    if tiled:
+        if apply_watershed:
+            raise ValueError("Watershed is not available for tiled segmentation.")
+        from napari_chatgpt.utils.segmentation.tiled_segmentation import \
+            tiled_classic_segmentation
+        return tiled_classic_segmentation(image,
+                                          threshold_type=threshold_type,
+                                          normalize=normalize,
+                                          norm_range_low=norm_range_low,
+                                          norm_range_high=norm_range_high,
+                                          min_segment_size=min_segment_size,
+                                          erosion_steps=erosion_steps,
+                                          closing_steps=closing_steps,
+                                          opening_steps=opening_steps,
+                                          tile_size=tile_size,
+                                          max_workers=max_workers)
+
+    # Convert image to float, lazy arrays (zarr, dask, ...) are read in memory:
+    image = asarray(image).astype(float, copy=False)
 
     # # Remove background:
     # background_scale = 50
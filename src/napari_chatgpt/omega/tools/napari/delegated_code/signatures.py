@@ -25,6 +25,7 @@ def stardist_segmentation(image: ArrayLike,
 
 classic_signature = """
 # Classic segmentation is a simple thresholding method that can be used as a baseline and works in 2D, 3D and more dimensions.
+# Large images, and zarr or dask arrays, are segmented tile by tile in parallel (tiled=None), which does not support watershed.
 def classic_segmentation(image: ArrayLike,
                           threshold_type: str = 'otsu',
                           normalize: Optional[bool] = True,
@@ -35,6 +36,7 @@ def classic_segmentation(image: ArrayLike,
                           closing_steps: int = 1,
                           opening_steps: int = 0,
                           apply_watershed: bool = False,
-                          min_distance: int = 10) -> ArrayLike
+                          min_distance: int = 10,
+                          tiled: Optional[bool] = None) -> ArrayLike
 ```
 """
\ No newline at end of file
@@ -77,6 +77,47 @@ def test_classsic_3d(show_viewer: bool = False):
     napari.run()
 
 
+
+def test_classic_tiled():
+    import dask.array
+    import numpy
+    from scipy.ndimage import gaussian_filter
+
+    # Blobs, some of them across tile boundaries:
+    rng = numpy.random.default_rng(0)
+    image = numpy.zeros((48, 96, 96), dtype=numpy.float32)
+    for z, y, x in rng.integers(4, [44, 92, 92], size=(30, 3)):
+        image[z - 3:z + 4, y - 5:y + 6, x - 5:x + 6] = 1
+    image = gaussian_filter(image, 1) + 0.05 * rng.random(image.shape)
+
+    # Reference, in memory:
+    labels = classic_segmentation(image, tiled=False)
+
+    # Tiled, in one process and on a pool of processes, on numpy and dask arrays:
+    for tiled_image, max_workers in ((image, 1), (dask.array.from_array(image, chunks=16), 2)):
+        tiled_labels = classic_segmentation(tiled_image, tiled=True, tile_size=32, max_workers=max_workers)
+
+        # Labels that fit in memory are returned as numpy arrays:
+        assert isinstance(tiled_labels, numpy.ndarray)
+
+        # Same segments, up to numbering:
+        assert ((tiled_labels > 0) == (labels > 0)).mean() > 0.999
+        assert len(unique(tiled_labels)) == len(unique(labels))
+        both = (labels > 0) & (tiled_labels > 0)
+        pairs = unique(numpy.stack([labels[both], tiled_labels[both]]), axis=1)
+        assert pairs.shape[1] == len(unique(labels)) - 1
+
+    # Small lazy images are segmented in memory, without tiling:
+    labels_from_dask = classic_segmentation(dask.array.from_array(image, chunks=16))
+    assert isinstance(labels_from_dask, numpy.ndarray)
+    assert (labels_from_dask == labels).all()
+
+    # Constant images have no segments, as without tiling:
+    constant_image = numpy.ones((64, 64))
+    assert classic_segmentation(constant_image, tiled=False).max() == 0
+    assert classic_segmentation(constant_image, tiled=True, tile_size=32, max_workers=1).max() == 0
+
+
 if __name__ == '__main__':
     test_classsic_2d(show_viewer=True)
-    test_classsic_3d(show_viewer=True)
\ No newline at end of file
+    test_classsic_3d(show_viewer=True)
@@ -1,20 +1,22 @@
-# Function that checks if the packages stardist or napari-stardist are installed:
+from importlib.util import find_spec
+
 from arbol import aprint
 
 
+# Function that checks if the packages stardist or napari-stardist are installed.
+# The package is located but not imported, importing stardist pulls in TensorFlow:
 def check_stardist_installed() -> bool:
-    try:
-        import stardist
-        return True
-    except ImportError:
-        return False
+    return _is_module_available('stardist')
 
 # Function that checks if the packages cellpose or cellpose-napari are installed:
 def check_cellpose_installed() -> bool:
+    return _is_module_available('cellpose')
+
+
+def _is_module_available(module_name: str) -> bool:
     try:
-        import cellpose
-        return True
-    except ImportError:
+        return find_spec(module_name) is not None
+    except (ImportError, ValueError):
         return False
 
 
@@ -9,6 +9,7 @@ from napari import Viewer
 
 from napari_chatgpt.omega.tools.napari.napari_base_tool import NapariBaseTool, \
     _get_delegated_code
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
 from napari_chatgpt.utils.python.dynamic_import import dynamic_import
 from napari_chatgpt.utils.python.pip_utils import pip_install
 
@@ -115,58 +116,65 @@ class ImageDenoisingTool(NapariBaseTool):
     prompt = _image_denoising_prompt
     instructions = _instructions
     save_last_generated_code = False
+    two_phase_execution = True
 
     # generic_codegen_instructions: str = ''
 
-    def _run_code(self, request: str, code: str, viewer: Viewer) -> str:
+    def _compute(self, request: str, code: str, viewer: ReadOnlyViewer):
 
-        try:
-            with asection(f"ImageDenoisingTool: query= {request} "):
-                # prepare code:
-                code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+        with asection(f"ImageDenoisingTool: query= {request} "):
+            # prepare code:
+            code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+
+            # lower case code:
+            code_lower = code.lower()
+
+            # Pick the right denoising code:
+            if 'aydin_classic_denoising(' in code_lower:
+                install_aydin(ask_permission_function=self._ask_permission_to_install)
+                denoising_code = _get_delegated_code('aydin_classic')
+            elif 'aydin_fgr_denoising(' in code_lower:
+                install_aydin(ask_permission_function=self._ask_permission_to_install)
+                denoising_code = _get_delegated_code('aydin_fgr')
+            else:
+                raise ValueError(f"Could not determine the denoising function used!")
 
-                # lower case code:
-                code_lower = code.lower()
+            # combine generated code and functions:
+            code = denoising_code + '\n\n' + code
 
-                # Pick the right denoising code:
-                if 'aydin_classic_denoising(' in code_lower:
-                    install_aydin()
-                    denoising_code = _get_delegated_code('aydin_classic')
-                elif 'aydin_fgr_denoising(' in code_lower:
-                    install_aydin()
-                    denoising_code = _get_delegated_code('aydin_fgr')
-                else:
-                    raise ValueError(f"Could not determine the denoising function used!")
+            with asection(f"Code:"):
+                aprint(code)
 
-                # combine generated code and functions:
-                code = denoising_code + '\n\n' + code
+            # Load the code as module:
+            loaded_module = dynamic_import(code)
 
-                with asection(f"Code:"):
-                    aprint(code)
+            # get the function:
+            denoise = getattr(loaded_module, 'denoise')
 
-                # Load the code as module:
-                loaded_module = dynamic_import(code)
+            # Run denoising, off napari's QT thread:
+            with asection(f"Running image denoising..."):
+                denoised_image = denoise(viewer)
 
-                # get the function:
-                denoise = getattr(loaded_module, 'denoise')
+            return code, denoised_image
 
-                # At this point we assume the code ran successfully and we add it to the notebook:
-                if self.notebook:
-                    self.notebook.add_code_cell(code)
+    def _commit(self, request: str, result, viewer: Viewer) -> str:
+
+        try:
+            code, denoised_image = result
 
-                # Run denoising:
-                with asection(f"Running image denoising..."):
-                    denoised_image = denoise(viewer)
+            # At this point we assume the code ran successfully and we add it to the notebook:
+            if self.notebook:
+                self.notebook.add_code_cell(code)
 
-                # Add to viewer:
-                viewer.add_image(denoised_image, name='denoised')
+            # Add to viewer:
+            viewer.add_image(denoised_image, name='denoised')
 
-                # Message:
-                message = f"Success: image denoised and added to the viewer as layer 'denoised'. "
+            # Message:
+            message = f"Success: image denoised and added to the viewer as layer 'denoised'. "
 
-                aprint(f"Message: {message}")
+            aprint(f"Message: {message}")
 
-                return message
+            return message
 
         except Exception as e:
             traceback.print_exc()
@@ -175,7 +183,7 @@ class ImageDenoisingTool(NapariBaseTool):
 
 
 @cache
-def install_aydin():
+def install_aydin(ask_permission_function=None):
     with asection(f"Installing Aydin if not already present."):
         message = ''
         if platform.system() == 'Darwin':
@@ -183,7 +191,8 @@ def install_aydin():
                 aprint('Cannot install Aydin on M1/M2 macs!')
                 raise NotImplementedError('Cannot install Aydin on M1/M2 macs!')
 
-        message += pip_install(['aydin'])
+        message += pip_install(['aydin'],
+                               ask_permission_function=ask_permission_function)
 
 
 
@@ -1,9 +1,10 @@
 
 import sys
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from queue import Queue
-from typing import Union, Optional
+from typing import Union, Optional, Any
 
 from arbol import aprint, asection
 from langchain.chains import LLMChain
@@ -14,15 +15,19 @@ from langchain_core.prompts import PromptTemplate
 from napari import Viewer
 from pydantic import Field
 
-from napari_chatgpt.omega.napari_bridge import _get_viewer_info
+from napari_chatgpt.llm.llms import bind_llm_callbacks
+from napari_chatgpt.omega.memory.long_term_memory import LongTermMemory
+from napari_chatgpt.omega.napari_bridge import NapariBridge
 from napari_chatgpt.omega.tools.async_base_tool import AsyncBaseTool
 from napari_chatgpt.omega.tools.instructions import \
     omega_generic_codegen_instructions
+from napari_chatgpt.utils.llm.prompt_budget import PromptSection, \
+    assemble_prompt_sections, select_relevant_packages, select_relevant_layers
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
 from napari_chatgpt.utils.python.consolidate_imports import consolidate_imports
 from napari_chatgpt.utils.python.dynamic_import import execute_as_module
 from napari_chatgpt.utils.python.exception_description import \
     exception_description
-from napari_chatgpt.utils.python.exception_guard import ExceptionGuard
 from napari_chatgpt.utils.python.fix_bad_fun_calls import \
     fix_all_bad_function_calls
 from napari_chatgpt.utils.python.fix_code_given_error import \
@@ -32,13 +37,27 @@ from napari_chatgpt.utils.python.installed_packages import \
 from napari_chatgpt.utils.python.missing_packages import required_packages
 from napari_chatgpt.utils.python.pip_utils import pip_install
 from napari_chatgpt.utils.python.required_imports import required_imports
+from napari_chatgpt.utils.qt.package_dialog import install_packages_dialog
 from napari_chatgpt.utils.strings.extract_code import extract_code_from_markdown
 from napari_chatgpt.utils.strings.filter_lines import filter_lines
 from napari_chatgpt.utils.system.information import system_info
 
 
+# Thread pool for the concurrent stages of code preparation:
+_prepare_code_thread_pool = ThreadPoolExecutor()
+
+
+def _timed(timings: dict, stage: str, function, *args, **kwargs):
+    # Calls the function and records its wall-clock time:
+    start = time.monotonic()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        timings[stage] = time.monotonic() - start
+
+
 class NapariBaseTool(AsyncBaseTool):
-    """A base tool for that delegates to execution to a sub-LLM and communicates with napari via queues."""
+    """A base tool for that delegates to execution to a sub-LLM and communicates with napari via the napari bridge."""
 
     name: str = "<NAME>"
     description: str = (
@@ -49,8 +68,14 @@ class NapariBaseTool(AsyncBaseTool):
     code_prefix: str = ''
     instructions: str = omega_generic_codegen_instructions
     prompt: str = None
-    to_napari_queue: Queue = Field(default=None)
-    from_napari_queue: Queue = Field(default=None)
+    napari_bridge: NapariBridge = Field(default=None)
+    napari_timeout: Optional[float] = None
+    # ID of the chat session this tool is bound to, tags the requests sent to napari:
+    session_id: Optional[str] = None
+    # Long-term memory in which generated code and tool outputs are recorded:
+    long_term_memory: Optional[LongTermMemory] = None
+    # Maximum number of tokens of the prompt's sections, None for no limit:
+    prompt_token_budget: Optional[int] = None
     llm: Union[BaseChatModel, LLM, BaseLanguageModel] = Field(default=None)
     return_direct: bool = False
     save_last_generated_code: bool = True
@@ -59,6 +84,9 @@ class NapariBaseTool(AsyncBaseTool):
     install_missing_packages = True
     fix_bad_calls = False
 
+    # If True, the tool implements _compute() and _commit() instead of _run_code():
+    two_phase_execution = False
+
     verbose = False
 
     last_generated_code: Optional[str] = None
@@ -82,34 +110,55 @@ class NapariBaseTool(AsyncBaseTool):
             package_list = installed_package_list()
 
             if self.last_generated_code:
-                last_generated_code = "**Previously Generated Code:**\n",
-                last_generated_code += ("Use this code for reference, usefull if you need to modify or fix the code. ",
-                                        "IMPORTANT: This code might not be relevant to the current request or task! "
-                                        "You should ignore it, unless you are explicitely asked to fix or modify the last generated widget!",
-                                         "```python\n",
-                                         self.last_generated_code + '\n',
-                                         "```\n"
-                                        )
+                last_generated_code = ("**Previously Generated Code:**\n"
+                                       "Use this code for reference, usefull if you need to modify or fix the code. "
+                                       "IMPORTANT: This code might not be relevant to the current request or task! "
+                                       "You should ignore it, unless you are explicitely asked to fix or modify the last generated widget!"
+                                       "```python\n"
+                                       + self.last_generated_code + '\n'
+                                       "```\n")
             else:
                 last_generated_code = ''
 
-            # Adding information about packages and Python version to instructions:
+            # Generic instructions, the list of packages is a section of its own:
+            python_version = str(sys.version.split()[0])
+            generic_instructions = omega_generic_codegen_instructions.format(python_version=python_version,
+                                                                             packages='')
+
+            # Sections of the prompt, trimmed by priority to fit the token budget,
+            # the highest priority numbers are trimmed first:
+            sections = {
+                'input': PromptSection(query),
+                'instructions': PromptSection(generic_instructions + self.instructions),
+                'packages': PromptSection(', '.join(package_list), priority=4,
+                                          trim=lambda text, budget: ', '.join(select_relevant_packages(package_list, query))),
+                'last_generated_code': PromptSection(last_generated_code, priority=2),
+                'viewer_information': PromptSection(self._get_viewer_info(), priority=3,
+                                                    trim=lambda text, budget: select_relevant_layers(text, query)),
+                'system_information': PromptSection(system_info(add_python_info=False), priority=5),
+            }
+            texts = assemble_prompt_sections(sections,
+                                             budget=self.prompt_token_budget,
+                                             model_name=getattr(self.llm, 'model_name', None),
+                                             name=f'{self.name} prompt')
+
+            # Adding information about packages and Python version to instructions,
+            # generic instructions are prepended to tool specific instructions:
             filled_generic_instructions = omega_generic_codegen_instructions.format(
-                python_version=str(sys.version.split()[0]),
-                packages=', '.join(package_list))
-
-            # Prepend generic instructions to tool specific instructions:
+                python_version=python_version,
+                packages=texts['packages'])
             instructions = filled_generic_instructions + self.instructions
 
             # Variable for prompt:
             variables = {"input": query,
                          "instructions": instructions,
-                         "last_generated_code": last_generated_code,
-                         "viewer_information": "For reference, below is information about the current state of the napari viewer: \n"+_get_viewer_info(),
-                         "system_information": "For reference, below is information about the current system: \n"+system_info(add_python_info=False)
+                         "last_generated_code": texts['last_generated_code'],
+                         "viewer_information": "For reference, below is information about the current state of the napari viewer: \n"+texts['viewer_information'],
+                         "system_information": "For reference, below is information about the current system: \n"+texts['system_information']
                          }
 
             # call LLM:
+            self._notify_tool_phase('generating_code')
             code = chain.invoke(variables)['text']
 
             aprint(f"code:\n{code}")
@@ -121,20 +170,25 @@ class NapariBaseTool(AsyncBaseTool):
         if self.save_last_generated_code:
             self.last_generated_code = code
 
+        # Tools that separate compute from commit do not block napari's QT thread while computing:
+        if self.two_phase_execution:
+            response = self._run_in_two_phases(query, code)
+            self._remember(query, code, response)
+            return response
+
         # Setting up delegated fuction:
         delegated_function = lambda v: self._run_code(query, code, v)
 
-        # Send code to napari:
-        self.to_napari_queue.put(delegated_function)
-
-        # Get response:
-        response = self.from_napari_queue.get()
-
-        if isinstance(response, ExceptionGuard):
-            exception_guard = response
-            # raise exception_guard.exception
-            return f"Error: {exception_guard.exception_type_name} with message: '{str(exception_guard.exception)}' while using tool: {self.__class__.__name__} ."
+        try:
+            # Send code to napari and wait for the response to this specific request:
+            self._notify_tool_phase('executing')
+            response = self.napari_bridge.execute(delegated_function,
+                                                  timeout=self.napari_timeout,
+                                                  session_id=self.session_id)
+        except Exception as e:
+            return f"Error: {type(e).__name__} with message: '{str(e)}' while using tool: {self.__class__.__name__} ."
 
+        self._remember(query, code, response)
         return response
 
     def _run_code(self, query: str, code: str, viewer: Viewer) -> str:
@@ -144,6 +198,92 @@ class NapariBaseTool(AsyncBaseTool):
         """
         raise NotImplementedError("This method must be implemented")
 
+    def _run_in_two_phases(self, query: str, code: str) -> str:
+
+        try:
+            # Take a read-only snapshot of the viewer on napari's QT thread:
+            viewer = self.napari_bridge.execute(ReadOnlyViewer,
+                                                timeout=self.napari_timeout,
+                                                session_id=self.session_id)
+
+            # Compute phase, runs here on the tool's worker thread:
+            with asection(f"{type(self).__name__}: compute phase"):
+                self._notify_tool_phase('computing')
+                result = self._compute(query, code, viewer)
+
+            # Commit phase, runs on napari's QT thread:
+            with asection(f"{type(self).__name__}: commit phase"):
+                self._notify_tool_phase('executing')
+                return self.napari_bridge.execute(lambda v: self._commit(query, result, v),
+                                                  timeout=self.napari_timeout,
+                                                  session_id=self.session_id)
+
+        except Exception as e:
+            traceback.print_exc()
+            return f"Error: {type(e).__name__} with message: '{str(e)}' while using tool: {self.__class__.__name__} ."
+
+    def _compute(self, query: str, code: str, viewer: ReadOnlyViewer) -> Any:
+        """
+        Compute phase, runs off napari's QT thread with read-only access to the viewer and its layers.
+        Heavy work (LLM calls, package installs, image processing) belongs here.
+        By default, the generated code is prepared and returned for the commit phase.
+        """
+        return self._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+
+    def _commit(self, query: str, result: Any, viewer: Viewer) -> str:
+        """
+        Commit phase, runs on napari's QT thread and receives the result of the compute phase.
+        Should be short: adding or updating layers, widgets, etc.
+        Must return 'Success: ...' if things went well, otherwise it is failure!
+        """
+        raise NotImplementedError("This method must be implemented")
+
+    def _ask_permission_to_install(self, packages) -> bool:
+        # Dialogs must be shown on napari's QT thread:
+        if self.two_phase_execution:
+            return self.napari_bridge.execute(lambda v: install_packages_dialog(packages=packages),
+                                              session_id=self.session_id)
+        return install_packages_dialog(packages=packages)
+
+    def _notify_tool_phase(self, phase: str):
+        # Callback handlers that support it are notified of the tool's progress, for example to update the chat client:
+        handlers = getattr(self.callbacks, 'handlers', self.callbacks) or []
+        for handler in handlers:
+            if hasattr(handler, 'on_tool_phase'):
+                try:
+                    handler.on_tool_phase(self.name, phase)
+                except Exception:
+                    traceback.print_exc()
+
+    def _helper_llm(self):
+        # Helper chains (missing imports, missing packages, error fixes) must not stream into the session's tool output,
+        # only the code generation chain does, so they get a copy of the LLM without callbacks:
+        if self.llm is None or not getattr(self.llm, 'callbacks', None):
+            return self.llm
+        return bind_llm_callbacks(self.llm, None)
+
+    def _remember(self, query: str, code: Optional[str], response: Any):
+        # Records the generated code and the tool's output in the long-term memory, for later recall:
+        if self.long_term_memory is None:
+            return
+        try:
+            if code:
+                self.long_term_memory.add('code',
+                                          f"Request to {self.name}: {query}\n```python\n{extract_code_from_markdown(code)}\n```",
+                                          tool=self.name)
+            if isinstance(response, str):
+                self.long_term_memory.add('tool_output',
+                                          f"Request to {self.name}: {query}\nOutput: {response}",
+                                          tool=self.name)
+        except Exception:
+            traceback.print_exc()
+
+    def _get_viewer_info(self) -> str:
+        # Up-to-date viewer information, cheap unless the viewer changed:
+        if self.napari_bridge:
+            return self.napari_bridge.get_viewer_info(session_id=self.session_id) or ''
+        return ''
+
     def _get_prompt_template(self):
 
         prompt_template = PromptTemplate(template=self.prompt,
@@ -166,6 +306,8 @@ class NapariBaseTool(AsyncBaseTool):
             with asection(f"code to prepare:"):
                 aprint(code)
 
+            self._notify_tool_phase('preparing_code')
+
             # extract code from markdown:
             if markdown:
                 code = extract_code_from_markdown(code)
@@ -176,9 +318,33 @@ class NapariBaseTool(AsyncBaseTool):
             # Add spaces around code:
             code = '\n\n' + code + '\n\n'
 
-            if self.fix_imports and do_fix_imports:
+            # Per-stage wall-clock timings:
+            timings = {}
+            start = time.monotonic()
+
+            do_fix_imports = self.fix_imports and do_fix_imports
+            do_install_missing_packages = self.install_missing_packages and do_install_missing_packages
+
+            # Missing imports and missing packages are independent analyses of the code,
+            # so the LLM requests are made concurrently. Suggested imports are only kept
+            # if importable, so they never introduce new packages to install:
+            helper_llm = self._helper_llm()
+            imports_future = _prepare_code_thread_pool.submit(_timed, timings, 'required_imports',
+                                                              required_imports, code, llm=helper_llm) if do_fix_imports else None
+            packages_future = _prepare_code_thread_pool.submit(_timed, timings, 'required_packages',
+                                                               required_packages, code, llm=helper_llm) if do_install_missing_packages else None
+
+            if do_install_missing_packages:
+                # Are there missing libraries that need to be installed?
+                packages = packages_future.result()
+
+                # Install them, before fixing function calls as this requires importing them:
+                _timed(timings, 'pip_install', pip_install, packages,
+                       ask_permission_function=self._ask_permission_to_install)
+
+            if do_fix_imports:
                 # Are there any missing imports?
-                imports = required_imports(code, llm=self.llm)
+                imports = imports_future.result()
 
                 # prepend missing imports:
                 code = '\n'.join(imports) + '\n\n' + code
@@ -191,30 +357,26 @@ class NapariBaseTool(AsyncBaseTool):
 
             # Fix code, this takes care of wrong function calls and more:
             if self.fix_bad_calls and do_fix_bad_calls:
-                code, fixed, _ = fix_all_bad_function_calls(code)
+                code, fixed, _ = _timed(timings, 'fix_bad_function_calls', fix_all_bad_function_calls, code)
 
                 if fixed:
                     # notify that code was fixed for bad calls:
                     code = "# Note: code was modified to fix bad function calls.\n" + code
 
-
-
             # Remove any offending lines:
             code = filter_lines(code,
                                 ['napari.Viewer(', '= Viewer(', 'gui_qt(', 'viewer.window.add_dock_widget('])
 
+            if do_install_missing_packages and len(packages) > 0:
+                # Notify that some packages might be missing and that Omega attempted to install them:
+                code = f"# Note: some packages ({','.join(packages)}) might be missing and Omega attempted to install them.\n" + code
+
             with asection(f"code after all preparations and fixes:"):
                 aprint(code)
 
-            if self.install_missing_packages and do_install_missing_packages:
-                # Are there missing libraries that need to be installed?
-                packages = required_packages(code, llm=self.llm)
-
-                # Install them:
-                pip_install(packages)
-
-                # Notify that some packages might be missing and that Omega attempted to install them:
-                code = f"# Note: some packages ({','.join(packages)}) might be missing and Omega attempted to install them.\n" + code
+            with asection(f"Code preparation timings (total: {time.monotonic() - start:.2f}s):"):
+                for stage, duration in timings.items():
+                    aprint(f"{stage}: {duration:.2f}s")
 
             # Return fully prepared and fixed code:
             return code
@@ -231,7 +393,12 @@ class NapariBaseTool(AsyncBaseTool):
 
                 # Run the code:
                 aprint(f"Code:\n{code}")
-                captured_output = execute_as_module(code, viewer=viewer)
+                try:
+                    captured_output = execute_as_module(code, viewer=viewer)
+                finally:
+                    # Generated code can modify layer data in place without emitting any event:
+                    if self.napari_bridge:
+                        self.napari_bridge.viewer_state.invalidate()
 
                 # Come up with a filename:
                 filename = f"generated_code_{self.__class__.__name__}.py"
@@ -255,7 +422,7 @@ class NapariBaseTool(AsyncBaseTool):
                                                           error=description,
                                                           instructions=instructions,
                                                           viewer=viewer,
-                                                          llm=self.llm,
+                                                          llm=self._helper_llm(),
                                                           verbose=self.verbose)
                 # We try again:
                 return self._run_code_catch_errors_fix_and_try_again(fixed_code,
@@ -87,15 +87,15 @@ class NapariViewerExecutionTool(NapariBaseTool):
     instructions = _instructions
     code_prefix = _code_prefix
     save_last_generated_code = False
+    two_phase_execution = True
 
-    def _run_code(self, request: str, code: str, viewer: Viewer) -> str:
+    def _commit(self, request: str, code: str, viewer: Viewer) -> str:
 
+        # The code has been prepared off napari's QT thread (default compute phase),
+        # it modifies the viewer so it is run here on napari's QT thread:
         try:
             with asection(f"NapariViewerControlTool: request= {request} "):
 
-                # Prepare code:
-                code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
-
                 captured_output = self._run_code_catch_errors_fix_and_try_again(code,
                                                                            viewer=viewer,
                                                                            instructions=self.instructions,
@@ -115,7 +115,3 @@ class NapariViewerExecutionTool(NapariBaseTool):
         except Exception as e:
             traceback.print_exc()
             return f"Error: {type(e).__name__} with message: '{str(e)}' occured while fullfiling request. " #\n```python\n{code}\n```\n
-
-
-
-
@@ -1,12 +1,11 @@
 """A tool for controlling a napari instance."""
 import traceback
-from contextlib import redirect_stdout
-from io import StringIO
 
 from arbol import asection, aprint
 from napari import Viewer
 
 from napari_chatgpt.omega.tools.napari.napari_base_tool import NapariBaseTool
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
 from napari_chatgpt.utils.python.dynamic_import import dynamic_import
 
 _napari_viewer_query_prompt = """
@@ -39,6 +38,7 @@ To answer the request, you need to implement a Python function called `query(vie
 _instructions =\
 """
 - DO NOT call the 'query(viewer)' function yourself.
+- The answer must be returned by the 'query(viewer)' function, DO NOT print it: printed output is not part of the answer.
 - Please provide your answer in Markdown format.
 
 **Instructions to help you determine which layer is referred to:**
@@ -78,45 +78,43 @@ class NapariViewerQueryTool(NapariBaseTool):
     prompt = _napari_viewer_query_prompt
     instructions = _instructions
     save_last_generated_code = False
+    two_phase_execution = True
 
-    def _run_code(self, query: str, code: str, viewer: Viewer) -> str:
+    def _compute(self, query: str, code: str, viewer: ReadOnlyViewer):
 
-        try:
-            with asection(f"NapariViewerQueryTool: query= {query} "):
-                # prepare code:
-                code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+        with asection(f"NapariViewerQueryTool: query= {query} "):
+            # prepare code:
+            code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+
+            # Load the code as module:
+            loaded_module = dynamic_import(code)
 
-                # Load the code as module:
-                loaded_module = dynamic_import(code)
+            # get the function:
+            query_function = getattr(loaded_module, 'query')
 
-                # get the function:
-                query_function = getattr(loaded_module, 'query')
+            # Run query code, off napari's QT thread. Standard output is not captured, as it is shared
+            # with other threads, such as other sessions' tools: the answer is the returned value:
+            response = query_function(viewer)
 
-                # Redirect output:
-                f = StringIO()
-                with redirect_stdout(f):
-                    # Run query code:
-                    response = query_function(viewer)
+            return code, response
 
-                    # Add successfully run code to notebook:
-                    if self.notebook:
-                        self.notebook.add_code_cell(code+'\n\nquery(viewer)')
+    def _commit(self, query: str, result, viewer: Viewer) -> str:
 
-                # Get captured stdout:
-                captured_output = f.getvalue()
+        try:
+            code, response = result
 
-                # Message:
-                if len(captured_output) > 0:
-                    message = f"Tool completed query successfully, here is the response:\n\n{response}\n\nand the captured standard output:\n\n{captured_output}\n\n"
-                else:
-                    message = f"Tool completed query successfully, here is the response:\n\n{response}\n\n"
+            # Add successfully run code to notebook:
+            if self.notebook:
+                self.notebook.add_code_cell(code+'\n\nquery(viewer)')
 
-                with asection(f"Message:"):
-                    aprint(message)
+            # Message:
+            message = f"Tool completed query successfully, here is the response:\n\n{response}\n\n"
 
-                return message
+            with asection(f"Message:"):
+                aprint(message)
+
+            return message
 
         except Exception as e:
             traceback.print_exc()
             return f"Error: {type(e).__name__} with message: '{str(e)}' occured while trying to query the napari viewer."  #with code:\n```python\n{code}\n```\n.
-
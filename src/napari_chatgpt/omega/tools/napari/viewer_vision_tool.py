@@ -1,14 +1,15 @@
 """A tool for controlling a napari instance."""
 import re
-import tempfile
 import traceback
 from typing import Optional
 
 from arbol import asection, aprint
 from napari import Viewer
+from napari.layers import Image as ImageLayer, Labels
 
 from napari_chatgpt.omega.tools.napari.napari_base_tool import NapariBaseTool
-from napari_chatgpt.utils.napari.layer_snapshot import capture_canvas_snapshot
+from napari_chatgpt.utils.napari.layer_thumbnail import render_layer_thumbnail
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
 from napari_chatgpt.utils.openai.gpt_vision import describe_image
 
 
@@ -36,15 +37,14 @@ class NapariViewerVisionTool(NapariBaseTool):
     )
     prompt: str = None
     instructions: str = None
+    two_phase_execution = True
 
-    def _run_code(self, query: str, code: str, viewer: Viewer) -> str:
+    def _compute(self, query: str, code: str, viewer: ReadOnlyViewer) -> str:
+        # Layers are rendered from their data, and described, off napari's QT thread:
 
         try:
             with (((asection(f"NapariViewerVisionTool: query= '{query}' ")))):
 
-                import napari
-                from PIL import Image
-
                 # list of layers in the viewer:
                 present_layer_names = list(layer.name for layer in viewer.layers)
 
@@ -78,16 +78,15 @@ class NapariViewerVisionTool(NapariBaseTool):
                         augmented_query = f"Here is an image. {query}"
 
                         # Get the description of the image of the layer:
-                        message = _get_layer_image_description(viewer=viewer,
-                                                               query=augmented_query,
-                                                               layer_name=layer_name,
-                                                               reset_view=True)
+                        message = self._get_layer_image_description(viewer=viewer,
+                                                                    query=augmented_query,
+                                                                    layer_name=layer_name)
                     elif 'selected' in layer_name or 'active' in layer_name or 'current' in layer_name:
                         # Augmented query:
                         augmented_query = f"Here is an image. {query}"
 
                         # Get the description of the image of the selected layer:
-                        message = _get_description_for_selected_layer(query=augmented_query, viewer=viewer, reset_view=True)
+                        message = self._get_description_for_selected_layer(query=augmented_query, viewer=viewer)
                     else:
                         message = f"Tool did not succeed because no layer '{layer_name}' exists or no layer is selected."
 
@@ -95,8 +94,7 @@ class NapariViewerVisionTool(NapariBaseTool):
                     # Augmented query:
                     augmented_query = f"Here is an image. {query}"
 
-                    message = _get_description_for_whole_canvas(query=augmented_query,
-                                                                viewer=viewer)
+                    message = self._get_description_for_whole_canvas(query=augmented_query)
 
                     message = f"The following is the description of the contents of the whole canvas: '{message}'"
 
@@ -109,97 +107,101 @@ class NapariViewerVisionTool(NapariBaseTool):
             traceback.print_exc()
             return f"Error: {type(e).__name__} with message: '{str(e)}' occured while trying to query the napari viewer."  #with code:\n```python\n{code}\n```\n.
 
-def _get_description_for_selected_layer(query, viewer, reset_view:bool = False):
-    with asection(f"Getting description for selected layer. "):
-        aprint(f"Query: '{query}'")
+    def _commit(self, query: str, result: str, viewer: Viewer) -> str:
+        # Nothing to change in the viewer:
+        return result
+
+    def _get_description_for_selected_layer(self, query, viewer):
+        with asection(f"Getting description for selected layer. "):
+            aprint(f"Query: '{query}'")
+
+            # Get the selected layers
+            selected_layers = viewer.layers.selection
+            # Check if there is exactly one selected layer
+            if len(selected_layers) == 0:
+
+                # In this case we default to the first layer if there is at least one layer:
+                if len(viewer.layers) > 0:
+                    first_layer = viewer.layers[0]
+                    first_layer_name = first_layer.name
+                    aprint(
+                        f"No layer is selected, defaulting to first layer: '{first_layer_name}'")
+
+                    message = self._get_layer_image_description(
+                        viewer=viewer,
+                        query=query,
+                        layer_name=first_layer_name)
+                else:
+                    message = f"Tool did not succeed because no layer is selected and there are no layers in the viewer."
 
-        # Get the selected layers
-        selected_layers = viewer.layers.selection
-        # Check if there is exactly one selected layer
-        if len(selected_layers) == 0:
+            elif selected_layers.active is not None:
+                selected_layer_name = selected_layers.active.name
+                aprint(f"Active selected layer: '{selected_layer_name}'")
 
-            # In this case we default to the first layer if there is at least one layer:
-            if len(viewer.layers) > 0:
-                first_layer = viewer.layers[0]
-                first_layer_name = first_layer.name
-                aprint(
-                    f"No layer is selected, defaulting to first layer: '{first_layer_name}'")
-
-                message = _get_layer_image_description(
+                message = self._get_layer_image_description(
                     viewer=viewer,
                     query=query,
-                    layer_name=first_layer_name,
-                    reset_view=reset_view)
-            else:
-                message = f"Tool did not succeed because no layer is selected and there are no layers in the viewer."
+                    layer_name=selected_layer_name)
 
-        elif len(selected_layers) == 1:
-            selected_layer = selected_layers.active
-            selected_layer_name = selected_layer.name
-            aprint(f"Only one selected layer: '{selected_layer_name}'")
-
-            message = _get_layer_image_description(
-                viewer=viewer,
-                query=query,
-                layer_name=selected_layer_name,
-                reset_view=reset_view)
-
-        else:
-            current_layer = selected_layers._current
-            if current_layer is not None:
-                current_layer_name = current_layer.name
+            elif getattr(selected_layers, '_current', None) is not None:
+                current_layer_name = selected_layers._current.name
                 aprint(
                     f"Multiple layers are selected, defaulting to current layer: '{current_layer_name}'. ")
 
-                message = _get_layer_image_description(
+                message = self._get_layer_image_description(
                     viewer=viewer,
                     query=query,
-                    layer_name=current_layer_name,
-                    reset_view=reset_view)
+                    layer_name=current_layer_name)
+
             else:
                 aprint(
                     f"Multiple layers are selected, looking at what is currently visible in the viewer's canvas. ")
 
-                message = _get_layer_image_description(
+                message = self._get_layer_image_description(
                     viewer=viewer,
                     query=query)
 
+            return message
 
-        return message
-
-
-def _get_description_for_whole_canvas(query, viewer):
-    with asection(f"Getting description for whole canvas.'"):
-        aprint(f"Query: '{query}'")
-
-        message = _get_layer_image_description(
-                    viewer=viewer,
-                    query=query,
-                    layer_name=None)
+    def _get_description_for_whole_canvas(self, query):
+        with asection(f"Getting description for whole canvas.'"):
+            aprint(f"Query: '{query}'")
 
-        return message
+            message = self._get_layer_image_description(
+                        viewer=None,
+                        query=query,
+                        layer_name=None)
 
+            return message
 
+    def _get_layer_image_description(self, viewer, query, layer_name: Optional[str] = None) -> str:
 
-def _get_layer_image_description(viewer, query, layer_name: Optional[str] =None, delete: bool = False, reset_view:bool = False) -> str:
-    # Capture the image of the specific layer
+        from PIL import Image
 
-    from PIL import Image
-    snapshot_image: Image = capture_canvas_snapshot(viewer=viewer,
-                                                    layer_name=layer_name,
-                                                    reset_view=reset_view)
-    with tempfile.NamedTemporaryFile(delete=delete,
-                                     suffix=".png") as tmpfile:
-        # Save the image to a temporary file:
-        snapshot_image.save(tmpfile.name)
+        layer = viewer.layers[layer_name] if layer_name else None
 
-        # Query OpenAI API to describe the image of the layer:
-        description = describe_image(image_path=tmpfile.name,
+        if layer is not None and isinstance(layer, (ImageLayer, Labels)):
+            # Thumbnail rendered from the layer's data, the viewer is not touched.
+            # In 2D, the slice shown in the viewer is described, in 3D a maximum projection:
+            if viewer.dims.ndisplay == 2:
+                # Position of the dims slider along the layer's dimensions, the last ones of the viewer:
+                current_step = tuple(viewer.dims.current_step)[-layer.ndim:]
+                image = render_layer_thumbnail(layer, projection='slice', current_step=current_step)
+            else:
+                image = render_layer_thumbnail(layer)
+        else:
+            # Other layer types, or the whole canvas: grab the canvas as displayed:
+            screenshot = self.napari_bridge.take_snapshot(session_id=self.session_id)
+            if screenshot is None or isinstance(screenshot, str):
+                return f"Tool did not succeed because the viewer's canvas could not be captured: {screenshot}"
+            image = Image.fromarray(screenshot)
+
+        # Query OpenAI API to describe the image of the layer, the image is encoded in memory:
+        description = describe_image(image=image,
                                      query=query)
 
         if layer_name:
             message = f"Tool completed successfully, layer '{layer_name}' description: '{description}'"
         else:
             message = f"Tool completed successfully, description: '{description}'"
-    return message
-
+        return message
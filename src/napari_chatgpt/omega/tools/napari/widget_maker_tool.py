@@ -5,6 +5,7 @@ from arbol import asection, aprint
 from napari import Viewer
 
 from napari_chatgpt.omega.tools.napari.napari_base_tool import NapariBaseTool
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
 from napari_chatgpt.utils.python.dynamic_import import dynamic_import
 from napari_chatgpt.utils.strings.filter_lines import filter_lines
 from napari_chatgpt.utils.strings.find_function_name import \
@@ -147,60 +148,68 @@ class NapariWidgetMakerTool(NapariBaseTool):
     instructions = _instructions
     save_last_generated_code = False
     return_direct: bool = True
+    two_phase_execution = True
 
-    def _run_code(self, query: str, code: str, viewer: Viewer) -> str:
+    def _compute(self, query: str, code: str, viewer: ReadOnlyViewer):
 
-        try:
+        with asection(f"NapariWidgetMakerTool: query= {query} "):
+
+            # Prepare code:
+            code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+
+            # Extracts function name:
+            function_name = find_magicgui_decorated_function_name(code)
 
-            with asection(f"NapariWidgetMakerTool: query= {query} "):
+            # If the function exists:
+            if function_name:
 
-                # Prepare code:
-                code = super()._prepare_code(code, do_fix_bad_calls=self.fix_bad_calls)
+                # Remove any viewer forbidden code:
+                code = filter_lines(code, _code_lines_to_filter_out)
 
-                # Extracts function name:
-                function_name = find_magicgui_decorated_function_name(code)
+                # Remove trailing code:
+                code = remove_trailing_code(code)
 
-                # If the function exists:
-                if function_name:
+            return code, function_name
 
-                    # Remove any viewer forbidden code:
-                    code = filter_lines(code, _code_lines_to_filter_out)
+    def _commit(self, query: str, result, viewer: Viewer) -> str:
 
-                    # Remove trailing code:
-                    code = remove_trailing_code(code)
+        try:
+            code, function_name = result
+
+            # If the function exists:
+            if function_name:
 
-                    # Load the code as module:
-                    loaded_module = dynamic_import(code)
+                # Load the code as module, magicgui creates widgets so this must happen on napari's QT thread:
+                loaded_module = dynamic_import(code)
 
-                    # get the function:
-                    function = getattr(loaded_module, function_name)
+                # get the function:
+                function = getattr(loaded_module, function_name)
 
-                    # Load the widget in the viewer:
-                    viewer.window.add_dock_widget(function, name=function_name)
+                # Load the widget in the viewer:
+                viewer.window.add_dock_widget(function, name=function_name)
 
-                    # Standalone code with the viewer.window.add_dock_widget call:
-                    standalone_code = f"{code}\n\nviewer.window.add_dock_widget({function_name}, name='{function_name}')"
+                # Standalone code with the viewer.window.add_dock_widget call:
+                standalone_code = f"{code}\n\nviewer.window.add_dock_widget({function_name}, name='{function_name}')"
 
-                    # At this point we assume the code ran successfully and we add it to the notebook:
-                    if self.notebook:
-                        self.notebook.add_code_cell(standalone_code)
+                # At this point we assume the code ran successfully and we add it to the notebook:
+                if self.notebook:
+                    self.notebook.add_code_cell(standalone_code)
 
-                    # Add the snippet to the code snippet editor:
-                    from microplugin.microplugin_window import MicroPluginMainWindow
-                    MicroPluginMainWindow.add_snippet(filename=function_name, code=standalone_code)
+                # Add the snippet to the code snippet editor:
+                from microplugin.microplugin_window import MicroPluginMainWindow
+                MicroPluginMainWindow.add_snippet(filename=function_name, code=standalone_code)
 
-                    message = f"The requested widget has been successfully created and registered to the viewer."
+                message = f"The requested widget has been successfully created and registered to the viewer."
 
-                # If the function does not exist:
-                else:
-                    message = f"Could not find a function for the requested widget."
+            # If the function does not exist:
+            else:
+                message = f"Could not find a function for the requested widget."
 
-                with asection(f"Message:"):
-                    aprint(message)
+            with asection(f"Message:"):
+                aprint(message)
 
-                return message
+            return message
 
         except Exception as e:
             traceback.print_exc()
             return f"Error: {type(e).__name__} with message: '{str(e)}' occured while trying to create the requested widget. " #with code:\n```python\n{code}\n```\n.
-
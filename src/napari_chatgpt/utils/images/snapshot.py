@@ -0,0 +1,90 @@
+import hashlib
+from io import BytesIO
+from typing import Tuple, Union
+
+import numpy as np
+from PIL import Image, features
+
+
+def downscale_image(image: Union[np.ndarray, Image.Image], max_size: int = 1024) -> Image.Image:
+    """
+    Downscales an image so that its longest side is at most max_size pixels, preserving its aspect ratio.
+    Images that are small enough are returned as is.
+
+    Parameters
+    ----------
+    image: Union[np.ndarray, Image.Image]
+        Image, for example a screenshot of the viewer as an RGB or RGBA array
+
+    max_size: int
+        Maximum length in pixels of the longest side of the image
+
+    Returns
+    -------
+    Downscaled PIL image
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+
+    if max(image.size) > max_size:
+        # thumbnail keeps the aspect ratio, and resizes in place:
+        image = image.copy()
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    return image
+
+
+def image_hash(image: Image.Image) -> str:
+    """
+    Hash of the image's pixels, identical images have identical hashes.
+
+    Parameters
+    ----------
+    image: Image.Image
+        PIL image
+
+    Returns
+    -------
+    Hexadecimal digest of the image's size, mode, and pixels
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{image.mode}{image.size}'.encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def encode_image(image: Image.Image, image_format: str = 'webp', quality: int = 80) -> Tuple[bytes, str]:
+    """
+    Encodes an image with a lossy format, WebP if available, JPEG otherwise.
+    PNG is also accepted, for lossless encoding.
+
+    Parameters
+    ----------
+    image: Image.Image
+        PIL image
+
+    image_format: str
+        'webp', 'jpeg', or 'png'
+
+    quality: int
+        Quality of lossy encodings, between 0 and 100
+
+    Returns
+    -------
+    Encoded image, and its mime type
+    """
+    image_format = image_format.lower()
+    if image_format == 'webp' and not features.check('webp'):
+        image_format = 'jpeg'
+
+    if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        # JPEG has no alpha channel:
+        image = image.convert('RGB')
+
+    buffered = BytesIO()
+    if image_format == 'png':
+        image.save(buffered, format='PNG')
+    else:
+        image.save(buffered, format=image_format.upper(), quality=quality)
+
+    return buffered.getvalue(), f'image/{image_format}'
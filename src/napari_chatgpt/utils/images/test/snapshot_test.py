@@ -0,0 +1,22 @@
+import numpy as np
+
+from napari_chatgpt.utils.images.snapshot import downscale_image, \
+    image_hash, encode_image
+
+
+def test_snapshot_pipeline():
+    screenshot = np.zeros((600, 2000, 4), dtype=np.uint8)
+    screenshot[100:200, 100:200] = 255
+
+    # Downscaled, with the same aspect ratio:
+    image = downscale_image(screenshot, max_size=1000)
+    assert image.size == (1000, 300)
+
+    # Identical images have identical hashes:
+    assert image_hash(image) == image_hash(downscale_image(screenshot.copy(), max_size=1000))
+    assert image_hash(image) != image_hash(downscale_image(255 - screenshot, max_size=1000))
+
+    # Lossy encoding:
+    data, mime_type = encode_image(image, image_format='jpeg')
+    assert mime_type == 'image/jpeg'
+    assert data[:2] == b'\xff\xd8'
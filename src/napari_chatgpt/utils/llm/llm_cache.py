@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+from arbol import aprint
+
+from napari_chatgpt.utils.configuration.app_configuration import \
+    AppConfiguration
+
+# Global cache instance, see get_llm_cache():
+_llm_cache = None
+_llm_cache_lock = Lock()
+
+
+class LLMCache:
+    """
+    Persistent, content-addressed cache of LLM responses stored in a SQLite file.
+    Entries expire after a time-to-live, and the least recently used entries
+    are evicted when the cache exceeds its maximum number of entries.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = 10000,
+                 ttl_seconds: Optional[float] = 30 * 24 * 3600):
+        """
+        Parameters
+        ----------
+        path : str
+            Path to the SQLite file, created if needed.
+        max_entries : int
+            Maximum number of entries, least recently used entries are evicted beyond that.
+        ttl_seconds : Optional[float]
+            Time-to-live of entries in seconds, None for no expiration.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # Hit and miss counters:
+        self.hits = 0
+        self.misses = 0
+
+        # Connection shared by all threads, accesses are serialised:
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                                     "key TEXT PRIMARY KEY, "
+                                     "value TEXT NOT NULL, "
+                                     "created REAL NOT NULL, "
+                                     "last_access REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+
+            # Expired entries are removed:
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO entries (key, value, created, last_access) VALUES (?, ?, ?, ?)",
+                                     (key, value, now, now))
+
+            # Evict least recently used entries:
+            number_of_entries = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if number_of_entries > self.max_entries:
+                self._connection.execute("DELETE FROM entries WHERE key IN "
+                                         "(SELECT key FROM entries ORDER BY last_access ASC LIMIT ?)",
+                                         (number_of_entries - self.max_entries,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    Returns the global LLM cache, stored in Omega's configuration folder,
+    or None if disabled in the configuration ('llm_cache_enabled').
+    """
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            config = AppConfiguration('omega')
+            if not config.get('llm_cache_enabled', True):
+                return None
+            path = os.path.expanduser(os.path.join('~', '.omega', 'llm_cache.sqlite'))
+            ttl_days = config.get('llm_cache_ttl_days', 30)
+            _llm_cache = LLMCache(path=path,
+                                  max_entries=config.get('llm_cache_max_entries', 10000),
+                                  ttl_seconds=ttl_days * 24 * 3600 if ttl_days > 0 else None)
+        return _llm_cache
+
+
+def llm_cache_key(llm: Any, template: str, variables: Dict[str, Any]) -> str:
+    """
+    Cache key for a LLM call: hash of the model name and temperature, the prompt template, and the input variables.
+    """
+    model_name = getattr(llm, 'model_name', None) or getattr(llm, 'model', None) or type(llm).__name__
+    content = json.dumps({'model': str(model_name),
+                          'temperature': getattr(llm, 'temperature', None),
+                          'template': hashlib.sha256(template.encode('utf-8')).hexdigest(),
+                          'variables': variables},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def cached_llm_call(llm: Any,
+                    template: str,
+                    variables: Dict[str, Any],
+                    function: Callable[[], str],
+                    cache: Optional[LLMCache] = None) -> str:
+    """
+    Returns the cached response for this LLM, template and variables, or calls the function and caches its response.
+
+    Parameters
+    ----------
+    llm : Any
+        LLM used by the function, its model name and temperature are part of the key.
+    template : str
+        Prompt template, or any string identifying the query.
+    variables : Dict[str, Any]
+        Input variables of the query.
+    function : Callable[[], str]
+        Function that queries the LLM and returns the response.
+    cache : Optional[LLMCache]
+        Cache to use, by default the global cache.
+
+    Returns
+    -------
+    str
+        Response, cached or not.
+    """
+    if cache is None:
+        cache = get_llm_cache()
+    if cache is None:
+        return function()
+
+    key = llm_cache_key(llm, template, variables)
+
+    response = cache.get(key)
+    if response is not None:
+        aprint(f"LLM cache hit (hits: {cache.hits}, misses: {cache.misses})")
+        return response
+
+    aprint(f"LLM cache miss (hits: {cache.hits}, misses: {cache.misses})")
+    response = function()
+    cache.put(key, response)
+    return response
+
+
+def cached_chain_invoke(chain, variables: Dict[str, Any], output_key: str = 'text') -> str:
+    """
+    Invokes a LLMChain with the given variables, unless the response is already cached.
+    Returns the output of the chain for the given output key.
+    """
+    return cached_llm_call(llm=chain.llm,
+                           template=chain.prompt.template,
+                           variables=variables,
+                           function=lambda: chain.invoke(variables)[output_key])
@@ -0,0 +1,192 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from arbol import aprint, asection
+
+# Packages always kept in the package list, even if not mentioned in the request:
+_core_packages = ('numpy', 'scipy', 'scikit-image', 'napari', 'magicgui', 'pandas', 'matplotlib')
+
+
+@dataclass
+class PromptSection:
+    """
+    Section of a prompt.
+
+    The priority decides which sections are trimmed first when the prompt is over budget:
+    sections with a higher priority number are trimmed first, sections with priority None are never trimmed.
+    The trim function receives the section's text and a token budget, and returns a shorter text,
+    for example by keeping only what is relevant to the request. If it is None, or if its result
+    is still over budget, the text is truncated.
+    """
+    text: str
+    priority: Optional[int] = None
+    trim: Optional[Callable[[str, int], str]] = None
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """
+    Number of tokens of a text for the given model, estimated from the text's length if
+    the model's tokenizer is not available.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        # About four characters per token for English text and code:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def assemble_prompt_sections(sections: Dict[str, PromptSection],
+                             budget: Optional[int],
+                             model_name: Optional[str] = None,
+                             name: str = 'prompt') -> Dict[str, str]:
+    """
+    Fits prompt sections within a token budget, trimming the sections of lowest priority first,
+    and logs the token count of each section.
+
+    Parameters
+    ----------
+    sections : Dict[str, PromptSection]
+        Sections of the prompt, by name.
+    budget : Optional[int]
+        Maximum number of tokens for all sections together, None for no limit.
+    model_name : Optional[str]
+        Name of the model, determines how tokens are counted.
+    name : str
+        Name of the prompt, for logging.
+
+    Returns
+    -------
+    Dict[str, str]
+        Text of each section, after trimming.
+    """
+    texts = {section_name: section.text or '' for section_name, section in sections.items()}
+    tokens = {section_name: count_tokens(text, model_name) for section_name, text in texts.items()}
+    original_tokens = dict(tokens)
+
+    if budget is not None:
+        # Least important sections first:
+        trimmable = sorted((section_name for section_name, section in sections.items() if section.priority is not None),
+                           key=lambda section_name: -sections[section_name].priority)
+
+        for section_name in trimmable:
+            excess = sum(tokens.values()) - budget
+            if excess <= 0:
+                break
+
+            section = sections[section_name]
+            section_budget = max(0, tokens[section_name] - excess)
+
+            text = texts[section_name]
+            if section.trim is not None:
+                text = section.trim(text, section_budget)
+            if count_tokens(text, model_name) > section_budget:
+                text = truncate_to_tokens(text, section_budget, model_name)
+
+            texts[section_name] = text
+            tokens[section_name] = count_tokens(text, model_name)
+
+    with asection(f"Token counts of {name} sections (total: {sum(tokens.values())}, budget: {budget}):"):
+        for section_name in sections:
+            trimmed = f" (trimmed from {original_tokens[section_name]})" if tokens[section_name] != original_tokens[section_name] else ''
+            aprint(f"{section_name}: {tokens[section_name]}{trimmed}")
+
+    return texts
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: Optional[str] = None) -> str:
+    """
+    Truncates a text to at most max_tokens tokens, marking the truncation.
+    """
+    if max_tokens <= 0:
+        return ''
+    marker = '\n... [truncated]\n'
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        max_length = max(0, max_tokens * 4 - len(marker))
+        return text[:max_length] + marker if len(text) > max_length else text
+    encoded = encoding.encode(text, disallowed_special=())
+    if len(encoded) <= max_tokens:
+        return text
+    return encoding.decode(encoded[:max(0, max_tokens - count_tokens(marker, model_name))]) + marker
+
+
+def select_relevant_packages(packages: List[str], request: str) -> List[str]:
+    """
+    Keeps the packages mentioned in the request, and a few core packages.
+    Packages are strings such as 'scikit-image==0.22.0', and are matched by name, with or without dashes.
+    """
+    request = request.lower()
+    request_words = set(re.findall(r'[a-z0-9_\-]+', request))
+
+    def _is_relevant(package: str) -> bool:
+        package_name = package.split('==')[0].lower()
+        if package_name in _core_packages:
+            return True
+        variants = {package_name, package_name.replace('-', '_'), package_name.replace('-', ''),
+                    package_name.split('-')[-1] if package_name.startswith(('scikit-', 'napari-')) else package_name}
+        return any(variant in request_words for variant in variants)
+
+    return [package for package in packages if _is_relevant(package)]
+
+
+def select_relevant_layers(viewer_info: str, request: str) -> str:
+    """
+    Keeps, in the viewer information, the viewer state and only the layers referenced by name in the request,
+    plus the selected layer and the most recent layer. Other layers are only listed by name.
+    """
+    match = re.search(r'^Layers:\n', viewer_info, flags=re.MULTILINE)
+    if not match:
+        return viewer_info
+
+    head = viewer_info[:match.end()]
+    layers_text = viewer_info[match.end():]
+
+    # Split layer descriptions, each starts with '  Layer <index>: <name> (Type: ...)':
+    starts = [m.start() for m in re.finditer(r'^  Layer \d+: ', layers_text, flags=re.MULTILINE)]
+    if not starts:
+        return viewer_info
+    blocks = [layers_text[start:end] for start, end in zip(starts, starts[1:] + [len(layers_text)])]
+    tail = ''
+    if blocks[-1].rstrip().endswith('```'):
+        # Closing fence of the viewer information:
+        last_block = blocks[-1].rstrip()
+        blocks[-1] = last_block[:-3]
+        tail = '```\n'
+
+    selected = re.search(r'Selected Layer: (.*)$', head, flags=re.MULTILINE)
+    selected_layer = selected.group(1).strip() if selected else None
+
+    request = request.lower()
+    kept, omitted = [], []
+    for index, block in enumerate(blocks):
+        layer_name = re.match(r'  Layer \d+: (.*) \(Type: ', block)
+        layer_name = layer_name.group(1) if layer_name else ''
+        if (layer_name and layer_name.lower() in request) or layer_name == selected_layer or index == len(blocks) - 1:
+            kept.append(block)
+        else:
+            omitted.append(layer_name)
+
+    info = head + ''.join(kept)
+    if omitted:
+        info += f"  Other layers (details omitted): {', '.join(omitted)}\n"
+    return info + tail
+
+
+@lru_cache(maxsize=16)
+def _get_encoding(model_name: Optional[str]):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name) if model_name else tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        # Unknown model, for example Anthropic or Ollama models, the count is approximate:
+        try:
+            return tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            return None
@@ -3,6 +3,7 @@ from langchain.docstore.document import Document
 from langchain.llms import BaseLLM
 from langchain.text_splitter import CharacterTextSplitter
 
+from napari_chatgpt.utils.llm.llm_cache import cached_llm_call
 from napari_chatgpt.utils.openai.default_model import \
     get_default_openai_model_name
 
@@ -29,7 +30,10 @@ def summarize(text: str, llm: BaseLLM = None):
     # Load summariser:
     chain = load_summarize_chain(llm, chain_type="map_reduce")
 
-    # Summarize:
-    summary = chain.invoke(docs)['output_text']
+    # Summarize, unless already summarised:
+    summary = cached_llm_call(llm=llm,
+                              template='summarize:map_reduce',
+                              variables={'texts': texts[:3]},
+                              function=lambda: chain.invoke(docs)['output_text'])
 
     return summary
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+import time
+
+from napari_chatgpt.utils.llm.llm_cache import LLMCache, cached_llm_call
+
+
+class _FakeLLM:
+    model_name = 'fake-model'
+    temperature = 0
+
+
+def test_llm_cache_hits_and_misses(tmp_path):
+    cache = LLMCache(path=os.path.join(tmp_path, 'cache.sqlite'))
+
+    calls = []
+
+    def function():
+        calls.append(1)
+        return f'response {len(calls)}'
+
+    # First call is a miss, second call is a hit:
+    assert cached_llm_call(_FakeLLM(), 'template {x}', {'x': 1}, function, cache=cache) == 'response 1'
+    assert cached_llm_call(_FakeLLM(), 'template {x}', {'x': 1}, function, cache=cache) == 'response 1'
+    assert len(calls) == 1
+    assert cache.hits == 1 and cache.misses == 1
+
+    # Different variables or template are different entries:
+    assert cached_llm_call(_FakeLLM(), 'template {x}', {'x': 2}, function, cache=cache) == 'response 2'
+    assert cached_llm_call(_FakeLLM(), 'other {x}', {'x': 1}, function, cache=cache) == 'response 3'
+
+    # Cache is persistent:
+    cache.close()
+    cache = LLMCache(path=os.path.join(tmp_path, 'cache.sqlite'))
+    assert len(cache) == 3
+    assert cached_llm_call(_FakeLLM(), 'template {x}', {'x': 1}, function, cache=cache) == 'response 1'
+    cache.close()
+
+
+def test_llm_cache_lru_and_ttl(tmp_path):
+    cache = LLMCache(path=os.path.join(tmp_path, 'cache.sqlite'), max_entries=2, ttl_seconds=0.5)
+
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    assert cache.get('a') == 'A'
+
+    # 'b' is the least recently used entry:
+    cache.put('c', 'C')
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+
+    # Entries expire:
+    time.sleep(0.6)
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+    cache.close()
+
+
+_key_script = """
+from napari_chatgpt.utils.llm.llm_cache import llm_cache_key
+from napari_chatgpt.utils.python.installed_packages import installed_package_list
+
+class _FakeLLM:
+    model_name = 'fake-model'
+    temperature = 0
+
+print(llm_cache_key(_FakeLLM(), 'template {packages}', {'packages': ', '.join(installed_package_list())}))
+"""
+
+
+def test_llm_cache_key_stable_across_processes():
+    # Keys must not depend on string hashing, which differs between processes:
+    keys = set()
+    for seed in ('1', '2'):
+        result = subprocess.run([sys.executable, '-c', _key_script],
+                                env=dict(os.environ, PYTHONHASHSEED=seed),
+                                capture_output=True, text=True, check=True)
+        keys.add(result.stdout.strip().splitlines()[-1])
+    assert len(keys) == 1
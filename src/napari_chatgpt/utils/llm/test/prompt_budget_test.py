@@ -0,0 +1,62 @@
+from napari_chatgpt.utils.llm.prompt_budget import PromptSection, \
+    assemble_prompt_sections, count_tokens, select_relevant_layers, \
+    select_relevant_packages
+
+_viewer_info = """**Viewer Information:**
+```
+Selected Layer: labels
+Layers:
+  Layer 0: cells (Type: Image)
+    Shape: (512, 512)
+  Layer 1: nuclei (Type: Image)
+    Shape: (512, 512)
+  Layer 2: labels (Type: Labels)
+    Shape: (512, 512)
+  Layer 3: points (Type: Points)
+    Number of points: 12
+```
+"""
+
+
+def test_select_relevant_packages():
+    packages = ['numpy==1.26.0', 'scikit-image==0.22.0', 'stardist==0.8.5', 'cellpose==2.2.3', 'torch==2.1.0']
+    selected = select_relevant_packages(packages, 'Segment the nuclei with StarDist')
+    assert selected == ['numpy==1.26.0', 'scikit-image==0.22.0', 'stardist==0.8.5']
+
+
+def test_select_relevant_layers():
+    info = select_relevant_layers(_viewer_info, 'Denoise the nuclei layer')
+
+    # Referenced, selected, and last layers are kept:
+    assert 'Layer 1: nuclei' in info
+    assert 'Layer 2: labels' in info
+    assert 'Layer 3: points' in info
+
+    # Other layers are only listed by name:
+    assert 'Layer 0: cells' not in info
+    assert 'Other layers (details omitted): cells' in info
+    assert info.rstrip().endswith('```')
+
+
+def test_assemble_prompt_sections():
+    packages = [f'package{i}==1.0' for i in range(200)] + ['numpy==1.26.0']
+    request = 'Denoise the nuclei layer with numpy'
+    sections = {
+        'input': PromptSection(request),
+        'packages': PromptSection(', '.join(packages), priority=2,
+                                  trim=lambda text, budget: ', '.join(select_relevant_packages(packages, request))),
+        'viewer_information': PromptSection(_viewer_info, priority=1,
+                                            trim=lambda text, budget: select_relevant_layers(text, request)),
+    }
+
+    # No budget, no trimming:
+    texts = assemble_prompt_sections(sections, budget=None)
+    assert texts['packages'] == sections['packages'].text
+
+    # Lowest priority first, just enough to fit the budget:
+    budget = count_tokens(request) + count_tokens(_viewer_info) + 50
+    texts = assemble_prompt_sections(sections, budget=budget)
+    assert sum(count_tokens(text) for text in texts.values()) <= budget
+    assert texts['packages'] == 'numpy==1.26.0'
+    assert texts['viewer_information'] == _viewer_info
+    assert texts['input'] == request
@@ -0,0 +1,177 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import numpy
+from napari.layers import Labels
+
+# Largest label for which per-label counts are computed with numpy.bincount,
+# beyond that numpy.unique is used to avoid allocating huge count arrays:
+_max_bincount_label = 2 ** 24
+
+# Cached statistics per Labels layer, together with the data they were computed for:
+_label_statistics_cache = WeakKeyDictionary()
+
+# Labels layer events after which the statistics must be recomputed:
+_label_data_events = ('data', 'paint', 'labels_update')
+
+
+@dataclass
+class LabelStatistics:
+    """
+    Statistics of a labels array: sorted labels present in the array (including background 0 if present),
+    and the number of voxels for each of these labels.
+    """
+    labels: numpy.ndarray
+    counts: numpy.ndarray
+
+    @property
+    def number_of_labels(self) -> int:
+        # Background (0) is not a label:
+        return int(numpy.count_nonzero(self.labels))
+
+    @property
+    def max_label(self) -> int:
+        return int(self.labels[-1]) if len(self.labels) > 0 else 0
+
+    def voxel_count(self, label: int) -> int:
+        index = numpy.searchsorted(self.labels, label)
+        if index < len(self.labels) and self.labels[index] == label:
+            return int(self.counts[index])
+        return 0
+
+
+def get_label_statistics(layer: Labels) -> LabelStatistics:
+    """
+    Returns the label statistics of a Labels layer. Statistics are cached per layer
+    and recomputed only after the layer's data changed (data, paint and labels_update events).
+
+    Parameters
+    ----------
+    layer : Labels
+        Labels layer.
+
+    Returns
+    -------
+    LabelStatistics
+        Labels present in the layer and their voxel counts.
+    """
+
+    # For multiscale labels, statistics are computed on the full resolution level:
+    data = layer.data[0] if layer.multiscale else layer.data
+
+    # Return cached statistics if the data has not changed:
+    cached = _label_statistics_cache.get(layer)
+    if cached is not None and cached[0] is data:
+        return cached[1]
+
+    # Make sure that the cache is invalidated when the data changes:
+    for event_name in _label_data_events:
+        emitter = getattr(layer.events, event_name, None)
+        if emitter is not None:
+            emitter.connect(_invalidate_label_statistics)
+
+    # Compute and cache statistics:
+    statistics = label_statistics(data)
+    _label_statistics_cache[layer] = (data, statistics)
+
+    return statistics
+
+
+def invalidate_label_statistics(layer: Optional[Labels] = None):
+    """
+    Drops the cached statistics of a Labels layer, or of all layers if no layer is given.
+    Needed when the data is modified in place without emitting any event.
+    """
+    if layer is None:
+        _label_statistics_cache.clear()
+    else:
+        _label_statistics_cache.pop(layer, None)
+
+
+def label_statistics(data) -> LabelStatistics:
+    """
+    Computes the label statistics of a labels array without sorting it.
+    Numpy arrays are reduced with a bincount fast path, chunked arrays
+    (dask, zarr) are reduced chunk by chunk without loading the whole array in memory.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        Labels array: numpy, dask, zarr, or any array convertible to numpy.
+
+    Returns
+    -------
+    LabelStatistics
+        Labels present in the array and their voxel counts.
+    """
+
+    # Dask arrays, chunks are reduced in parallel by dask:
+    if _is_dask_array(data):
+        import dask
+        block_indices = list(numpy.ndindex(*data.numblocks))
+        partials = dask.compute(*[dask.delayed(_label_counts)(data.blocks[index])
+                                  for index in block_indices])
+        return _merge_label_counts(partials)
+
+    # Other chunked arrays (zarr, ...), chunks are read and reduced one at a time:
+    if hasattr(data, 'chunks') and not isinstance(data, numpy.ndarray):
+        partials = [_label_counts(data[chunk_slice]) for chunk_slice in _chunk_slices(data.shape, data.chunks)]
+        return _merge_label_counts(partials)
+
+    # In-memory arrays:
+    labels, counts = _label_counts(data)
+    return LabelStatistics(labels=labels, counts=counts)
+
+
+def _label_counts(data) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    data = numpy.asarray(data)
+
+    if data.size == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    if data.dtype == bool:
+        data = data.view(numpy.uint8)
+
+    # Fast path for integer labels: bincount is linear time, numpy.unique sorts:
+    if numpy.issubdtype(data.dtype, numpy.integer):
+        max_label = int(data.max())
+        min_label = 0 if numpy.issubdtype(data.dtype, numpy.unsignedinteger) else int(data.min())
+        if min_label >= 0 and max_label <= _max_bincount_label:
+            counts = numpy.bincount(data.ravel(), minlength=max_label + 1)
+            labels = numpy.flatnonzero(counts)
+            return labels, counts[labels]
+
+    # General case:
+    labels, counts = numpy.unique(data, return_counts=True)
+    return labels, counts
+
+
+def _merge_label_counts(partials) -> LabelStatistics:
+    partials = list(partials)
+    if len(partials) == 0:
+        return LabelStatistics(labels=numpy.zeros(0, dtype=numpy.int64), counts=numpy.zeros(0, dtype=numpy.int64))
+
+    all_labels = numpy.concatenate([labels for labels, _ in partials])
+    all_counts = numpy.concatenate([counts for _, counts in partials])
+
+    # Only the (few) distinct labels of each chunk are merged here:
+    labels, inverse = numpy.unique(all_labels, return_inverse=True)
+    counts = numpy.bincount(inverse.ravel(), weights=all_counts, minlength=len(labels)).astype(numpy.int64)
+
+    return LabelStatistics(labels=labels, counts=counts)
+
+
+def _chunk_slices(shape, chunks):
+    chunk_starts = [range(0, size, chunk) for size, chunk in zip(shape, chunks)]
+    for starts in numpy.ndindex(*[len(s) for s in chunk_starts]):
+        yield tuple(slice(chunk_starts[axis][index], chunk_starts[axis][index] + chunks[axis])
+                    for axis, index in enumerate(starts))
+
+
+def _is_dask_array(data) -> bool:
+    return type(data).__module__.startswith('dask') and hasattr(data, 'blocks')
+
+
+def _invalidate_label_statistics(event):
+    invalidate_label_statistics(event.source)
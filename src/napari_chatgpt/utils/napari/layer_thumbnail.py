@@ -0,0 +1,107 @@
+from math import ceil
+from typing import Optional, Sequence
+
+import numpy
+from PIL import Image
+from napari.layers import Image as ImageLayer, Labels
+
+# Fixed palette for labels, label 0 is the background and stays black:
+_labels_palette = numpy.random.default_rng(seed=42).integers(64, 256, size=(256, 3), dtype=numpy.uint8)
+
+
+def render_layer_thumbnail(layer,
+                           max_size: int = 768,
+                           projection: str = 'max',
+                           current_step: Optional[Sequence[int]] = None) -> Image.Image:
+    """
+    Renders an RGB thumbnail of an image or labels layer directly from its data, without the viewer:
+    the layer's data is downsampled, projected or sliced to 2D, and its contrast limits and colormap are applied with NumPy.
+    Nothing is drawn on the canvas, and the viewer's state is not modified, so this can run off napari's Qt thread,
+    for example on a ReadOnlyLayer.
+
+    Parameters
+    ----------
+    layer : Layer
+        The napari image or labels layer, or a read-only proxy of it.
+    max_size : int
+        Maximum length in pixels of the longest side of the thumbnail.
+    projection : str
+        How to reduce layers with more than two spatial dimensions: 'max' for a maximum intensity projection
+        along the non-displayed dimensions, or 'slice' for the slice at current_step.
+    current_step : Optional[Sequence[int]]
+        Current position of the viewer's dims slider, used with 'slice' projection. Typically: viewer.dims.current_step.
+        If None, the middle slice is used.
+
+    Returns
+    -------
+    Image.Image
+        RGB thumbnail of the layer.
+    """
+    # isinstance also works for read-only proxies of layers:
+    is_labels = isinstance(layer, Labels)
+    if not is_labels and not isinstance(layer, ImageLayer):
+        raise ValueError(f"Cannot render a thumbnail of layer '{layer.name}' of type: {layer.__class__.__name__}, only image and labels layers are supported.")
+
+    data = layer.data
+    if getattr(layer, 'multiscale', False):
+        # Lowest resolution level, already downsampled:
+        data = data[-1]
+
+    is_rgb = not is_labels and layer.rgb
+    spatial_ndim = data.ndim - 1 if is_rgb else data.ndim
+
+    # Downsample the displayed (last two) dimensions by striding, before reading any data:
+    shape = data.shape[spatial_ndim - 2:spatial_ndim]
+    step = max(1, ceil(max(shape) / max_size))
+    index = [slice(None)] * (spatial_ndim - 2) + [slice(None, None, step)] * 2
+
+    # Reduce the other dimensions to 2D:
+    if spatial_ndim > 2 and projection == 'slice':
+        for axis in range(spatial_ndim - 2):
+            size = data.shape[axis]
+            position = current_step[axis] if current_step is not None and axis < len(current_step) else size // 2
+            index[axis] = min(max(int(position), 0), size - 1)
+    elif projection not in ('max', 'slice'):
+        raise ValueError(f"Unknown projection: '{projection}', must be 'max' or 'slice'.")
+
+    # Lazy arrays (dask, zarr, ...) are only read here:
+    plane = numpy.asarray(data[tuple(index)])
+    if plane.ndim > (3 if is_rgb else 2):
+        plane = plane.max(axis=tuple(range(plane.ndim - (3 if is_rgb else 2))))
+
+    if is_labels:
+        rgb = _labels_palette[plane.astype(numpy.int64) % len(_labels_palette)]
+        rgb[plane == 0] = 0
+    elif is_rgb:
+        rgb = _to_uint8(plane[..., :3], layer.contrast_limits)
+    else:
+        normalised = _normalise(plane, layer.contrast_limits)
+        gamma = getattr(layer, 'gamma', 1)
+        if gamma != 1:
+            normalised = normalised ** gamma
+        colors = layer.colormap.map(normalised.ravel())
+        rgb = (colors[:, :3].reshape(plane.shape + (3,)) * 255).astype(numpy.uint8)
+
+    image = Image.fromarray(numpy.ascontiguousarray(rgb), mode='RGB')
+
+    # Account for anisotropic pixels:
+    scale = getattr(layer, 'scale', None)
+    if scale is not None and len(scale) >= 2 and scale[-1] > 0 and scale[-2] != scale[-1]:
+        aspect = scale[-2] / scale[-1]
+        image = image.resize((image.width, max(1, round(image.height * aspect))), Image.BILINEAR)
+        if max(image.size) > max_size:
+            image.thumbnail((max_size, max_size), Image.BILINEAR)
+
+    return image
+
+
+def _normalise(plane: numpy.ndarray, contrast_limits) -> numpy.ndarray:
+    low, high = (contrast_limits if contrast_limits is not None else (plane.min(), plane.max()))
+    normalised = (plane.astype(numpy.float32) - low) / max(float(high) - float(low), 1e-12)
+    return numpy.clip(normalised, 0, 1)
+
+
+def _to_uint8(plane: numpy.ndarray, contrast_limits) -> numpy.ndarray:
+    if plane.dtype == numpy.uint8:
+        return plane
+    return (_normalise(plane, contrast_limits) * 255).astype(numpy.uint8)
@@ -2,6 +2,8 @@ import numpy
 from napari.layers import Image, Labels, Points, Vectors, Tracks, Surface
 from napari.utils.transforms import Affine
 
+from napari_chatgpt.utils.napari.label_statistics import get_label_statistics
+
 def get_viewer_info(viewer):
     """
     Returns a string describing the state of a Napari viewer instance.
@@ -82,17 +84,21 @@ def get_viewer_state(viewer):
     return description
 
 
-def get_viewer_layers_info(viewer, max_layers: int = 20, max_layers_with_details: int = 4):
+def get_viewer_layers_info(viewer, max_layers: int = 20, max_layers_with_details: int = 4, layer_description_function=None):
     """
     Lists all layers in a given Napari viewer and provides detailed information about each layer.
 
     Parameters:
     viewer (napari.Viewer): The Napari viewer instance.
+    layer_description_function: Function with the same signature as layer_description, used for caching.
 
     Returns:
     str: A descriptive string of all layers and their details.
     """
 
+    if layer_description_function is None:
+        layer_description_function = layer_description
+
     layer_descriptions = []
 
     layers = viewer.layers[len(viewer.layers)-max_layers:]
@@ -100,7 +106,7 @@ def get_viewer_layers_info(viewer, max_layers: int = 20, max_layers_with_details
     number_of_layers = len(layers)
 
     for index, layer in enumerate(layers):
-        layer_info = layer_description(viewer, layer, details=index >= number_of_layers-max_layers_with_details)
+        layer_info = layer_description_function(viewer, layer, details=index >= number_of_layers-max_layers_with_details)
 
 
 
@@ -180,10 +186,9 @@ def layer_description(viewer, layer, details: bool = True):
             }
 
     elif isinstance(layer, Labels):
-        unique_labels = numpy.unique(layer.data)
+        label_statistics = get_label_statistics(layer)
         layer_info |= {
-            'Number of Labels': len(unique_labels) - (
-                1 if 0 in unique_labels else 0),
+            'Number of Labels': label_statistics.number_of_labels,
             'Labels Data Type': layer.data.dtype,
         }
 
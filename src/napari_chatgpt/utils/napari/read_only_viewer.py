@@ -0,0 +1,137 @@
+from typing import Any, List, Optional, Union
+
+import numpy
+from napari import Viewer
+from napari.layers import Layer
+
+# Viewer methods that modify the viewer or require napari's QT thread:
+_forbidden_viewer_methods = ('open', 'open_sample', 'close', 'reset_view',
+                             'screenshot', 'export_figure', 'update_console')
+
+
+class ReadOnlyLayer:
+    """
+    Read-only proxy for a napari layer.
+    Attributes are read from the wrapped layer, except for the data which is
+    captured when the proxy is created and exposed as read-only array(s).
+    """
+
+    def __init__(self, layer: Layer):
+        object.__setattr__(self, '_layer', layer)
+        object.__setattr__(self, '_data', _read_only_data(layer.data))
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def __class__(self):
+        # So that isinstance(layer, Image) still works on the proxy:
+        return type(self._layer)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._layer, name)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"Cannot set attribute '{name}' of layer '{self._layer.name}': layers are read-only during the compute phase.")
+
+    def __repr__(self):
+        return f"ReadOnlyLayer({self._layer!r})"
+
+
+class _ReadOnlySelection:
+
+    def __init__(self,
+                 active: Optional[ReadOnlyLayer],
+                 selected: List[ReadOnlyLayer],
+                 current: Optional[ReadOnlyLayer] = None):
+        self.active = active
+        self._selected = selected
+        # Current layer, the last one clicked when several layers are selected:
+        self._current = current
+
+    def __iter__(self):
+        return iter(self._selected)
+
+    def __len__(self):
+        return len(self._selected)
+
+    def __contains__(self, layer) -> bool:
+        return any(layer is l or layer is l._layer for l in self._selected)
+
+
+class ReadOnlyLayerList:
+    """
+    Snapshot of a napari layer list: the list of layers and the selection are
+    captured when the snapshot is created, layers are wrapped as ReadOnlyLayer.
+    """
+
+    def __init__(self, layers):
+        self._layers = [ReadOnlyLayer(layer) for layer in layers]
+        by_layer = {id(l._layer): l for l in self._layers}
+        active = layers.selection.active
+        current = getattr(layers.selection, '_current', None)
+        self.selection = _ReadOnlySelection(
+            active=by_layer.get(id(active)) if active is not None else None,
+            selected=[by_layer[id(l)] for l in layers.selection if id(l) in by_layer],
+            current=by_layer.get(id(current)) if current is not None else None)
+
+    def __getitem__(self, key: Union[int, str, slice]):
+        if isinstance(key, str):
+            for layer in self._layers:
+                if layer.name == key:
+                    return layer
+            raise KeyError(key)
+        return self._layers[key]
+
+    def __iter__(self):
+        return iter(self._layers)
+
+    def __len__(self):
+        return len(self._layers)
+
+    def __contains__(self, key) -> bool:
+        if isinstance(key, str):
+            return any(layer.name == key for layer in self._layers)
+        return any(key is l or key is l._layer for l in self._layers)
+
+    def index(self, key) -> int:
+        for index, layer in enumerate(self._layers):
+            if (isinstance(key, str) and layer.name == key) or key is layer or key is layer._layer:
+                return index
+        raise ValueError(f"Layer {key} not found.")
+
+
+class ReadOnlyViewer:
+    """
+    Read-only view of a napari viewer that can be handed to code running off napari's QT thread.
+    Must be created on napari's QT thread. Layer data is read-only, and methods that modify
+    the viewer (add_image, add_labels, ...) raise an error: results must be added to the
+    viewer during the commit phase, on napari's QT thread.
+    """
+
+    def __init__(self, viewer: Viewer):
+        object.__setattr__(self, '_viewer', viewer)
+        object.__setattr__(self, 'layers', ReadOnlyLayerList(viewer.layers))
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('add_') or name in _forbidden_viewer_methods:
+            raise RuntimeError(f"'viewer.{name}' cannot be used during the compute phase, the viewer is read-only.")
+        return getattr(self._viewer, name)
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"Cannot set attribute '{name}' of the viewer: the viewer is read-only during the compute phase.")
+
+
+def _read_only_data(data):
+    # Multiscale and surface data come as sequences of arrays:
+    if isinstance(data, (list, tuple)):
+        return type(data)(_read_only_data(d) for d in data)
+
+    # Numpy arrays are wrapped in a non-writeable view, other array types (dask, zarr, ...) are passed as is:
+    if isinstance(data, numpy.ndarray):
+        view = data.view()
+        view.flags.writeable = False
+        return view
+
+    return data
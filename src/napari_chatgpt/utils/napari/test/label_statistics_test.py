@@ -0,0 +1,66 @@
+import dask.array
+import numpy
+import zarr
+from napari.layers import Labels
+
+from napari_chatgpt.utils.napari.label_statistics import label_statistics, \
+    get_label_statistics
+
+
+def _labels():
+    labels = numpy.zeros((64, 64, 64), dtype=numpy.uint16)
+    labels[4:12, 4:12, 4:12] = 1
+    labels[30:40, 30:40, 30:40] = 7
+    labels[60:64, 0:64, 0:2] = 300
+    return labels
+
+
+def test_label_statistics_numpy():
+
+    labels = _labels()
+    statistics = label_statistics(labels)
+
+    assert statistics.number_of_labels == 3
+    assert statistics.max_label == 300
+    assert statistics.voxel_count(1) == 8 ** 3
+    assert statistics.voxel_count(7) == 10 ** 3
+    assert statistics.voxel_count(300) == 4 * 64 * 2
+    assert statistics.voxel_count(2) == 0
+    assert statistics.counts.sum() == labels.size
+
+    # Negative and float labels fall back to numpy.unique:
+    statistics = label_statistics(labels.astype(numpy.int32) - 2)
+    assert statistics.number_of_labels == 4
+    statistics = label_statistics(labels.astype(numpy.float32))
+    assert statistics.number_of_labels == 3
+
+
+def test_label_statistics_chunked():
+
+    labels = _labels()
+
+    # Dask:
+    statistics = label_statistics(dask.array.from_array(labels, chunks=(16, 32, 20)))
+    assert statistics.number_of_labels == 3
+    assert statistics.voxel_count(300) == 4 * 64 * 2
+    assert statistics.counts.sum() == labels.size
+
+    # Zarr:
+    statistics = label_statistics(zarr.array(labels, chunks=(16, 32, 20)))
+    assert statistics.number_of_labels == 3
+    assert statistics.voxel_count(7) == 10 ** 3
+    assert statistics.counts.sum() == labels.size
+
+
+def test_label_statistics_cache():
+
+    layer = Labels(_labels())
+
+    statistics = get_label_statistics(layer)
+    assert statistics.number_of_labels == 3
+    assert get_label_statistics(layer) is statistics
+
+    # Setting new data invalidates the cache:
+    layer.data = numpy.ones((8, 8), dtype=numpy.uint8)
+    assert get_label_statistics(layer) is not statistics
+    assert get_label_statistics(layer).number_of_labels == 1
@@ -0,0 +1,37 @@
+import numpy
+from napari.layers import Image, Labels, Points
+
+from napari_chatgpt.utils.napari.layer_thumbnail import render_layer_thumbnail
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyLayer
+
+
+def test_render_layer_thumbnail():
+    # Volume with a bright voxel at the top slice:
+    volume = numpy.zeros((10, 400, 200), dtype=numpy.float32)
+    volume[9, 100:120, 50:70] = 1
+    layer = Image(volume, contrast_limits=(0, 1), colormap='gray')
+
+    # Downsampled, and maximum projection along z:
+    thumbnail = render_layer_thumbnail(ReadOnlyLayer(layer), max_size=100)
+    assert thumbnail.mode == 'RGB'
+    assert thumbnail.size == (50, 100)
+    assert numpy.asarray(thumbnail)[27, 15].tolist() == [255, 255, 255]
+
+    # Current slice:
+    thumbnail = render_layer_thumbnail(layer, max_size=100, projection='slice', current_step=(0, 0, 0))
+    assert numpy.asarray(thumbnail).max() == 0
+
+    # Labels have colors, background is black:
+    labels = numpy.zeros((64, 64), dtype=numpy.uint32)
+    labels[10:20, 10:20] = 1
+    thumbnail = numpy.asarray(render_layer_thumbnail(Labels(labels)))
+    assert thumbnail[0, 0].tolist() == [0, 0, 0]
+    assert thumbnail[15, 15].max() > 0
+
+
+def test_render_layer_thumbnail_unsupported():
+    try:
+        render_layer_thumbnail(Points(numpy.zeros((3, 2))))
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,46 @@
+import napari
+import numpy
+import pytest
+from napari.layers import Labels
+
+from napari_chatgpt.utils.napari.read_only_viewer import ReadOnlyViewer
+
+
+def test_read_only_viewer():
+
+    # Instantiating Napari viewer headlessly:
+    viewer = napari.Viewer(show=False)
+
+    labels = numpy.zeros((32, 32), dtype=numpy.uint32)
+    labels[4:12, 4:12] = 1
+    viewer.add_labels(labels, name='segmented')
+
+    read_only_viewer = ReadOnlyViewer(viewer)
+
+    # Layers can be looked up by name and index, and keep their type:
+    layer = read_only_viewer.layers['segmented']
+    assert layer is read_only_viewer.layers[0]
+    assert isinstance(layer, Labels)
+    assert 'segmented' in read_only_viewer.layers
+    assert read_only_viewer.layers.selection.active is layer
+
+    # Data can be read but not modified:
+    assert layer.data.sum() == 64
+    with pytest.raises(ValueError):
+        layer.data[0, 0] = 1
+
+    # Layers and viewer cannot be modified:
+    with pytest.raises(AttributeError):
+        layer.opacity = 0.5
+    with pytest.raises(RuntimeError):
+        read_only_viewer.add_image(labels)
+
+    # With several layers selected, the current layer is kept:
+    viewer.add_labels(labels.copy(), name='other')
+    viewer.layers.selection.update(set(viewer.layers))
+    viewer.layers.selection._current = viewer.layers['other']
+    read_only_viewer = ReadOnlyViewer(viewer)
+    assert len(read_only_viewer.layers.selection) == 2
+    assert read_only_viewer.layers.selection._current is read_only_viewer.layers['other']
+
+    viewer.close()
@@ -0,0 +1,48 @@
+import napari
+import numpy
+
+from napari_chatgpt.utils.napari.napari_viewer_info import get_viewer_info
+from napari_chatgpt.utils.napari.viewer_state_cache import ViewerStateCache
+
+
+def test_viewer_state_cache():
+
+    # Instantiating Napari viewer headlessly:
+    viewer = napari.Viewer(show=False)
+
+    labels = numpy.zeros((32, 32), dtype=numpy.uint32)
+    labels[4:12, 4:12] = 1
+    viewer.add_labels(labels, name='first')
+
+    viewer_state = ViewerStateCache(viewer)
+
+    # Same information as computed from scratch, and cached:
+    viewer_info = viewer_state.get_viewer_info()
+    assert viewer_info == get_viewer_info(viewer)
+    assert viewer_state.cached_viewer_info() == viewer_info
+
+    # Adding a layer invalidates the cache:
+    labels = labels.copy()
+    labels[20:24, 20:24] = 2
+    layer = viewer.add_labels(labels, name='second')
+    assert viewer_state.cached_viewer_info() is None
+    assert viewer_state.get_viewer_info() == get_viewer_info(viewer)
+    assert 'Number of Labels: 2' in viewer_state.get_viewer_info()
+
+    # Changing a layer invalidates the cache:
+    layer.opacity = 0.25
+    assert viewer_state.cached_viewer_info() is None
+    assert 'Opacity: 0.25' in viewer_state.get_viewer_info()
+
+    # Removing a layer invalidates the cache:
+    viewer.layers.remove('first')
+    assert viewer_state.cached_viewer_info() is None
+    assert 'first' not in viewer_state.get_viewer_info()
+    assert viewer_state.get_viewer_info() == get_viewer_info(viewer)
+
+    # Status changes do not invalidate the cache, the current status is always reported:
+    viewer.status = 'Some new status'
+    assert 'Status: Some new status\n' in viewer_state.cached_viewer_info()
+    assert viewer_state.get_viewer_info() == get_viewer_info(viewer)
+
+    viewer.close()
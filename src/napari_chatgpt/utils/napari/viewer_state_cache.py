@@ -0,0 +1,159 @@
+from typing import Dict, Optional
+
+from arbol import aprint
+from napari import Viewer
+from napari.layers import Layer, Labels
+
+from napari_chatgpt.utils.napari.label_statistics import \
+    invalidate_label_statistics
+from napari_chatgpt.utils.napari.napari_viewer_info import get_viewer_state, \
+    get_viewer_layers_info, layer_description
+
+# Layer events that change the description of a layer.
+# High-frequency events (cursor, status, thumbnail, set_data, ...) are deliberately left out:
+_layer_events = ('data', 'name', 'visible', 'opacity', 'blending',
+                 'scale', 'translate', 'rotate', 'shear', 'affine',
+                 'symbol', 'size', 'rendering', 'interpolation2d',
+                 'interpolation3d', 'paint', 'labels_update')
+
+# Lines of the viewer state around the status, which is read live instead of cached:
+_status_prefix = "  Status: "
+_selected_layer_prefix = "  Selected Layer: "
+
+
+class ViewerStateCache:
+    """
+    Incrementally maintained description of the state of a napari viewer.
+
+    Subscribes to viewer, camera and layer events and keeps one description
+    fragment per layer. Only the fragments of layers that changed are
+    recomputed, so that getting the viewer information is nearly free when
+    nothing changed. The viewer's status changes on every mouse move, so it is
+    not cached but read when the information is returned. Must be created,
+    updated and queried on napari's QT thread, except for cached_viewer_info()
+    which can be called from any thread.
+    """
+
+    def __init__(self, viewer: Viewer):
+        self.viewer = viewer
+
+        # Cached fragments, None means dirty:
+        self._viewer_state: Optional[str] = None
+        self._layer_infos: Dict[int, Dict[bool, dict]] = {}
+        self._viewer_info: Optional[str] = None
+
+        # Viewer level events:
+        viewer.camera.events.connect(self._on_viewer_state_changed)
+        viewer.dims.events.ndisplay.connect(self._on_ndisplay_changed)
+        viewer.grid.events.enabled.connect(self._on_viewer_state_changed)
+        viewer.events.theme.connect(self._on_viewer_state_changed)
+        viewer.layers.selection.events.active.connect(self._on_viewer_state_changed)
+        try:
+            viewer.window.qt_viewer.canvas.events.resize.connect(self._on_viewer_state_changed)
+        except AttributeError:
+            aprint("Could not subscribe to canvas resize events.")
+
+        # Layer list events:
+        viewer.layers.events.inserted.connect(self._on_layer_inserted)
+        viewer.layers.events.removed.connect(self._on_layer_removed)
+        viewer.layers.events.moved.connect(self._on_layers_changed)
+        viewer.layers.events.reordered.connect(self._on_layers_changed)
+
+        # Layers already in the viewer:
+        for layer in viewer.layers:
+            self._connect_layer(layer)
+
+    def get_viewer_info(self) -> str:
+        """
+        Returns the same string as napari_viewer_info.get_viewer_info(viewer),
+        recomputing only what changed since the last call.
+        """
+        if self._viewer_info is None:
+            if self._viewer_state is None:
+                self._viewer_state = get_viewer_state(self.viewer)
+
+            info = "```viewer_info\n"
+            info += self._viewer_state
+            info += get_viewer_layers_info(self.viewer,
+                                           layer_description_function=self._layer_description)
+            info += "```\n"
+
+            self._viewer_info = info
+
+        return self._with_current_status(self._viewer_info)
+
+    def cached_viewer_info(self) -> Optional[str]:
+        """
+        Returns the cached viewer information, or None if it must be recomputed on napari's QT thread.
+        """
+        viewer_info = self._viewer_info
+        return None if viewer_info is None else self._with_current_status(viewer_info)
+
+    def invalidate(self, layer: Optional[Layer] = None):
+        """
+        Marks a layer, or everything if no layer is given, as changed.
+        Useful after code that modifies layer data in place without emitting events.
+        """
+        if layer is None:
+            self._layer_infos.clear()
+        else:
+            self._layer_infos.pop(id(layer), None)
+
+        # Label statistics are cached separately, per data version:
+        if layer is None or isinstance(layer, Labels):
+            invalidate_label_statistics(layer)
+
+        # The viewer state mentions the selected layer, cheap to recompute:
+        self._viewer_state = None
+        self._viewer_info = None
+
+    def _with_current_status(self, viewer_info: str) -> str:
+        # Replaces the status, as it was when the information was cached, by the current status:
+        start = viewer_info.find(_status_prefix)
+        end = viewer_info.find(_selected_layer_prefix, start)
+        if start < 0 or end < 0:
+            return viewer_info
+        return viewer_info[:start] + f"{_status_prefix}{self.viewer.status}\n" + viewer_info[end:]
+
+    def _layer_description(self, viewer: Viewer, layer: Layer, details: bool = True) -> dict:
+        infos = self._layer_infos.setdefault(id(layer), {})
+        if details not in infos:
+            infos[details] = layer_description(viewer, layer, details=details)
+        return infos[details]
+
+    def _connect_layer(self, layer: Layer):
+        for event_name in _layer_events:
+            emitter = getattr(layer.events, event_name, None)
+            if emitter is not None:
+                emitter.connect(self._on_layer_changed)
+
+    def _disconnect_layer(self, layer: Layer):
+        for event_name in _layer_events:
+            emitter = getattr(layer.events, event_name, None)
+            if emitter is not None:
+                emitter.disconnect(self._on_layer_changed)
+
+    def _on_layer_changed(self, event):
+        self.invalidate(event.source)
+
+    def _on_layer_inserted(self, event):
+        self._connect_layer(event.value)
+        self._on_layers_changed(event)
+
+    def _on_layer_removed(self, event):
+        self._disconnect_layer(event.value)
+        self._layer_infos.pop(id(event.value), None)
+        self._on_layers_changed(event)
+
+    def _on_layers_changed(self, event):
+        # Layer indices, and which layers are detailed, depend on the order of the layers:
+        self._viewer_state = None
+        self._viewer_info = None
+
+    def _on_viewer_state_changed(self, event):
+        self._viewer_state = None
+        self._viewer_info = None
+
+    def _on_ndisplay_changed(self, event):
+        # Layer descriptions depend on the display mode (interpolation):
+        self.invalidate()
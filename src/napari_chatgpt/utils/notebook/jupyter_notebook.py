@@ -1,23 +1,79 @@
+import json
 import os
+import traceback
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 from datetime import datetime
-from io import BytesIO
 from mimetypes import guess_type
 from os import path, makedirs
-from typing import Optional, Callable
+from threading import Lock
+from typing import Optional, Callable, Dict, Tuple, Union
 
-import nbformat
+import numpy
 from PIL import Image
+from arbol import aprint
+from nbformat import NotebookNode
 from nbformat.v4 import new_notebook, new_code_cell, new_markdown_cell
 
+from napari_chatgpt.utils.images.snapshot import downscale_image, image_hash, \
+    encode_image
 from napari_chatgpt.utils.strings.markdown import extract_markdown_blocks
 
+# Single thread on which notebooks are written, so that writes never block the chat's event loop,
+# and writes to the same file never overlap:
+_notebook_writer_thread_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='omega_notebook_writer')
 
-class JupyterNotebookFile:
+# End of the notebook file, after the last cell. New cells are written in its place:
+_notebook_file_tail = '\n ]\n}\n'
 
 
-    def __init__(self, notebook_folder_path: Optional[str] = None):
+class JupyterNotebookFile:
+    """
+    Jupyter notebook of a chat session, written to disk in the background.
+
+    Writes are coalesced: requesting a write while one is pending only writes once.
+    Cells are only ever appended, so a write only serialises the cells added since the previous write,
+    and appends them at the end of the file, instead of rewriting the whole notebook.
+    Images are stored as cell attachments, and are encoded on the writer thread.
+    Viewer snapshots are downscaled, and a snapshot identical to the previous one is recorded as a reference.
+    """
+
+    def __init__(self,
+                 notebook_folder_path: Optional[str] = None,
+                 snapshot_max_size: int = 1024,
+                 snapshot_format: str = 'webp',
+                 name: str = 'omega_notebook'):
         self._modified = False
+
+        # Folder of the notebook files, and name that ends their file names:
+        self.notebook_folder_path = notebook_folder_path
+        self.name = name
+
+        # Function that returns a snapshot of the viewer, see register_snapshot_function():
+        self._snapshot_function: Optional[Callable] = None
+
+        self._lock = Lock()
+
+        # Pending writes, the notebook and file path of each, in order. Requests for the same notebook and file are coalesced:
+        self._write_requests: Dict[Tuple[int, str], Tuple[NotebookNode, str]] = {}
+        self._write_future: Optional[Future] = None
+
+        # Last written notebook and file, number of cells written, and size of the file:
+        self._written_notebook: Optional[NotebookNode] = None
+        self._written_file_path: Optional[str] = None
+        self._written_cells: int = 0
+        self._written_file_size: int = 0
+
+        # Snapshots are downscaled and encoded with this format:
+        self.snapshot_max_size = snapshot_max_size
+        self.snapshot_format = snapshot_format
+
+        # Images not yet encoded, by cell id:
+        self._pending_images: Dict[str, tuple] = {}
+
+        # Notebook, hash, and attachment name of the last snapshot:
+        self._last_snapshot: Tuple[Optional[NotebookNode], Optional[str], Optional[str]] = (None, None, None)
+
         self.restart(notebook_folder_path=notebook_folder_path,
                      write_before_restart=False,
                      force_restart=True
@@ -35,14 +91,16 @@ class JupyterNotebookFile:
             return
 
         if write_before_restart:
-            # Write the notebook to disk before restarting
+            # Write the notebook to disk before restarting, the write of the previous notebook
+            # is not coalesced with writes of the new notebook:
             self.write()
 
         # path of system's desktop folder:
         desktop_path = path.join(path.join(path.expanduser('~')), 'Desktop')
 
         # default folder path for notebooks:
-        notebook_folder_path = notebook_folder_path or path.join(desktop_path, 'omega_notebooks')
+        notebook_folder_path = notebook_folder_path or self.notebook_folder_path or path.join(desktop_path, 'omega_notebooks')
+        self.notebook_folder_path = notebook_folder_path
 
         # Create the folder if it does not exist:
         if not path.exists(notebook_folder_path):
@@ -55,23 +113,144 @@ class JupyterNotebookFile:
         formatted_date_time = now.strftime("%Y_%m_%d_%H_%M_%S")
 
         # path of default notebook file on desktop:
-        self.default_file_path = path.join(notebook_folder_path, f'{formatted_date_time}_omega_notebook.ipynb')
+        self.default_file_path = path.join(notebook_folder_path, f'{formatted_date_time}_{self.name}.ipynb')
 
         # Actual file path of the notebook (last saved file path):
         self.file_path = None
 
         # Restart the notebook:
-        self.notebook = new_notebook()
+        with self._lock:
+            self.notebook = new_notebook()
 
         # Mark as not modified:
         self._modified = False
 
-    def write(self, file_path: Optional[str] = None):
+    def spawn(self, name: str) -> 'JupyterNotebookFile':
+        """
+        Creates a new notebook, written to its own file in the same folder,
+        with the same snapshot settings and snapshot function. For example, one notebook per chat session.
+
+        Parameters
+        ----------
+        name : str
+            Name that ends the file name of the new notebook.
+
+        Returns
+        -------
+        JupyterNotebookFile
+            New empty notebook.
+        """
+        notebook = JupyterNotebookFile(notebook_folder_path=self.notebook_folder_path,
+                                       snapshot_max_size=self.snapshot_max_size,
+                                       snapshot_format=self.snapshot_format,
+                                       name=name)
+        notebook.register_snapshot_function(self._snapshot_function)
+        return notebook
+
+    def write(self, file_path: Optional[str] = None, blocking: bool = False):
+        """
+        Writes the notebook to disk, in the background unless blocking is True.
+
+        Parameters
+        ----------
+        file_path : Optional[str]
+            Path of the notebook file, the default file path if None.
+        blocking : bool
+            If True, waits until the notebook is written.
+        """
         file_path = file_path or self.default_file_path
-        # Write the notebook to disk
-        with open(file_path, 'w') as f:
-            nbformat.write(self.notebook, f)
+
+        with self._lock:
             self.file_path = file_path
+            self._write_requests[(id(self.notebook), file_path)] = (self.notebook, file_path)
+
+            # At most one write in progress per notebook file, it picks up the writes requested in the meantime:
+            if self._write_future is None:
+                self._write_future = _notebook_writer_thread_pool.submit(self._process_write_requests)
+
+        if blocking:
+            self.flush()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until all requested writes are done. Returns False if the timeout expired.
+        """
+        with self._lock:
+            future = self._write_future
+        if future is None:
+            return True
+        done, _ = wait([future], timeout=timeout)
+        return bool(done)
+
+    def _process_write_requests(self):
+        while True:
+            with self._lock:
+                if not self._write_requests:
+                    self._write_future = None
+                    return
+                key = next(iter(self._write_requests))
+                notebook, file_path = self._write_requests.pop(key)
+                cells = list(notebook.cells)
+
+            try:
+                self._write_cells(notebook, cells, file_path)
+            except Exception as e:
+                aprint(f"Error: {type(e).__name__} with message: '{str(e)}' occured while writing notebook to: {file_path}")
+                traceback.print_exc()
+                # Next write starts over:
+                self._written_file_path = None
+
+    def _write_cells(self, notebook: NotebookNode, cells, file_path: str):
+
+        # Cells can be appended if the same notebook was last written to the same file, and the file was not modified since:
+        can_append = (self._written_notebook is notebook
+                      and self._written_file_path == file_path
+                      and path.exists(file_path)
+                      and path.getsize(file_path) == self._written_file_size
+                      and len(cells) >= self._written_cells)
+
+        if can_append:
+            new_cells = cells[self._written_cells:]
+            if not new_cells:
+                return
+            separator = ',\n' if self._written_cells > 0 else '\n'
+            data = (separator + self._serialise_cells(notebook, new_cells) + _notebook_file_tail).encode('utf-8')
+            with open(file_path, 'r+b') as f:
+                # Overwrite the tail of the file:
+                f.seek(self._written_file_size - len(_notebook_file_tail.encode('utf-8')))
+                f.write(data)
+                f.truncate()
+                size = f.tell()
+        else:
+            # Cells come last, so that cells can be appended without rewriting the file:
+            header = json.dumps({'metadata': notebook.metadata,
+                                 'nbformat': notebook.nbformat,
+                                 'nbformat_minor': notebook.nbformat_minor},
+                                indent=1, ensure_ascii=False)[:-2]
+            header += ',\n "cells": ['
+            data = header + ('\n' + self._serialise_cells(notebook, cells) if cells else '') + _notebook_file_tail
+            data = data.encode('utf-8')
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            size = len(data)
+
+        self._written_notebook = notebook
+        self._written_file_path = file_path
+        self._written_cells = len(cells)
+        self._written_file_size = size
+
+    def _serialise_cells(self, notebook: NotebookNode, cells) -> str:
+        serialised_cells = []
+        for cell in cells:
+            # Images are encoded on the writer thread:
+            with self._lock:
+                pending_image = self._pending_images.pop(cell.get('id'), None)
+            if pending_image is not None:
+                self._encode_image(notebook, cell, *pending_image)
+
+            serialised_cell = json.dumps(cell, indent=1, sort_keys=True, ensure_ascii=False)
+            serialised_cells.append('\n'.join('  ' + line for line in serialised_cell.split('\n')))
+        return ',\n'.join(serialised_cells)
 
     def add_code_cell(self, code: str, remove_quotes: bool = False):
 
@@ -80,7 +259,8 @@ class JupyterNotebookFile:
             code = '\n'.join(code.split('\n')[1:-1])
 
         # Add a code cell
-        self.notebook.cells.append(new_code_cell(code))
+        with self._lock:
+            self.notebook.cells.append(new_code_cell(code))
 
         # Mark as modified:
         self._modified = True
@@ -100,21 +280,66 @@ class JupyterNotebookFile:
 
         else:
             # Add a plain markdown cell without detecting code blocks:
-            self.notebook.cells.append(new_markdown_cell(markdown))
+            with self._lock:
+                self.notebook.cells.append(new_markdown_cell(markdown))
 
             # Mark as modified:
             self._modified = True
 
-    def _add_image(self, base64_string: str, image_type: str, text: str = ""):
-        # Add a markdown cell with the image and optional text
-        image_html = f'<img src="data:image/{image_type};base64,{base64_string}"/>'
-        markdown_content = f"{text}\n\n{image_html}" if text else image_html
-        new_image_cell = new_markdown_cell(markdown_content)
-        self.notebook.cells.append(new_image_cell)
+    def _add_image(self,
+                   base64_string: Optional[str],
+                   image_type: str,
+                   text: str = "",
+                   image: Union[Image.Image, numpy.ndarray, None] = None,
+                   snapshot: bool = False):
+        # Add a markdown cell with the image as attachment, and optional text.
+        # Images are not inlined in the markdown, and images given as PIL images or arrays
+        # are only encoded when the notebook is written:
+        with self._lock:
+            attachment_name = f'image_{len(self.notebook.cells)}'
+            if image is not None:
+                new_image_cell = new_markdown_cell(text)
+                new_image_cell['attachments'] = {}
+                self._pending_images[new_image_cell['id']] = (image, attachment_name, image_type, text, snapshot)
+            else:
+                attachment_name += f'.{image_type.lower()}'
+                new_image_cell = new_markdown_cell(_image_markdown(text, attachment_name))
+                new_image_cell['attachments'] = {attachment_name: {f'image/{image_type.lower()}': base64_string}}
+            self.notebook.cells.append(new_image_cell)
 
         # Mark as modified:
         self._modified = True
 
+    def _encode_image(self,
+                      notebook: NotebookNode,
+                      cell: NotebookNode,
+                      image: Union[Image.Image, numpy.ndarray],
+                      attachment_name: str,
+                      image_type: str,
+                      text: str,
+                      snapshot: bool):
+
+        if snapshot:
+            # Snapshots are downscaled, and not repeated if the viewer did not change:
+            image = downscale_image(image, max_size=self.snapshot_max_size)
+            snapshot_hash = image_hash(image)
+            last_notebook, last_hash, last_attachment_name = self._last_snapshot
+            if last_notebook is notebook and last_hash == snapshot_hash:
+                reference = f"*Viewer unchanged since snapshot {last_attachment_name} above.*"
+                cell['source'] = f"{text}\n\n{reference}" if text else reference
+                del cell['attachments']
+                return
+        elif isinstance(image, numpy.ndarray):
+            image = Image.fromarray(image)
+
+        data, mime_type = encode_image(image, image_format=image_type)
+        attachment_name += '.' + mime_type.split('/')[1]
+        cell['source'] = _image_markdown(text, attachment_name)
+        cell['attachments'][attachment_name] = {mime_type: b64encode(data).decode()}
+
+        if snapshot:
+            self._last_snapshot = (notebook, snapshot_hash, attachment_name)
+
     def add_image_cell(self, image_path: str, text: str = ""):
         # Read the image and convert it to base64
         image_type = guess_type(image_path)[0].split('/')[1]
@@ -126,36 +351,50 @@ class JupyterNotebookFile:
 
 
     def add_image_cell_from_PIL_image(self, pil_image: Image, text: str = ""):
-        # Convert PIL image to base64
-        buffered = BytesIO()
-        pil_image.save(buffered, format='PNG')
-        base64_string = b64encode(buffered.getvalue()).decode()
-
-        # Use the existing method to add the image with text
-        self._add_image(base64_string, 'PNG', text)
-
-        # Mark as modified:
-        self._modified = True
+        # The image is converted to PNG when the notebook is written:
+        self._add_image(None, 'png', text, image=pil_image)
 
     def register_snapshot_function(self, snapshot_function: Callable):
         self._snapshot_function = snapshot_function
 
     def take_snapshot(self, text: str = ""):
 
-        # Call the snapshot function:
-        pil_image = self._snapshot_function()
+        # Call the snapshot function, which only grabs the viewer's pixels:
+        screenshot = self._snapshot_function()
 
-        # Add this image to the notebook
-        self.add_image_cell_from_PIL_image(pil_image, text)
+        if screenshot is None or isinstance(screenshot, str):
+            # The snapshot failed, or timed out:
+            aprint(f"Could not take a snapshot of the viewer: {screenshot}")
+            return
+
+        # Add this image to the notebook, it is downscaled, deduplicated, and encoded when the notebook is written:
+        self._add_image(None, self.snapshot_format, text, image=screenshot, snapshot=True)
 
 
     def delete_notebook_file(self):
+        # Wait for pending writes:
+        self.flush()
+
         # Delete the notebook file
         if self.file_path is not None and path.exists(self.file_path):
             os.unlink(self.file_path)
             print(f"Deleted the notebook at {self.file_path}")
 
 
+def flush_notebook_writes(timeout: Optional[float] = None) -> bool:
+    """
+    Waits until the writes requested so far for all notebooks are done. Returns False if the timeout expired.
+    """
+    # Writes run one after the other on the writer thread, so this runs after all of them:
+    done, _ = wait([_notebook_writer_thread_pool.submit(lambda: None)], timeout=timeout)
+    return bool(done)
+
+
+def _image_markdown(text: str, attachment_name: str) -> str:
+    image_markdown = f'![{attachment_name}](attachment:{attachment_name})'
+    return f"{text}\n\n{image_markdown}" if text else image_markdown
+
+
 # def start_jupyter_server(folder_path):
 #     # Function to run the notebook server in a thread
 #     def notebook_thread():
@@ -1,9 +1,15 @@
 import os
 import tempfile
+from base64 import b64decode
+from io import BytesIO
 
+import nbformat
+import numpy
 import requests
+from PIL import Image
 
-from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile
+from napari_chatgpt.utils.notebook.jupyter_notebook import JupyterNotebookFile, \
+    flush_notebook_writes
 
 
 def test_notebook_creation():
@@ -38,6 +44,90 @@ def test_add_markdown_cell():
     notebook.delete_notebook_file()
 
 
+def test_incremental_write(tmp_path):
+    notebook = JupyterNotebookFile(notebook_folder_path=str(tmp_path))
+    notebook.add_markdown_cell("### User:\nOpen the image")
+    notebook.add_code_cell("print('Hello, World!')")
+    notebook.write(blocking=True)
+
+    with open(notebook.file_path, 'rb') as f:
+        first_write = f.read()
+
+    # New cells are appended, images become attachments:
+    notebook.add_markdown_cell("### Omega:\nDone")
+    notebook.add_image_cell_from_PIL_image(Image.fromarray(numpy.zeros((8, 8), dtype=numpy.uint8)), "Snapshot")
+    notebook.write()
+    assert notebook.flush(timeout=10)
+
+    with open(notebook.file_path, 'rb') as f:
+        second_write = f.read()
+    assert second_write.startswith(first_write[:-len('\n ]\n}\n')])
+
+    # The notebook is valid:
+    written_notebook = nbformat.read(notebook.file_path, as_version=4)
+    nbformat.validate(written_notebook)
+    assert [cell.cell_type for cell in written_notebook.cells] == ['markdown', 'code', 'markdown', 'markdown']
+    image_cell = written_notebook.cells[3]
+    assert 'data:image' not in image_cell.source
+    assert 'image/png' in next(iter(image_cell.attachments.values()))
+
+    # After a restart, the new notebook is written to a new file:
+    notebook.restart()
+    notebook.add_code_cell("print('Hello again!')")
+    notebook.write(blocking=True)
+    assert len(nbformat.read(notebook.file_path, as_version=4).cells) == 1
+
+    notebook.delete_notebook_file()
+
+
+def test_spawn_notebooks(tmp_path):
+    notebook = JupyterNotebookFile(notebook_folder_path=str(tmp_path))
+    notebook.register_snapshot_function(lambda: numpy.zeros((8, 8, 3), dtype=numpy.uint8))
+
+    # One notebook per session, written to its own file:
+    notebook_1 = notebook.spawn(name='omega_notebook_1')
+    notebook_2 = notebook.spawn(name='omega_notebook_2')
+    notebook_1.add_markdown_cell("### User:\nOpen the image")
+    notebook_2.add_markdown_cell("### User:\nDenoise the image")
+    notebook_2.take_snapshot()
+    notebook_1.write()
+    notebook_2.write()
+    assert flush_notebook_writes(timeout=10)
+
+    assert notebook_1.file_path != notebook_2.file_path
+    assert notebook_1.file_path.endswith('_omega_notebook_1.ipynb')
+    assert len(nbformat.read(notebook_1.file_path, as_version=4).cells) == 1
+    assert len(nbformat.read(notebook_2.file_path, as_version=4).cells) == 2
+
+
+def test_snapshots(tmp_path):
+    notebook = JupyterNotebookFile(notebook_folder_path=str(tmp_path), snapshot_max_size=64)
+
+    screenshots = [numpy.zeros((256, 128, 4), dtype=numpy.uint8)]
+    notebook.register_snapshot_function(lambda: screenshots[-1])
+
+    # Second snapshot of an unchanged viewer is recorded as a reference:
+    notebook.take_snapshot()
+    notebook.take_snapshot()
+    screenshots.append(numpy.full((256, 128, 4), 255, dtype=numpy.uint8))
+    notebook.take_snapshot()
+    notebook.write(blocking=True)
+
+    cells = nbformat.read(notebook.file_path, as_version=4).cells
+    assert len(cells[0].attachments) == 1
+    assert 'attachments' not in cells[1]
+    assert 'unchanged' in cells[1].source
+    assert len(cells[2].attachments) == 1
+
+    # Snapshots are downscaled:
+    attachment = next(iter(cells[0].attachments.values()))
+    mime_type, data = next(iter(attachment.items()))
+    assert mime_type in ('image/webp', 'image/jpeg')
+    assert Image.open(BytesIO(b64decode(data))).size == (32, 64)
+
+    notebook.delete_notebook_file()
+
+
 def download_image(url, file):
     """Download an image from a URL and save it to a file object."""
     response = requests.get(url)
@@ -1,9 +1,12 @@
 import importlib
 
+from napari_chatgpt.utils.system.ttl_cache import ttl_cache
 
 ### https://packaging.python.org/en/latest/guides/creating-and-discovering-plugins/
 
 
+# Entry points only change when packages are installed, the result is cached for a while:
+@ttl_cache(ttl_seconds=600)
 def discover_omega_tools(group: str = 'omega.tools'):
     """
     This function discovers plugins
@@ -1,9 +1,19 @@
+import base64
+import hashlib
+import json
+from typing import Optional
+
+from PIL import Image
 from arbol import asection, aprint
 
-from napari_chatgpt.utils.api_keys.api_key import set_api_key
+from napari_chatgpt.utils.images.snapshot import encode_image, image_hash
+from napari_chatgpt.utils.llm.llm_cache import get_llm_cache
 from napari_chatgpt.utils.openai.model_list import get_openai_model_list
+from napari_chatgpt.utils.openai.openai_client import get_openai_client
+from napari_chatgpt.utils.system.ttl_cache import ttl_cache
 
 
+@ttl_cache(ttl_seconds=3600)
 def is_gpt_vision_available(vision_model_name: str = 'gpt-4-vision-preview') -> bool:
     """
     Check if GPT-vision is available.
@@ -27,19 +37,21 @@ def is_gpt_vision_available(vision_model_name: str = 'gpt-4-vision-preview') ->
             aprint(f"GPT-vision is available!")
         return is_available
 
-def describe_image(image_path: str,
+def describe_image(image_path: Optional[str] = None,
                    query: str = 'Here is an image, please carefully describe it in detail.',
                    model: str = "gpt-4-vision-preview",
                    max_tokens: int = 4096,
                    number_of_tries: int = 4,
+                   image: Optional[Image.Image] = None,
+                   use_cache: bool = True,
                    ) -> str:
     """
     Describe an image using GPT-vision.
 
     Parameters
     ----------
-    image_path: str
-        Path to the image to describe
+    image_path: Optional[str]
+        Path to the image to describe, ignored if an image is given
     query  : str
         Query to send to GPT
     model   : str
@@ -48,6 +60,10 @@ def describe_image(image_path: str,
         Maximum number of tokens to use
     number_of_tries : int
         Number of times to try to send the request to GPT.
+    image : Optional[Image.Image]
+        Image to describe, encoded in memory
+    use_cache : bool
+        If True, descriptions are cached by image content, query, and model
 
     Returns
     -------
@@ -56,91 +72,132 @@ def describe_image(image_path: str,
 
     """
 
-    with (asection(f"Asking GPT-vision to analyse a given image at path: '{image_path}':")):
+    with (asection(f"Asking GPT-vision to analyse a given image{'' if image is not None else f' at path: {image_path!r}'}:")):
         aprint(f"Query: '{query}'")
         aprint(f"Model: '{model}'")
         aprint(f"Max tokens: '{max_tokens}'")
 
-        if image_path.endswith('.png'):
-            image_format = 'png'
-        elif image_path.endswith('.jpg') or image_path.endswith('.jpeg'):
-            image_format = 'jpeg'
-        else:
-            raise NotImplementedError(f"Image format not supported: '{image_path}' (only .png and .jpg are supported)")
-
-        import base64
-
-        # Read and encode the image in base64
-        with open(image_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
-
-            # Craft the prompt for GPT
-            prompt_messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": query
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/{image_format};base64,{encoded_image}"
-                            }
+        if image is None:
+            if not image_path.endswith(('.png', '.jpg', '.jpeg')):
+                raise NotImplementedError(f"Image format not supported: '{image_path}' (only .png and .jpg are supported)")
+            image = Image.open(image_path)
+
+        # Pixels beyond the model's input resolution are not seen by the model, only sent:
+        image = resize_for_vision(image)
+        aprint(f"Image size: {image.size}")
+
+        # Cached description, if this query was already made for the same image:
+        cache = get_llm_cache() if use_cache else None
+        cache_key = _description_cache_key(image, query, model, max_tokens) if cache is not None else None
+        if cache is not None:
+            description = cache.get(cache_key)
+            if description is not None:
+                aprint(f"Cached description (hits: {cache.hits}, misses: {cache.misses}): '{description}'")
+                return description
+
+        # Encode the image in memory, in base64:
+        image_data, mime_type = encode_image(image, image_format='jpeg', quality=90)
+        encoded_image = base64.b64encode(image_data).decode("utf-8")
+
+        # Craft the prompt for GPT
+        prompt_messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": query
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{encoded_image}"
                         }
-                    ]
-                }
-            ]
-
-            from openai import OpenAI
-            from openai.resources.chat import Completions
-
-            # Ensure that the OpenAI API key is set:
-            set_api_key('OpenAI')
-
-            try:
-                for tries in range(number_of_tries):
-
-                    # Instantiate API entry points:
-                    client = OpenAI()
-                    completions = Completions(client)
-
-                    # Send a request to GPT:
-                    result = completions.create(model=model,
-                                                messages=prompt_messages,
-                                                max_tokens=max_tokens)
-
-                    # Actual response:
-                    response = result.choices[0].message.content
-                    aprint(f"Response: '{response}'")
-
-                    # Check if the response is empty:
-                    if not response:
-                        aprint(f"Response is empty. Trying again...")
-                        continue
-
-                    # response in lower case and trimmed of white spaces
-                    response_lc = response.lower().strip()
-
-                    # Check if response is too short:
-                    if len(response) < 3:
-                        aprint(f"Response is empty. Trying again...")
-                        continue
-
-                    # if the response contains these words: "sorry" and ("I cannot" or "I can't")  then try again:
-                    if ("sorry" in response_lc and ("i cannot" in response_lc or "i can't" in response_lc or 'i am unable' in response_lc)) \
-                        or "i cannot assist" in response_lc:
-                        aprint(f"Vision model refuses to assist (response: {response}). Trying again...")
-                        continue
-                    else:
-                        return response
-
-            except Exception as e:
-                # Log the error:
-                aprint(f"Error: '{e}'")
-                # print stack trace:
-                import traceback
-                traceback.print_exc()
-                return f"Error: '{e}'"
+                    }
+                ]
+            }
+        ]
+
+        try:
+            # Shared client, its connections are reused across tries and requests:
+            client = get_openai_client()
+
+            for tries in range(number_of_tries):
+
+                # Send a request to GPT:
+                result = client.chat.completions.create(model=model,
+                                                        messages=prompt_messages,
+                                                        max_tokens=max_tokens)
+
+                # Actual response:
+                response = result.choices[0].message.content
+                aprint(f"Response: '{response}'")
+
+                # Check if the response is empty:
+                if not response:
+                    aprint(f"Response is empty. Trying again...")
+                    continue
+
+                # response in lower case and trimmed of white spaces
+                response_lc = response.lower().strip()
+
+                # Check if response is too short:
+                if len(response) < 3:
+                    aprint(f"Response is empty. Trying again...")
+                    continue
+
+                # if the response contains these words: "sorry" and ("I cannot" or "I can't")  then try again:
+                if ("sorry" in response_lc and ("i cannot" in response_lc or "i can't" in response_lc or 'i am unable' in response_lc)) \
+                    or "i cannot assist" in response_lc:
+                    aprint(f"Vision model refuses to assist (response: {response}). Trying again...")
+                    continue
+                else:
+                    if cache is not None:
+                        cache.put(cache_key, response)
+                    return response
+
+        except Exception as e:
+            # Log the error:
+            aprint(f"Error: '{e}'")
+            # print stack trace:
+            import traceback
+            traceback.print_exc()
+            return f"Error: '{e}'"
+
+
+def resize_for_vision(image: Image.Image,
+                      max_long_side: int = 2048,
+                      max_short_side: int = 768) -> Image.Image:
+    """
+    Downscales an image to the effective input resolution of GPT-vision models, which scale images
+    to fit within 2048x2048 pixels, and then so that their shortest side is at most 768 pixels.
+
+    Parameters
+    ----------
+    image : Image.Image
+        Image to resize
+    max_long_side : int
+        Maximum length of the longest side
+    max_short_side : int
+        Maximum length of the shortest side
 
+    Returns
+    -------
+    Image.Image
+        Resized image, or the same image if it is small enough
+
+    """
+    width, height = image.size
+    scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    return image
+
+
+def _description_cache_key(image: Image.Image, query: str, model: str, max_tokens: int) -> str:
+    content = json.dumps({'image': image_hash(image),
+                          'query': query,
+                          'model': model,
+                          'max_tokens': max_tokens},
+                         sort_keys=True)
+    return 'vision:' + hashlib.sha256(content.encode('utf-8')).hexdigest()
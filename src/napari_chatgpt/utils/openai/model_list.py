@@ -3,13 +3,14 @@ import traceback
 from arbol import asection, aprint
 
 from napari_chatgpt.utils.api_keys.api_key import set_api_key
+from napari_chatgpt.utils.system.ttl_cache import ttl_cache
 
 
-
-
+@ttl_cache(ttl_seconds=3600)
 def get_openai_model_list(filter: str = 'gpt', verbose: bool = False) -> list:
     """
     Get the list of all OpenAI ChatGPT models.
+    The list is cached for an hour, this avoids a network request each time.
 
     Parameters
     ----------
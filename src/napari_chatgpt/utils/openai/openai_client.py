@@ -0,0 +1,34 @@
+import os
+from threading import Lock
+
+from napari_chatgpt.utils.api_keys.api_key import set_api_key
+
+# OpenAI client shared by all threads, see get_openai_client():
+_openai_client = None
+_openai_client_lock = Lock()
+
+
+def get_openai_client():
+    """
+    Returns an OpenAI client shared by all callers, so that its HTTP connection pool is reused
+    across requests instead of opening new connections for each request.
+    A new client is created if the OpenAI API key changed.
+
+    Returns
+    -------
+    OpenAI
+        OpenAI client
+
+    """
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None or _openai_client.api_key != os.environ.get('OPENAI_API_KEY'):
+
+            # Ensure that the OpenAI API key is set:
+            set_api_key('OpenAI')
+
+            # Local imports to avoid issues:
+            from openai import OpenAI
+            _openai_client = OpenAI()
+
+        return _openai_client
@@ -1,9 +1,16 @@
+import os
+from types import SimpleNamespace
+
+import numpy
 import pytest
+from PIL import Image
 from arbol import aprint
 
 from napari_chatgpt.utils.api_keys.api_key import is_api_key_available
+from napari_chatgpt.utils.llm.llm_cache import LLMCache
+from napari_chatgpt.utils.openai import gpt_vision
 from napari_chatgpt.utils.openai.gpt_vision import is_gpt_vision_available, \
-    describe_image
+    describe_image, resize_for_vision
 
 
 @pytest.mark.skipif(not is_api_key_available('OpenAI'),
@@ -32,6 +39,36 @@ def test_gpt_vision():
     assert 'futuristic' in description_2 and ('sunset' in description_2 or 'sunrise' in description_2 or 'landscape' in description_2)
 
 
+def test_describe_image_cached(tmp_path, monkeypatch):
+
+    # Fake client that records the requests it receives:
+    requests = []
+
+    def _create(model, messages, max_tokens):
+        requests.append(messages)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='A bright square.'))])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=_create)))
+    cache = LLMCache(path=os.path.join(tmp_path, 'cache.sqlite'))
+    monkeypatch.setattr(gpt_vision, 'get_openai_client', lambda: client)
+    monkeypatch.setattr(gpt_vision, 'get_llm_cache', lambda: cache)
+
+    image = Image.fromarray(numpy.full((3000, 1500, 3), 255, dtype=numpy.uint8))
+    assert resize_for_vision(image).size == (768, 1536)
+
+    # Second identical query is answered from the cache:
+    assert describe_image(image=image, query='Describe this.') == 'A bright square.'
+    assert describe_image(image=image.copy(), query='Describe this.') == 'A bright square.'
+    assert len(requests) == 1
+
+    # Different query, new request:
+    describe_image(image=image, query='What color is it?')
+    assert len(requests) == 2
+    assert requests[0][0]['content'][1]['image_url']['url'].startswith('data:image/jpeg;base64,')
+
+    cache.close()
+
+
 def _get_image_path(image_name: str):
     import os
 
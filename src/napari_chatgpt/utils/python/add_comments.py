@@ -8,6 +8,7 @@ from langchain_openai import ChatOpenAI
 
 from napari_chatgpt.chat_server.callbacks.callbacks_arbol_stdout import \
     ArbolCallbackHandler
+from napari_chatgpt.utils.llm.llm_cache import cached_chain_invoke
 from napari_chatgpt.utils.openai.default_model import \
     get_default_openai_model_name
 from napari_chatgpt.utils.python.installed_packages import \
@@ -101,7 +102,7 @@ def add_comments(code: str,
             variables = {"code": code, 'installed_packages': ' '.join(package_list)}
 
             # call LLM:
-            response = chain.invoke(variables)['text']
+            response = cached_chain_invoke(chain, variables)
 
             # Extract code from the response:
             commented_code = extract_code_from_markdown(response)
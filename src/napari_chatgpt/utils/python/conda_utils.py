@@ -4,6 +4,7 @@ from typing import List
 from arbol import asection, aprint
 
 from napari_chatgpt.utils.python.installed_packages import is_package_installed
+from napari_chatgpt.utils.python.package_index import invalidate_package_index
 
 
 def conda_install(list_of_packages: List[str], channel:str = None) -> bool:
@@ -32,6 +33,9 @@ def conda_install(list_of_packages: List[str], channel:str = None) -> bool:
                     aprint(f"An error occurred while installing {package}. Error: {e}")
                     error_occurred = True
 
+    # Installed packages have changed:
+    invalidate_package_index()
+
     return not error_occurred
 
 
@@ -58,4 +62,7 @@ def conda_uninstall(list_of_packages):
                     aprint(f"An error occurred while uninstalling {package}. Error: {e}")
                     error_occurred = True
 
+    # Installed packages have changed:
+    invalidate_package_index()
+
     return not error_occurred
\ No newline at end of file
@@ -1,39 +1,82 @@
-import importlib.util
-import importlib.util
-import tempfile
+import hashlib
+import linecache
+from collections import OrderedDict
 from contextlib import redirect_stdout
 from io import StringIO
-from random import randint
-from typing import Optional, Any
+from threading import Lock
+from types import CodeType, ModuleType
+from typing import Optional, Any, Tuple
 
 from arbol import asection, aprint
 
+# Compiled code objects keyed by hash of the source code, least recently used first:
+_code_cache: 'OrderedDict[str, Tuple[str, CodeType]]' = OrderedDict()
+_code_cache_lock = Lock()
+_code_cache_max_size = 256
+
 
 def dynamic_import(module_code: str,
                    name: str = None) -> Optional[Any]:
+    """
+    Loads Python code as a new module, directly from memory.
+    The code is compiled once per distinct source and the compiled code is cached,
+    so that running the same code again (retries, snippet editor) does not recompile it.
+    The source is registered in linecache so that tracebacks and inspect.getsource() work.
+
+    Parameters
+    ----------
+    module_code : str
+        Python code of the module.
+    name : str
+        Name of the module, by default derived from the hash of the code.
+
+    Returns
+    -------
+    ModuleType
+        Freshly executed module.
+    """
+
+    # Compile, or get compiled code from cache:
+    digest, code_object = _compile(module_code)
+
     # Module name:
     if not name:
-        name = f'some_code_{randint(0, 999999999)}'
-
-    # Write code to temp file:
-    with tempfile.NamedTemporaryFile(mode="w", suffix='.py', delete=False) as f:
-        f.write(module_code)
-        module_path = f.name
+        name = f'some_code_{digest}'
 
-    # Load the module from the temporary file
-    spec = importlib.util.spec_from_file_location(name=name,
-                                                  location=module_path)
-
-    # Not clear what this is about:
-    loaded_module = importlib.util.module_from_spec(spec)
+    # Create module:
+    loaded_module = ModuleType(name)
+    loaded_module.__file__ = code_object.co_filename
 
     # Execute module:
-    spec.loader.exec_module(loaded_module)
+    exec(code_object, loaded_module.__dict__)
 
     return loaded_module
 
 
+def _compile(module_code: str) -> Tuple[str, CodeType]:
+    digest = hashlib.sha256(module_code.encode('utf-8')).hexdigest()[:16]
+
+    with _code_cache_lock:
+        if digest in _code_cache:
+            _code_cache.move_to_end(digest)
+            return digest, _code_cache[digest][1]
+
+    # Stable pseudo file name for the code:
+    filename = f'<omega_code_{digest}>'
+
+    code_object = compile(module_code, filename, 'exec')
+
+    with _code_cache_lock:
+        # Register source for tracebacks and inspect:
+        linecache.cache[filename] = (len(module_code), None, module_code.splitlines(keepends=True), filename)
+        _code_cache[digest] = (filename, code_object)
+
+        # Evict least recently used code, and its source:
+        while len(_code_cache) > _code_cache_max_size:
+            _, (evicted_filename, _) = _code_cache.popitem(last=False)
+            linecache.cache.pop(evicted_filename, None)
 
+    return digest, code_object
 
 
 def execute_as_module(code_str, name: str = None, **kwargs) -> str:
@@ -1,8 +1,9 @@
+import ast
 import re
 import sys
 import traceback
 from difflib import Differ
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
 from arbol import asection, aprint
 from langchain.chains import LLMChain
@@ -12,12 +13,14 @@ from langchain_openai import ChatOpenAI
 
 from napari_chatgpt.chat_server.callbacks.callbacks_arbol_stdout import \
     ArbolCallbackHandler
+from napari_chatgpt.utils.llm.llm_cache import cached_chain_invoke
 from napari_chatgpt.utils.openai.default_model import \
     get_default_openai_model_name
 from napari_chatgpt.utils.python.installed_packages import \
     installed_package_list
 from napari_chatgpt.utils.python.python_lang_utils import \
     extract_fully_qualified_function_names, function_exists
+from napari_chatgpt.utils.python.symbol_index import get_symbol_index
 
 
 def fix_all_bad_function_calls(code: str,
@@ -44,47 +47,38 @@ def fix_all_bad_function_calls(code: str,
             # First extract function calls from code:
             function_calls = extract_fully_qualified_function_names(code)
 
-            # Is there at least one non-existing function used?
-            one_non_existing_function_used = any(
-                not function_exists(fully_qual_fun_name) for
-                fully_qual_fun_name, original_function_call in function_calls)
+            # Distinct calls to non-existing functions, the same call might appear several times in the code:
+            bad_function_calls = list(dict.fromkeys((fully_qual_fun_name, original_function_call)
+                                                    for fully_qual_fun_name, original_function_call in function_calls
+                                                    if not function_exists(fully_qual_fun_name)))
 
-            if one_non_existing_function_used:
+            # Is there at least one non-existing function used?
+            if len(bad_function_calls) > 0:
 
                 # There is at least one function that does not exist:
                 function_calls_report = '**NON-EXISTENT FUNCTION REPORT:**\n'
                 function_calls_report += 'I reviewed the code and verified if the function calls correspond to existing functions within the installed packages. \n'
                 function_calls_report += 'I discovered that the following function calls are referring to functions that do not exist:\n'
-                for fully_qual_fun_name, original_function_call in function_calls:
-                    if not function_exists(fully_qual_fun_name):
-                        function_calls_report += f"- Function call: '{original_function_call}(...)' refers to an non-existing function: '{fully_qual_fun_name}'!\n"
+                for fully_qual_fun_name, original_function_call in bad_function_calls:
+                    function_calls_report += f"- Function call: '{original_function_call}(...)' refers to an non-existing function: '{fully_qual_fun_name}'!\n"
                 function_calls_report += 'It is possible that the code is referring to an incorrect version of the library or package.\n'
                 function_calls_report += "I recommend changing the import statement and/or the qualified name of the function to a different version.\n"
 
                 with asection('Non-existent function report:'):
                     aprint(function_calls_report)
 
-                for fully_qual_fun_name, original_function_call in function_calls:
-                    if not function_exists(fully_qual_fun_name):
-
-                        # get the fix:
-                        fixed_function_call = fix_function_call(original_function_call,
-                                                                fully_qual_fun_name,
-                                                                llm=llm,
-                                                                verbose=verbose)
-
-                        aprint(f"LLM proposes this '{fixed_function_call}' as fix for '{fully_qual_fun_name}' (original: '{original_function_call}')")
-
-                        # Apply fix:
-                        fixed_code = fixed_code.replace(original_function_call, fixed_function_call)
+                # Get the fixes, from the symbol index if possible, otherwise from the LLM in a single request:
+                fixes = fix_function_calls(bad_function_calls, llm=llm, verbose=verbose)
 
-                        # Prepend import:
-                        package_name = fixed_function_call.split('.')[0]
-                        import_statement = f'import {package_name}\n'
-                        aprint(
-                            f'Adding this import statemet: {import_statement}')
-                        fixed_code = import_statement + fixed_code
+                # Apply all fixes at once:
+                fixed_code = replace_function_calls(fixed_code, fixes)
 
+                # Prepend imports:
+                package_names = list(dict.fromkeys(fixed_function_call.split('.')[0] for fixed_function_call in fixes.values()))
+                for package_name in package_names:
+                    import_statement = f'import {package_name}\n'
+                    aprint(f'Adding this import statemet: {import_statement}')
+                    fixed_code = import_statement + fixed_code
 
                 with asection(f'Fixed code:'):
                     aprint(fixed_code)
@@ -110,39 +104,151 @@ def fix_all_bad_function_calls(code: str,
             return code, False, ''
 
 
+def fix_function_calls(bad_function_calls: List[Tuple[str, str]],
+                       llm: BaseLLM = None,
+                       verbose: bool = False) -> Dict[str, str]:
+    """
+    Proposes fixes for calls to non-existent functions. Fixes are found in the symbol index when possible,
+    and the remaining calls are all sent to the LLM in a single request.
+
+    Parameters
+    ----------
+    bad_function_calls : List[Tuple[str, str]]
+        List of (fully qualified function name, original function call) pairs,
+        for example: ('skimage.transform.line', 'transform.line').
+    llm : BaseLLM
+        LLM to use for calls that cannot be fixed locally.
+    verbose : bool
+        Verbosity flag.
+
+    Returns
+    -------
+    Dict[str, str]
+        Dictionary mapping original function calls to fully qualified fixed function calls,
+        calls that could not be fixed are omitted.
+    """
+
+    fixes = {}
+    remaining_function_calls = []
+
+    for fully_qual_fun_name, original_function_call in bad_function_calls:
+        fixed_function_call = fix_function_call_locally(fully_qual_fun_name)
+        if fixed_function_call:
+            aprint(f"Symbol index proposes this '{fixed_function_call}' as fix for '{fully_qual_fun_name}' (original: '{original_function_call}')")
+            fixes[original_function_call] = fixed_function_call
+        else:
+            remaining_function_calls.append((fully_qual_fun_name, original_function_call))
+
+    if remaining_function_calls:
+        llm_fixes = _fix_function_calls_with_llm(remaining_function_calls, llm=llm, verbose=verbose)
+
+        for (fully_qual_fun_name, original_function_call), fixed_function_call in zip(remaining_function_calls, llm_fixes):
+            aprint(f"LLM proposes this '{fixed_function_call}' as fix for '{fully_qual_fun_name}' (original: '{original_function_call}')")
+
+            # Only keep fixes that refer to existing functions:
+            if fixed_function_call and function_exists(fixed_function_call):
+                fixes[original_function_call] = fixed_function_call
+
+    return fixes
+
+
+def fix_function_call_locally(fully_qual_fun_name: str) -> Optional[str]:
+    """
+    Proposes a fix for a call to a non-existent function using the symbol index of its package,
+    for example: 'skimage.transform.line' -> 'skimage.draw.line'. Returns None if no close match is found,
+    or if the symbol index is not ready yet, in which case it is built in the background.
+    """
+    symbol_index = get_symbol_index(fully_qual_fun_name.split('.')[0], wait=False)
+    if symbol_index is None:
+        return None
+
+    candidates = symbol_index.closest(fully_qual_fun_name, max_results=1)
+    return candidates[0] if candidates else None
+
+
+def fix_function_call(original_function_call:str,
+                      fully_qual_fun_name: str,
+                      llm: BaseLLM = None,
+                      verbose: bool = False
+                      ):
+    return _fix_function_calls_with_llm([(fully_qual_fun_name, original_function_call)], llm=llm, verbose=verbose)[0]
+
+
+def replace_function_calls(code: str, fixes: Dict[str, str]) -> str:
+    """
+    Replaces the function part of calls in the code according to the given dictionary of fixes,
+    for example: {'transform.line': 'skimage.draw.line'}. Only actual calls are rewritten,
+    names in strings, comments, or other expressions are left untouched.
+    """
+    if not fixes:
+        return code
+
+    tree = ast.parse(code)
+
+    # Byte offset of the start of each line, AST column offsets are in UTF-8 bytes:
+    encoded_code = code.encode('utf-8')
+    line_offsets = [0]
+    for line in encoded_code.splitlines(keepends=True):
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    spans = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            dotted_name = _dotted_name(node.func)
+            if dotted_name in fixes:
+                start = line_offsets[node.func.lineno - 1] + node.func.col_offset
+                end = line_offsets[node.func.end_lineno - 1] + node.func.end_col_offset
+                spans.append((start, end, fixes[dotted_name]))
+
+    # Replace from the end so that offsets remain valid:
+    for start, end, replacement in sorted(spans, reverse=True):
+        encoded_code = encoded_code[:start] + replacement.encode('utf-8') + encoded_code[end:]
+
+    return encoded_code.decode('utf-8')
+
+
+def _dotted_name(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        prefix = _dotted_name(node.value)
+        return f"{prefix}.{node.attr}" if prefix else None
+    return None
+
+
 _fix_bad_fun_calls_prompt = f"""
 **Context:**
 You are an expert Python coder with extensive knowledge of all python libraries and their different versions.
 
-This function call: '{'{call}'}' refers to a non-existent function '{'{fully_qual_fun_name}'}'.
+The following function calls refer to non-existent functions:
+{'{calls}'}
+
 The current environment is based on Python version {sys.version.split()[0]} and has the following packages/libraries installed:
-{'{package_list}'}. It is very likely that the function call exists but for a different version of the library! 
+{'{package_list}'}. It is very likely that the function calls exist but for a different version of the library! 
 
 **Task:**
-Please propose the most likely fix for the function call. 
+Please propose the most likely fix for each function call. 
 For example: if I tell you that this function call: 'transform.line' refers to a non existent function: 'skimage.transform.line',
 you should return the fully qualified corrected function call: 'skimage.draw.line' as this is the correct call for recent version of scikit-image. 
-In any case you should check the list above of packages and their version to return the correct function call.
-Important: just return the function call as a single line with no comments before or after!
-please enclose the returned fixed function call using apostrophes: '<fully_qualified_fixed_function_call>'.
+In any case you should check the list above of packages and their version to return the correct function calls.
+Important: return one line per function call, in the same order and with the same number, with no comments before or after!
+please enclose each returned fixed function call using apostrophes, for example: 1. '<fully_qualified_fixed_function_call>'.
 
-**Fixed Call:**
+**Fixed Calls:**
 """
 
-def fix_function_call(original_function_call:str,
-                      fully_qual_fun_name: str,
-                      llm: BaseLLM = None,
-                      verbose: bool = False
-                      ):
+
+def _fix_function_calls_with_llm(bad_function_calls: List[Tuple[str, str]],
+                                 llm: BaseLLM = None,
+                                 verbose: bool = False) -> List[Optional[str]]:
 
     # Instantiates LLM if needed:
     llm = llm or ChatOpenAI(model_name=get_default_openai_model_name(), temperature=0)
 
     # Make prompt template:
     prompt_template = PromptTemplate(template=_fix_bad_fun_calls_prompt,
-                                     input_variables=["call",
-                                                      'package_list',
-                                                      'fully_qual_fun_name'])
+                                     input_variables=['calls',
+                                                      'package_list'])
 
     # Instantiate chain:
     chain = LLMChain(
@@ -152,32 +258,41 @@ def fix_function_call(original_function_call:str,
         callbacks=[ArbolCallbackHandler('fix_all_bad_function_calls')]
     )
 
-    # List of installed packages with their versions:
+    # List of installed packages with their versions, shared by all calls:
     package_list = installed_package_list()
 
     # turn it into a string:
     package_list_str = '\n'.join(package_list)
 
+    # Numbered list of calls:
+    calls_str = '\n'.join(f"{i + 1}. Function call: '{original_function_call}' refers to the non-existent function: '{fully_qual_fun_name}'"
+                          for i, (fully_qual_fun_name, original_function_call) in enumerate(bad_function_calls))
+
     # Variable for prompt:
-    variables = {'call': original_function_call,
-                 'package_list': package_list_str,
-                 'fully_qual_fun_name': fully_qual_fun_name}
+    variables = {'calls': calls_str,
+                 'package_list': package_list_str}
 
     # call LLM:
-    fixed_function_call = chain.invoke(variables)['text']
+    response = cached_chain_invoke(chain, variables)
 
-    # Cleanup:
-    fixed_function_call = fixed_function_call.strip()
-
-    # Parse function call:
-    fixed_function_call = _parse_function_call(fixed_function_call)
+    # Parse numbered fixed function calls:
+    fixed_function_calls = [None] * len(bad_function_calls)
+    for line in response.strip().splitlines():
+        match = re.match(r"\s*(\d+)[.):]\s*(.*)", line)
+        if match:
+            index = int(match.group(1)) - 1
+            if 0 <= index < len(fixed_function_calls):
+                fixed_function_calls[index] = _parse_function_call(match.group(2).strip())
+        elif len(bad_function_calls) == 1 and line.strip():
+            # Unnumbered answer for a single call:
+            fixed_function_calls[0] = _parse_function_call(line.strip())
 
-    return fixed_function_call
+    return fixed_function_calls
 
 
 def _parse_function_call(string):
     if "'" in string:
-        pattern = r"'([a-zA-Z]+(?:\.[a-zA-Z]+)*)'"
+        pattern = r"'([a-zA-Z_]\w*(?:\.[a-zA-Z_]\w*)*)'"
         match = re.search(pattern, string)
         if match:
             return match.group(1)
@@ -0,0 +1,293 @@
+import ast
+import builtins
+import importlib
+import importlib.util
+import inspect
+from functools import cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from arbol import aprint
+
+# Conventional aliases and the import statements that define them:
+_conventional_aliases = {
+    'np': ('numpy', 'import numpy as np'),
+    'pd': ('pandas', 'import pandas as pd'),
+    'plt': ('matplotlib', 'import matplotlib.pyplot as plt'),
+    'mpl': ('matplotlib', 'import matplotlib as mpl'),
+    'ndi': ('scipy', 'from scipy import ndimage as ndi'),
+    'ndimage': ('scipy', 'from scipy import ndimage'),
+    'sp': ('scipy', 'import scipy as sp'),
+    'da': ('dask', 'import dask.array as da'),
+    'xr': ('xarray', 'import xarray as xr'),
+    'sns': ('seaborn', 'import seaborn as sns'),
+    'tf': ('tensorflow', 'import tensorflow as tf'),
+    'nx': ('networkx', 'import networkx as nx'),
+    'ski': ('skimage', 'import skimage as ski'),
+    'cle': ('pyclesperanto_prototype', 'import pyclesperanto_prototype as cle'),
+}
+
+# Scikit-image submodules, often used without their package prefix:
+_skimage_submodules = ('color', 'data', 'draw', 'exposure', 'feature',
+                       'filters', 'graph', 'io', 'measure', 'metrics',
+                       'morphology', 'registration', 'restoration',
+                       'segmentation', 'transform', 'util')
+
+# Curated symbols and the modules they are imported from. Only names with one obvious meaning are listed,
+# names defined in several common modules with different meanings (e.g. 'rotate', 'binary_erosion', 'imread')
+# are left unresolved for the LLM to fix:
+_curated_symbols = {
+    # Standard library:
+    'Any': 'typing', 'Callable': 'typing', 'Dict': 'typing', 'List': 'typing',
+    'Optional': 'typing', 'Sequence': 'typing', 'Set': 'typing', 'Tuple': 'typing', 'Union': 'typing',
+    'Path': 'pathlib',
+    'Counter': 'collections', 'OrderedDict': 'collections', 'defaultdict': 'collections',
+    'deque': 'collections', 'namedtuple': 'collections',
+    'dataclass': 'dataclasses', 'field': 'dataclasses',
+    'lru_cache': 'functools', 'partial': 'functools', 'reduce': 'functools',
+    # napari and magicgui:
+    'ImageData': 'napari.types', 'LabelsData': 'napari.types', 'LayerDataTuple': 'napari.types',
+    'PointsData': 'napari.types', 'ShapesData': 'napari.types',
+    'Image': 'napari.layers', 'Labels': 'napari.layers', 'Layer': 'napari.layers',
+    'Points': 'napari.layers', 'Shapes': 'napari.layers', 'Surface': 'napari.layers',
+    'Tracks': 'napari.layers', 'Vectors': 'napari.layers',
+    # SciPy:
+    'binary_fill_holes': 'scipy.ndimage', 'center_of_mass': 'scipy.ndimage',
+    'distance_transform_edt': 'scipy.ndimage', 'gaussian_filter': 'scipy.ndimage',
+    'maximum_filter': 'scipy.ndimage', 'median_filter': 'scipy.ndimage',
+    'minimum_filter': 'scipy.ndimage', 'uniform_filter': 'scipy.ndimage',
+    'convolve2d': 'scipy.signal', 'fftconvolve': 'scipy.signal', 'find_peaks': 'scipy.signal',
+    # scikit-image:
+    'find_contours': 'skimage.measure', 'label': 'skimage.measure',
+    'regionprops': 'skimage.measure', 'regionprops_table': 'skimage.measure',
+    'threshold_li': 'skimage.filters', 'threshold_local': 'skimage.filters',
+    'threshold_otsu': 'skimage.filters', 'threshold_triangle': 'skimage.filters',
+    'threshold_yen': 'skimage.filters', 'sobel': 'skimage.filters',
+    'ball': 'skimage.morphology', 'disk': 'skimage.morphology',
+    'remove_small_holes': 'skimage.morphology', 'remove_small_objects': 'skimage.morphology',
+    'clear_border': 'skimage.segmentation', 'find_boundaries': 'skimage.segmentation',
+    'watershed': 'skimage.segmentation',
+    'peak_local_max': 'skimage.feature',
+    'equalize_adapthist': 'skimage.exposure', 'rescale_intensity': 'skimage.exposure',
+    'denoise_nl_means': 'skimage.restoration', 'estimate_sigma': 'skimage.restoration',
+    'img_as_float': 'skimage.util', 'img_as_ubyte': 'skimage.util',
+}
+
+# Names that are always defined when Omega runs code:
+_predefined_names = {'viewer', '__name__', '__file__', '__doc__'}
+
+
+def resolve_missing_imports(code: str) -> Tuple[List[str], Set[str]]:
+    """
+    Statically determines the import statements required to run the given code, without any LLM.
+    Names used but never bound in the code are resolved against conventional aliases (np, ndi, ...),
+    scikit-image and SciPy submodules, a curated table of common symbols, and installed top-level modules.
+    A name is only resolved to a module if it is used with attributes, and all the attributes used on it exist.
+
+    Parameters
+    ----------
+    code : str
+        Python code to analyse.
+
+    Returns
+    -------
+    Tuple[List[str], Set[str]]
+        Import statements for the names that could be resolved,
+        and the set of names that could not be resolved.
+
+    Raises
+    ------
+    SyntaxError
+        If the code cannot be parsed.
+    """
+
+    # Names used but never bound, and the dotted paths they are used with:
+    unbound = unbound_names(code)
+
+    imports = []
+    unresolved = set()
+
+    for name, dotted_paths in unbound.items():
+        import_statements = _resolve_name(name, dotted_paths)
+        if import_statements:
+            aprint(f"Name '{name}' resolved with: {', '.join(import_statements)}")
+            imports.extend(s for s in import_statements if s not in imports)
+        else:
+            unresolved.add(name)
+
+    return imports, unresolved
+
+
+def existing_imports(code: str) -> List[str]:
+    """
+    Returns the import statements already in the code, one statement per line.
+    """
+    tree = ast.parse(code)
+    statements = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            statement = ast.unparse(node)
+            if statement not in statements:
+                statements.append(statement)
+    return statements
+
+
+def unbound_names(code: str) -> Dict[str, Set[str]]:
+    """
+    Returns the names that are used but never bound in the code (ignoring builtins),
+    mapped to the dotted attribute paths they are used with (e.g. 'scipy.signal.convolve2d').
+    A name used on its own (e.g. 'magicgui(...)') has itself as one of its paths.
+    Scopes are not distinguished: a name bound anywhere in the code is considered bound.
+    """
+    tree = ast.parse(code)
+
+    # Names used as root of an attribute access:
+    attribute_roots = {id(node.value) for node in ast.walk(tree) if isinstance(node, ast.Attribute)}
+
+    bound = set(dir(builtins)) | _predefined_names
+    used: Dict[str, Set[str]] = {}
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                paths = used.setdefault(node.id, set())
+                if id(node) not in attribute_roots:
+                    paths.add(node.id)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            dotted_path = _dotted_path(node)
+            if dotted_path:
+                used.setdefault(dotted_path.split('.')[0], set()).add(dotted_path)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bound.add(alias.asname or alias.name.split('.')[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+
+    return {name: paths for name, paths in used.items() if name not in bound}
+
+
+def _dotted_path(node: ast.Attribute) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return '.'.join(reversed(parts))
+
+
+def _resolve_name(name: str, dotted_paths: Set[str]) -> List[str]:
+
+    # Conventional aliases:
+    if name in _conventional_aliases:
+        package, import_statement = _conventional_aliases[name]
+        if _is_module_available(package):
+            return [import_statement]
+
+    # Curated symbols, only those with one obvious meaning:
+    module_name = _curated_symbols.get(name)
+    if module_name and _symbol_paths_exist(module_name, name, dotted_paths):
+        return [f"from {module_name} import {name}"]
+
+    # Modules used on their own are probably undefined variables (e.g. 'data', 'test'),
+    # except for callables of the same name (e.g. magicgui, tqdm):
+    if name in dotted_paths:
+        if _is_module_available(name) and _module_has_attribute(name, name):
+            return [f"from {name} import {name}"]
+        return []
+
+    # Scikit-image and SciPy submodules, often used without their package prefix (e.g. io.imread, signal.convolve2d),
+    # tried before top-level modules of the same name, such as 'io' or 'signal' in the standard library:
+    for package in ('skimage', 'scipy'):
+        module_name = f'{package}.{name}'
+        if (package != 'skimage' or name in _skimage_submodules) \
+                and _is_module_available(module_name) \
+                and all(_module_path_exists(module_name, _attribute_path(name, path)) for path in dotted_paths):
+            return [f"from {package} import {name}"]
+
+    # Installed top-level modules, possibly used with submodules (e.g. scipy.signal.convolve2d),
+    # only if all the attributes used exist:
+    if _is_module_available(name):
+        if all(_module_path_exists(name, _attribute_path(name, path)) for path in dotted_paths):
+            submodules = {_longest_module_prefix(path) for path in dotted_paths}
+            submodules.discard(name)
+            submodules.discard(None)
+            return [f"import {module}" for module in sorted(submodules)] or [f"import {name}"]
+
+    # Left unresolved, for example for the LLM to fix:
+    return []
+
+
+def _attribute_path(name: str, dotted_path: str) -> str:
+    # Attributes used on the name, e.g. 'imread' for 'io.imread':
+    return dotted_path[len(name) + 1:]
+
+
+@cache
+def _module_path_exists(module_name: str, attribute_path: str) -> bool:
+    # Whether each attribute of the path exists, submodules are imported as needed:
+    try:
+        obj = importlib.import_module(module_name)
+    except Exception:
+        return False
+    for attribute in filter(None, attribute_path.split('.')):
+        if hasattr(obj, attribute):
+            obj = getattr(obj, attribute)
+        elif inspect.ismodule(obj) and _is_module_available(f'{obj.__name__}.{attribute}'):
+            try:
+                obj = importlib.import_module(f'{obj.__name__}.{attribute}')
+            except Exception:
+                return False
+        else:
+            return False
+    return True
+
+
+def _symbol_paths_exist(module_name: str, name: str, dotted_paths: Set[str]) -> bool:
+    try:
+        symbol = getattr(importlib.import_module(module_name), name)
+    except Exception:
+        return False
+    if inspect.ismodule(symbol):
+        return False
+    for path in dotted_paths:
+        obj = symbol
+        for attribute in filter(None, _attribute_path(name, path).split('.')):
+            if not hasattr(obj, attribute):
+                return False
+            obj = getattr(obj, attribute)
+    return True
+
+
+def _longest_module_prefix(dotted_path: str) -> Optional[str]:
+    parts = dotted_path.split('.')
+    for length in range(len(parts), 0, -1):
+        prefix = '.'.join(parts[:length])
+        if _is_module_available(prefix):
+            return prefix
+    return None
+
+
+@cache
+def _is_module_available(module_name: str) -> bool:
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError, AttributeError):
+        return False
+
+
+@cache
+def _module_has_attribute(module_name: str, name: str) -> bool:
+    try:
+        return hasattr(importlib.import_module(module_name), name)
+    except Exception:
+        return False
+
@@ -1,4 +1,5 @@
 import sys
+from textwrap import dedent
 
 from arbol import aprint, asection
 from langchain.chains import LLMChain
@@ -8,8 +9,12 @@ from langchain_openai import ChatOpenAI
 
 from napari_chatgpt.chat_server.callbacks.callbacks_arbol_stdout import \
     ArbolCallbackHandler
+from napari_chatgpt.utils.llm.llm_cache import cached_chain_invoke
 from napari_chatgpt.utils.openai.default_model import \
     get_default_openai_model_name
+from napari_chatgpt.utils.python.installed_packages import is_package_installed
+from napari_chatgpt.utils.python.package_resolver import \
+    resolve_missing_packages
 
 _required_packages_prompt = f"""
 **Context:**
@@ -47,6 +52,34 @@ def required_packages(code: str,
 
         aprint(f'Input code:\n{code}')
 
+        try:
+            # Resolve missing packages statically, no need for an LLM in the common case:
+            list_of_packages, unresolved_modules = resolve_missing_packages(dedent(code))
+        except SyntaxError:
+            aprint(f'Code could not be parsed, cannot resolve packages statically.')
+            list_of_packages, unresolved_modules = [], None
+
+        # Ask the LLM only if some missing modules could not be mapped to a package:
+        if unresolved_modules is None or len(unresolved_modules) > 0:
+            if unresolved_modules:
+                aprint(f'Missing modules that could not be mapped to a package: {", ".join(sorted(unresolved_modules))}')
+            llm_packages = _required_packages_with_llm(code, llm=llm, verbose=verbose)
+
+            # The LLM lists all required packages, only keep those not installed:
+            list_of_packages += [p for p in llm_packages if p not in list_of_packages and not is_package_installed(p)]
+
+        if len(list_of_packages) > 0:
+            aprint(f'List of missing packages:\n{list_of_packages}')
+        else:
+            aprint(f'No packages missing to run this code!')
+
+    return list_of_packages
+
+
+def _required_packages_with_llm(code: str,
+                                llm: BaseLLM = None,
+                                verbose: bool = False):
+    with(asection(f'Asking LLM for the packages required by the code')):
         # Instantiates LLM if needed:
         llm = llm or ChatOpenAI(model_name=get_default_openai_model_name(),
                                 temperature=0)
@@ -67,7 +100,7 @@ def required_packages(code: str,
         variables = {"code": code}
 
         # call LLM:
-        list_of_packages_str = chain.invoke(variables)['text']
+        list_of_packages_str = cached_chain_invoke(chain, variables)
 
         # Cleanup:
         list_of_packages_str = list_of_packages_str.strip()
@@ -84,24 +117,15 @@ def required_packages(code: str,
         if '\n' in list_of_packages_str:
             list_of_packages_str = list_of_packages_str.replace('\n', ' ')
 
-        if len(list_of_packages_str) > 0:
+        # Parse the list:
+        list_of_packages = list_of_packages_str.split()
 
-            # Parse the list:
-            list_of_packages = list_of_packages_str.split()
-
-            # Strip each package name of white spaces:
-            list_of_packages = [p.strip() for p in list_of_packages]
-
-            # Remove empty strings:
-            list_of_packages = [p for p in list_of_packages if len(p) > 0]
-
-            aprint(f'List of required packages:\n{list_of_packages}')
-
-        else:
-            aprint(f'No packages to run this code!')
-            return []
-
-    return list_of_packages
+        # Strip each package name of white spaces:
+        list_of_packages = [p.strip() for p in list_of_packages]
 
+        # Remove empty strings:
+        list_of_packages = [p for p in list_of_packages if len(p) > 0]
 
+        aprint(f'List of required packages according to LLM:\n{list_of_packages}')
 
+        return list_of_packages
@@ -0,0 +1,266 @@
+import hashlib
+import importlib
+import json
+import os
+import pkgutil
+import re
+import sys
+import traceback
+import weakref
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from arbol import aprint, asection
+
+# Global package index, see get_package_index():
+_package_index = None
+_package_index_lock = Lock()
+
+# Functions called when the installed packages change, see add_package_index_listener():
+_package_index_listeners = []
+
+
+class PackageIndex:
+    """
+    Index of the packages installed in the current environment:
+    pip distributions and their versions, conda packages, and importable top-level modules.
+    """
+
+    def __init__(self,
+                 pip_packages: List[Tuple[str, str]],
+                 conda_packages: List[Tuple[str, str]],
+                 modules: Set[str]):
+        self.pip_packages = pip_packages
+        self.conda_packages = conda_packages
+        self.modules = set(modules)
+
+        # Normalised distribution name -> version:
+        self._versions = {_normalize(name): version for name, version in pip_packages}
+
+        # Memoised package lists:
+        self._package_lists = {}
+
+    def is_installed(self, package_name: str, version_required: Optional[str] = None) -> bool:
+        """
+        Checks whether a package is installed, given either its distribution name (e.g. 'scikit-image')
+        or its top-level module name (e.g. 'skimage'), and optionally a required version.
+        """
+        normalized_name = _normalize(package_name)
+
+        if normalized_name in self._versions:
+            return version_required is None or self._versions[normalized_name] == version_required
+
+        if package_name in self.modules:
+            if version_required is None:
+                return True
+            # Module whose distribution has a different name:
+            from importlib.metadata import version, PackageNotFoundError
+            try:
+                return version(package_name) == version_required
+            except PackageNotFoundError:
+                return False
+
+        return False
+
+    def package_list(self, version: bool = True) -> List[str]:
+        """
+        List of pip and conda packages, as 'name==version' strings if version is True.
+        """
+        if version not in self._package_lists:
+            packages = self.pip_packages + self.conda_packages
+            self._package_lists[version] = [f"{name}=={v}" if version else name for name, v in packages]
+        return self._package_lists[version]
+
+    def to_dict(self) -> dict:
+        return {'pip_packages': self.pip_packages,
+                'conda_packages': self.conda_packages,
+                'modules': sorted(self.modules)}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'PackageIndex':
+        return PackageIndex(pip_packages=[tuple(p) for p in data['pip_packages']],
+                            conda_packages=[tuple(p) for p in data['conda_packages']],
+                            modules=set(data['modules']))
+
+
+def get_package_index(wait: bool = True) -> Optional[PackageIndex]:
+    """
+    Returns the package index, loading it from disk if the environment has not changed,
+    or building it otherwise. Waits if the index is being built in the background,
+    unless wait is False in which case None is returned.
+    """
+    global _package_index
+    if not _package_index_lock.acquire(blocking=wait):
+        return None
+    try:
+        if _package_index is None:
+            _package_index = _load_or_build_package_index()
+        return _package_index
+    finally:
+        _package_index_lock.release()
+
+
+def start_package_index_build():
+    """
+    Starts loading or building the package index in a background thread, if not already available.
+    """
+    Thread(target=get_package_index, name='package_index_builder', daemon=True).start()
+
+
+def invalidate_package_index(rebuild: bool = True):
+    """
+    Invalidates the package index, to be called after installing or uninstalling packages.
+    The index is rebuilt in the background if requested.
+    """
+    global _package_index
+    with _package_index_lock:
+        _package_index = None
+
+        # Remove persisted index:
+        index_path = _package_index_path()
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+        # Newly installed modules must be visible to the import system:
+        importlib.invalidate_caches()
+
+    # Installed package versions might have changed:
+    from napari_chatgpt.utils.python.symbol_index import invalidate_symbol_indices, start_symbol_index_build
+    invalidate_symbol_indices()
+
+    if rebuild:
+        start_package_index_build()
+        start_symbol_index_build()
+
+    # Notify listeners, for example to rebuild tools that depend on installed packages and plugins:
+    for listener in list(_package_index_listeners):
+        function = listener()
+        if function is None:
+            _package_index_listeners.remove(listener)
+            continue
+        try:
+            function()
+        except Exception:
+            traceback.print_exc()
+
+
+def add_package_index_listener(function: Callable[[], None]):
+    """
+    Registers a function, or bound method, to be called when the package index is invalidated,
+    after installing or uninstalling packages. Only a weak reference to the function is kept.
+    """
+    listener = weakref.WeakMethod(function) if hasattr(function, '__self__') else weakref.ref(function)
+    _package_index_listeners.append(listener)
+
+
+def build_package_index() -> PackageIndex:
+    with asection("Building index of installed packages"):
+        pip_packages = [tuple(p.split('==', 1)) for p in pip_list(version=True)]
+        conda_packages = [tuple(p.split('==', 1)) for p in conda_list(version=True)]
+        modules = _top_level_modules()
+        aprint(f"Indexed {len(pip_packages)} pip packages, {len(conda_packages)} conda packages, and {len(modules)} top-level modules.")
+        return PackageIndex(pip_packages=pip_packages,
+                            conda_packages=conda_packages,
+                            modules=modules)
+
+
+def pip_list(version: bool = False):
+    try:
+        import importlib.metadata as metadata
+
+        # Get a list of installed packages
+        if version:
+            package_list = [f"{pkg.metadata['name']}=={pkg.metadata['version']}"
+                            for pkg in metadata.distributions()]
+        else:
+            package_list = [pkg.metadata['name'] for pkg in
+                            metadata.distributions()]
+
+        return package_list
+
+    except Exception as e:
+        print(traceback.format_exc())
+        return []
+
+
+def conda_list(version: bool = False):
+    try:
+        import subprocess
+
+        # Run the conda command to get a list of installed packages
+        output = subprocess.check_output(['conda', 'list']).decode(
+            'utf-8').strip()
+
+        # Split the output into lines and print the package names
+        if version:
+            package_list = [f"{line.split()[0]}=={line.split()[1]}" for line in
+                            output.split('\n') if not line.startswith('#')]
+        else:
+            package_list = [line.split()[0] for line in output.split('\n') if
+                            not line.startswith('#')]
+
+        return package_list
+
+    except Exception as e:
+        print(traceback.format_exc())
+        return []
+
+
+def _load_or_build_package_index() -> PackageIndex:
+    index_path = _package_index_path()
+    fingerprint = _environment_fingerprint()
+
+    # Load persisted index if the environment has not changed:
+    try:
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as file:
+                data = json.load(file)
+            if data.get('fingerprint') == fingerprint:
+                aprint(f"Loaded index of installed packages from: {index_path}")
+                return PackageIndex.from_dict(data['index'])
+    except Exception:
+        traceback.print_exc()
+
+    # Build index and persist it:
+    package_index = build_package_index()
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, 'w') as file:
+            json.dump({'fingerprint': fingerprint, 'index': package_index.to_dict()}, file)
+    except Exception:
+        traceback.print_exc()
+
+    return package_index
+
+
+def _package_index_path() -> str:
+    # One index per environment:
+    prefix_hash = hashlib.sha256(sys.prefix.encode('utf-8')).hexdigest()[:16]
+    return os.path.expanduser(os.path.join('~', '.omega', f'package_index_{prefix_hash}.json'))
+
+
+def _environment_fingerprint() -> Dict[str, object]:
+    # Installing or removing packages modifies these folders:
+    folders = [p for p in sys.path if p and os.path.isdir(p)]
+    folders.append(os.path.join(sys.prefix, 'conda-meta'))
+    mtimes = {folder: os.path.getmtime(folder) for folder in folders if os.path.isdir(folder)}
+    return {'prefix': sys.prefix,
+            'executable': sys.executable,
+            'mtimes': mtimes}
+
+
+def _top_level_modules() -> Set[str]:
+    modules = set(sys.builtin_module_names)
+    modules.update(module.name for module in pkgutil.iter_modules())
+    try:
+        # Also covers editable installs that are not directly on the path:
+        from importlib.metadata import packages_distributions
+        modules.update(packages_distributions().keys())
+    except Exception:
+        traceback.print_exc()
+    return modules
+
+
+def _normalize(name: str) -> str:
+    # PEP 503 normalisation of distribution names:
+    return re.sub(r"[-_.]+", "-", name).lower()
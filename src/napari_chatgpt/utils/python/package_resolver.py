@@ -0,0 +1,175 @@
+import ast
+import importlib.util
+import os
+import re
+import sys
+import sysconfig
+import traceback
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple
+
+# Top-level modules whose pip distribution has a different name:
+_module_to_distribution = {
+    'skimage': 'scikit-image',
+    'sklearn': 'scikit-learn',
+    'cv2': 'opencv-python',
+    'PIL': 'pillow',
+    'yaml': 'pyyaml',
+    'bs4': 'beautifulsoup4',
+    'Bio': 'biopython',
+    'SimpleITK': 'simpleitk',
+    'pywt': 'pywavelets',
+    'torch': 'torch',
+    'dateutil': 'python-dateutil',
+    'pyclesperanto_prototype': 'pyclesperanto-prototype',
+    'aicsimageio': 'aicsimageio',
+    'zmq': 'pyzmq',
+    'serial': 'pyserial',
+    'OpenGL': 'pyopengl',
+    'attr': 'attrs',
+    'fitz': 'pymupdf',
+    'docx': 'python-docx',
+    'magic': 'python-magic',
+    'jwt': 'pyjwt',
+    'Levenshtein': 'python-levenshtein',
+}
+
+
+def resolve_missing_packages(code: str) -> Tuple[List[str], Set[str]]:
+    """
+    Statically determines the pip packages that must be installed to run the given code:
+    top-level modules imported by the code that cannot be found are mapped to distribution names.
+
+    Parameters
+    ----------
+    code : str
+        Python code, must be parsable.
+
+    Returns
+    -------
+    Tuple[List[str], Set[str]]
+        List of distributions to install, and set of missing top-level modules
+        for which the distribution name is not known.
+    """
+
+    packages = []
+    unresolved = set()
+
+    for module_name in imported_modules(code):
+
+        # Nothing to install if the module can be found:
+        if _is_module_available(module_name):
+            continue
+
+        distribution = _distribution_for_module(module_name)
+        if distribution is None:
+            unresolved.add(module_name)
+        elif distribution not in packages:
+            packages.append(distribution)
+
+    return packages, unresolved
+
+
+def imported_modules(code: str) -> List[str]:
+    """
+    Returns the top-level modules imported by the code, in order of first import,
+    excluding relative imports and modules of the standard library.
+    """
+    tree = ast.parse(code)
+
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+
+        for name in names:
+            module_name = name.split('.')[0]
+            if module_name not in modules and not _is_standard_library_module(module_name):
+                modules.append(module_name)
+
+    return modules
+
+
+def _distribution_for_module(module_name: str):
+    # Curated table first:
+    if module_name in _module_to_distribution:
+        return _module_to_distribution[module_name]
+
+    # Distributions known to provide that module, for example when a package is partially installed:
+    distributions = _packages_distributions().get(module_name)
+    if distributions:
+        return distributions[0]
+
+    # Known distributions that share the name of their module:
+    if _normalize(module_name) in _known_distributions():
+        return _normalize(module_name)
+
+    return None
+
+
+def _is_module_available(module_name: str) -> bool:
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+@lru_cache(maxsize=None)
+def _is_standard_library_module(module_name: str) -> bool:
+    if module_name in sys.builtin_module_names or module_name == '__future__':
+        return True
+
+    # Python 3.10 and later:
+    stdlib_module_names = getattr(sys, 'stdlib_module_names', None)
+    if stdlib_module_names is not None:
+        return module_name in stdlib_module_names
+
+    # Otherwise, modules located in the standard library folder, but not in site-packages:
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return False
+    if spec is None or not spec.origin:
+        return False
+    if spec.origin in ('frozen', 'built-in'):
+        return True
+    origin = os.path.realpath(spec.origin)
+    stdlib_path = os.path.realpath(sysconfig.get_paths()['stdlib'])
+    return origin.startswith(stdlib_path + os.sep) and 'site-packages' not in origin and 'dist-packages' not in origin
+
+
+@lru_cache(maxsize=1)
+def _packages_distributions() -> Dict[str, List[str]]:
+    try:
+        from importlib.metadata import packages_distributions
+        return packages_distributions()
+    except Exception:
+        traceback.print_exc()
+        return {}
+
+
+@lru_cache(maxsize=1)
+def _known_distributions() -> Set[str]:
+    from napari_chatgpt.utils.python.relevant_libraries import \
+        _essential_packages, _signal_processing_related_packages
+
+    # Pip substitutions and extras are applied by pip_install:
+    from napari_chatgpt.utils.python.pip_utils import \
+        ___included_packages, ___pip_substitutions, ___conda_forge_substitutions
+
+    names = set(_essential_packages) | set(_signal_processing_related_packages) | set(___included_packages)
+    names |= set(___pip_substitutions.keys()) | set(___conda_forge_substitutions.keys())
+    names |= {'napari', 'magicgui', 'stardist', 'cellpose', 'aydin', 'tifffile', 'zarr', 'pyclesperanto'}
+    names |= set(_module_to_distribution.values())
+
+    # Entries such as 'scipy.signal' are not distributions:
+    return {_normalize(name) for name in names if '.' not in name}
+
+
+def _normalize(name: str) -> str:
+    # PEP 503 normalisation of distribution names:
+    return re.sub(r"[-_.]+", "-", name).lower()
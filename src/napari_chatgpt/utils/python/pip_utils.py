@@ -1,9 +1,10 @@
-from typing import List
+from typing import List, Callable, Optional
 
 from arbol import aprint, asection
 
 from napari_chatgpt.utils.python.conda_utils import conda_install
 from napari_chatgpt.utils.python.installed_packages import is_package_installed
+from napari_chatgpt.utils.python.package_index import invalidate_package_index
 from napari_chatgpt.utils.qt.package_dialog import install_packages_dialog
 
 ___included_packages = ['numpy', 'napari', 'magicgui', 'scikit-image', 'scipy']
@@ -21,7 +22,8 @@ def pip_install(packages: List[str],
                 included: bool = True,
                 special_rules: bool = True,
                 skip_if_installed: bool = True,
-                ask_permission: bool = True) -> str:
+                ask_permission: bool = True,
+                ask_permission_function: Optional[Callable[[List[str]], bool]] = None) -> str:
 
     message = ''
 
@@ -75,16 +77,21 @@ def pip_install(packages: List[str],
 
     if len(packages) > 0:
         try:
-            response = not ask_permission or install_packages_dialog(packages=packages)
+            ask_permission_function = ask_permission_function or install_packages_dialog
+            response = not ask_permission or ask_permission_function(packages)
 
             if response:
                 aprint(f"User accepted to install packages!")
                 message += f"User accepted to install packages: {', '.join(packages)}\n"
                 with asection(f"Installing up to {len(packages)} packages with pip:"):
                     for package in packages:
-                        message += pip_install_single_package(package=package)
+                        message += pip_install_single_package(package=package,
+                                                              invalidate_index=False)
                         message += '\n'
 
+                # Installed packages have changed:
+                invalidate_package_index()
+
             else:
                 message += f"User refused to install packages!\n"
 
@@ -111,7 +118,8 @@ from subprocess import CalledProcessError
 
 def pip_install_single_package(package: str,
                                upgrade: bool = False,
-                               skip_if_installed: bool = True) -> str:
+                               skip_if_installed: bool = True,
+                               invalidate_index: bool = True) -> str:
 
     # Upgrade is a special case:
     if upgrade:
@@ -154,6 +162,10 @@ def pip_install_single_package(package: str,
             else:
                 message = f"Error occurred:\n{result.stderr}\n"
 
+            # Installed packages have changed:
+            if invalidate_index:
+                invalidate_package_index()
+
         aprint(message)
         return message
 
@@ -179,4 +191,7 @@ def pip_uninstall(list_of_packages: List[str]) -> bool:
                     print(f"An error occurred while uninstalling {package}. Error: {e}")
                     error_occurred = True
 
+    # Installed packages have changed:
+    invalidate_package_index()
+
     return not error_occurred
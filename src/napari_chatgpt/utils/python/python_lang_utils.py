@@ -8,6 +8,9 @@ from typing import get_type_hints, Any, List
 
 from arbol import aprint
 
+from napari_chatgpt.utils.python.symbol_index import get_symbol_index, \
+    get_loaded_symbol_index
+
 
 @lru_cache
 def get_function_signature(function_name: str,
@@ -174,6 +177,22 @@ def get_function_info(function_path: str,
 
 
 def find_functions_in_package(pkg_name: str, function_name: str):
+
+    # Look up the symbol index first if ready, this avoids importing every submodule of the package:
+    symbol_index = get_symbol_index(pkg_name.split('.')[0], wait=False) if pkg_name else None
+    if symbol_index is not None:
+        functions = []
+        for qualified_name in symbol_index.find(function_name, module_prefix=pkg_name):
+            if symbol_index.kind(qualified_name) == 'function':
+                obj = symbol_index.resolve(qualified_name)
+                if inspect.isfunction(obj) and obj.__name__ == function_name:
+                    functions.append((qualified_name.rsplit('.', 1)[0], obj))
+        return functions
+
+    return _find_functions_in_package_by_import(pkg_name, function_name)
+
+
+def _find_functions_in_package_by_import(pkg_name: str, function_name: str):
     import warnings # to ignore deprecation warnings
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -188,7 +207,7 @@ def find_functions_in_package(pkg_name: str, function_name: str):
             if name.startswith('_'):
                 continue
             if inspect.ismodule(obj):
-                recursive_functions = find_functions_in_package(
+                recursive_functions = _find_functions_in_package_by_import(
                     pkg_name + '.' + name, function_name)
                 if recursive_functions:
                     functions += recursive_functions
@@ -293,6 +312,16 @@ def unzip(list_of_tuples):
 def function_exists(function_name: str) -> bool:
     try:
         module_name, function_name = function_name.rsplit('.', 1)
+
+        # Answer from the symbol index if already loaded, without importing the module nor indexing its package:
+        symbol_index = get_loaded_symbol_index(module_name.split('.')[0])
+        if symbol_index is not None:
+            kind = symbol_index.kind(f'{module_name}.{function_name}')
+            if kind is not None:
+                return not kind.startswith('module')
+            if symbol_index.is_indexed_module(module_name):
+                return False
+
         module = importlib.import_module(module_name)
         return hasattr(module, function_name) and callable(
             getattr(module, function_name))
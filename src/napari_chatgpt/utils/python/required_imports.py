@@ -1,6 +1,9 @@
+import ast
 import importlib
+import importlib.util
 import sys
 import traceback
+from textwrap import dedent
 
 from arbol import asection, aprint
 from langchain.chains import LLMChain
@@ -10,8 +13,11 @@ from langchain_openai import ChatOpenAI
 
 from napari_chatgpt.chat_server.callbacks.callbacks_arbol_stdout import \
     ArbolCallbackHandler
+from napari_chatgpt.utils.llm.llm_cache import cached_chain_invoke
 from napari_chatgpt.utils.openai.default_model import \
     get_default_openai_model_name
+from napari_chatgpt.utils.python.import_resolver import \
+    resolve_missing_imports, existing_imports
 from napari_chatgpt.utils.strings.extract_code import extract_code_from_markdown
 
 _required_imports_prompt = f"""
@@ -43,13 +49,45 @@ def required_imports(code: str,
                      verbose: bool = False):
     with(asection(
             f'Automatically determines missing imports for code of length: {len(code)}')):
-        # Cleanup code:
-        code = code.strip()
 
         # If code is empty, nothing is missing!
-        if len(code) == 0:
+        if len(code.strip()) == 0:
             return []
 
+        try:
+            # Resolve imports statically, no need for an LLM in the common case:
+            code_to_parse = dedent(code)
+            list_of_imports, unresolved_names = resolve_missing_imports(code_to_parse)
+
+            # Like the LLM, we list the imports already in the code too:
+            list_of_imports = existing_imports(code_to_parse) + list_of_imports
+
+        except SyntaxError:
+            aprint(f'Code could not be parsed, cannot resolve imports statically.')
+            list_of_imports, unresolved_names = [], None
+
+        # Ask the LLM only if some names could not be resolved:
+        if unresolved_names is None or len(unresolved_names) > 0:
+            if unresolved_names:
+                aprint(f'Names that could not be resolved statically: {", ".join(sorted(unresolved_names))}')
+            llm_imports = _required_imports_with_llm(code, llm=llm, verbose=verbose)
+            list_of_imports += [i for i in llm_imports if i not in list_of_imports]
+
+        # Filter the list of imports for bad ones:
+        list_of_imports = list([i for i in list_of_imports if check_import_statement(i)])
+
+        aprint(f'List of missing imports:\n{list_of_imports}')
+
+    return list_of_imports
+
+
+def _required_imports_with_llm(code: str,
+                               llm: BaseLLM = None,
+                               verbose: bool = False):
+    with(asection(f'Asking LLM for missing imports')):
+        # Cleanup code:
+        code = code.strip()
+
         # Instantiates LLM if needed:
         llm = llm or ChatOpenAI(model_name=get_default_openai_model_name(),
                                 temperature=0)
@@ -70,7 +108,7 @@ def required_imports(code: str,
         variables = {'input': code}
 
         # call LLM:
-        list_of_imports_str = chain.invoke(variables)['text']
+        list_of_imports_str = cached_chain_invoke(chain, variables)
 
         # Extract code:
         list_of_imports_str = extract_code_from_markdown(list_of_imports_str)
@@ -78,10 +116,8 @@ def required_imports(code: str,
         # Parse the list:
         list_of_imports = list_of_imports_str.split('\n')
 
-        # Filter the list of imports for bad ones:
-        list_of_imports = list([i for i in list_of_imports if check_import_statement(i)])
-
-        aprint(f'List of missing imports:\n{list_of_imports}')
+        # Remove empty lines:
+        list_of_imports = [i.strip() for i in list_of_imports if len(i.strip()) > 0]
 
     return list_of_imports
 
@@ -90,65 +126,53 @@ def check_import_statement(import_statement):
 
     with asection(f"Checking the validity of suggested import statement: '{import_statement}'"):
         try:
-            # Cleanup import statement:
-            import_statement = import_statement.strip()
-
-            # remove the 'as' statement:
-            if ' as ' in import_statement:
-                index = import_statement.find(' as ')
-                import_statement = import_statement[:index].strip()
-
-            # Extract modules and names:
-            if import_statement.startswith('import '):
-                import_statement = import_statement[7:]
-
-                # cleanup module name:
-                module_name = import_statement.strip()
-
-                names = None
-            elif import_statement.startswith('from '):
-                import_statement = import_statement[5:]
+            # Parse the import statement:
+            try:
+                nodes = ast.parse(import_statement.strip()).body
+            except SyntaxError:
+                nodes = []
 
-                # Split the import statement into module and names
-                module_name, names = import_statement.split(' import ')
-
-                # cleanup module name:
-                module_name = module_name.strip()
-
-                # Names:
-                names = names.split()
-            else:
+            if len(nodes) != 1 or not isinstance(nodes[0], (ast.Import, ast.ImportFrom)):
                 aprint(
                     f"This is not an import statement: '{import_statement}' !")
                 return False
 
-            # cleanup module name and names:
-            module_name = module_name.strip()
-            names = [n.strip() for n in names] if names else None
+            node = nodes[0]
 
-            # Check module's existence:
-            spec = importlib.util.find_spec(module_name)
-            if spec is None:
-                aprint(f"Module '{module_name}' does not exist.")
+            # Relative imports cannot be checked:
+            if isinstance(node, ast.ImportFrom) and (node.level > 0 or node.module is None):
+                aprint(f"Relative import statement: '{import_statement}' cannot be used!")
                 return False
 
-            aprint(f"Module '{module_name}' exists.")
+            # Modules and names to check:
+            if isinstance(node, ast.Import):
+                module_names = [alias.name for alias in node.names]
+                names = None
+            else:
+                module_names = [node.module]
+                names = [alias.name for alias in node.names]
+
+            for module_name in module_names:
+                # Check module's existence:
+                spec = importlib.util.find_spec(module_name)
+                if spec is None:
+                    aprint(f"Module '{module_name}' does not exist.")
+                    return False
 
-            # Do we need to check whether the names exist?
-            if names:
-                # Loading module from spec:
-                module = importlib.util.module_from_spec(spec)
+                aprint(f"Module '{module_name}' exists.")
 
-                # Loading from spec:
-                spec.loader.exec_module(module)
+            # Do we need to check whether the names exist?
+            if names and names != ['*']:
+                # Importing the module, a no-op if already imported:
+                module = importlib.import_module(module_names[0])
 
-                # Checking if each name exists:
+                # Checking if each name exists, either as attribute or as submodule:
                 for name in names:
-                    if hasattr(module, name):
-                        aprint(f"Name '{name}' exists within module '{module_name}'.")
+                    if hasattr(module, name) or importlib.util.find_spec(f"{module_names[0]}.{name}") is not None:
+                        aprint(f"Name '{name}' exists within module '{module_names[0]}'.")
                     else:
                         aprint(
-                            f"Name '{name}' does not exist within module '{module_name}'.")
+                            f"Name '{name}' does not exist within module '{module_names[0]}'.")
                         return False
 
             return True
@@ -156,4 +180,4 @@ def check_import_statement(import_statement):
         except Exception:
             traceback.print_exc()
             aprint(f"Import statement: '{import_statement}' is problematic!")
-            return False
\ No newline at end of file
+            return False
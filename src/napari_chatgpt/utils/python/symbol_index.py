@@ -0,0 +1,325 @@
+import difflib
+import inspect
+import json
+import os
+import re
+import traceback
+import warnings
+from threading import Lock, Thread
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
+
+from arbol import aprint, asection
+
+# Symbol indices per top-level package, see get_symbol_index():
+_symbol_indices = {}
+_symbol_indices_lock = Lock()
+_package_locks = {}
+
+# Maximal number of modules visited when indexing a package:
+_max_modules = 2000
+
+# Packages indexed on demand, indexing other packages would import all their submodules for little benefit:
+_indexable_packages = ('numpy', 'scipy', 'skimage', 'napari', 'magicgui',
+                       'pandas', 'matplotlib', 'dask', 'sklearn',
+                       'pyclesperanto_prototype', 'cellpose', 'stardist')
+
+
+class SymbolIndex:
+    """
+    Index of the public symbols (modules, classes, functions and other callables)
+    of an installed package, reachable as attributes from its top-level module.
+    Each symbol is stored with its fully qualified name, kind, and signature.
+    """
+
+    def __init__(self,
+                 package: str,
+                 version: str,
+                 symbols: Dict[str, Tuple[str, str]]):
+        self.package = package
+        self.version = version
+        self.symbols = symbols
+
+        # Symbol short name -> fully qualified names:
+        self._by_name = {}
+        for qualified_name in symbols:
+            self._by_name.setdefault(qualified_name.rsplit('.', 1)[-1], []).append(qualified_name)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, qualified_name: str):
+        return qualified_name in self.symbols
+
+    def kind(self, qualified_name: str) -> Optional[str]:
+        entry = self.symbols.get(qualified_name)
+        return entry[0] if entry else None
+
+    def signature(self, qualified_name: str) -> Optional[str]:
+        entry = self.symbols.get(qualified_name)
+        return entry[1] if entry else None
+
+    def is_indexed_module(self, module_name: str) -> bool:
+        """
+        True if the attributes of the given module were indexed, in which case
+        a missing symbol in that module is known to not exist.
+        """
+        return module_name == self.package or self.kind(module_name) == 'module'
+
+    def find(self, name: str, module_prefix: Optional[str] = None) -> List[str]:
+        """
+        Returns the fully qualified names of the symbols with the given short name,
+        optionally restricted to those starting with a module prefix.
+        """
+        qualified_names = self._by_name.get(name, [])
+        if module_prefix:
+            qualified_names = [q for q in qualified_names if q == module_prefix or q.startswith(module_prefix + '.')]
+        return list(qualified_names)
+
+    def closest(self, qualified_name: str, max_results: int = 3, cutoff: float = 0.8) -> List[str]:
+        """
+        Returns the fully qualified names of the callable symbols closest to the given, possibly incorrect,
+        fully qualified name. Symbols with the same short name come first, ranked by similarity of their path,
+        for example: 'skimage.transform.line' -> 'skimage.draw.line'. Otherwise, symbols with similar short names are returned.
+        """
+        name = qualified_name.rsplit('.', 1)[-1]
+
+        # Same short name, different path:
+        candidates = [q for q in self.find(name) if not self.kind(q).startswith('module')]
+
+        # Similar short name, for example misspelled or renamed functions:
+        if not candidates:
+            close_names = difflib.get_close_matches(name, list(self._by_name.keys()), n=max_results, cutoff=cutoff)
+            candidates = [q for n in close_names for q in self._by_name[n] if not self.kind(q).startswith('module')]
+
+        def _similarity(candidate: str) -> float:
+            return difflib.SequenceMatcher(None, qualified_name, candidate).ratio()
+
+        # Shorter paths are preferred for equal similarity, they are usually the public API:
+        candidates.sort(key=lambda q: (-_similarity(q), q.count('.'), q))
+        return candidates[:max_results]
+
+    def resolve(self, qualified_name: str):
+        """
+        Returns the object for the given fully qualified name, by importing the package
+        and following attributes, or None if it cannot be resolved.
+        """
+        try:
+            obj = __import__(self.package)
+            for name in qualified_name.split('.')[1:]:
+                obj = getattr(obj, name)
+            return obj
+        except Exception:
+            return None
+
+    def to_dict(self) -> dict:
+        return {'package': self.package,
+                'version': self.version,
+                'symbols': self.symbols}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'SymbolIndex':
+        return SymbolIndex(package=data['package'],
+                           version=data['version'],
+                           symbols={q: tuple(e) for q, e in data['symbols'].items()})
+
+
+def get_symbol_index(package: str, wait: bool = True) -> Optional[SymbolIndex]:
+    """
+    Returns the symbol index of an installed top-level package, loading it from disk
+    if already built for the installed version of the package, or building it otherwise.
+    If wait is False and the index is not loaded yet, it is loaded or built in the background and None is returned.
+    Returns None if the package is not installed, or is not one of the packages indexed on demand.
+    """
+    if package not in _indexable_packages:
+        return None
+
+    with _symbol_indices_lock:
+        if package in _symbol_indices:
+            return _symbol_indices[package]
+        package_lock = _package_locks.setdefault(package, Lock())
+
+    if not wait:
+        if not package_lock.locked():
+            start_symbol_index_build([package])
+        return None
+
+    with package_lock:
+        # Another thread might have built it in the meantime:
+        with _symbol_indices_lock:
+            if package in _symbol_indices:
+                return _symbol_indices[package]
+
+        symbol_index = _load_or_build_symbol_index(package)
+
+        with _symbol_indices_lock:
+            _symbol_indices[package] = symbol_index
+        return symbol_index
+
+
+def start_symbol_index_build(packages: Optional[List[str]] = None):
+    """
+    Starts loading or building the symbol indices of the given packages in a background thread,
+    by default of all the packages indexed on demand. Packages that are not installed are skipped.
+    """
+    packages = [package for package in (packages or _indexable_packages) if package in _indexable_packages]
+
+    def _build():
+        for package in packages:
+            try:
+                get_symbol_index(package)
+            except Exception:
+                traceback.print_exc()
+
+    Thread(target=_build, name='symbol_index_builder', daemon=True).start()
+
+
+def get_loaded_symbol_index(package: str) -> Optional[SymbolIndex]:
+    """
+    Returns the symbol index of a package only if it is already loaded, never loads or builds it.
+    """
+    with _symbol_indices_lock:
+        return _symbol_indices.get(package)
+
+
+def invalidate_symbol_indices():
+    """
+    Forgets the loaded symbol indices, to be called after installing or uninstalling packages.
+    Persisted indices are keyed by package version and remain valid.
+    """
+    with _symbol_indices_lock:
+        _symbol_indices.clear()
+
+
+def build_symbol_index(package: str, version: str = '') -> Optional[SymbolIndex]:
+    """
+    Builds the symbol index of a package by importing it and walking its public submodules.
+    Returns None if the package cannot be imported.
+    """
+    with asection(f"Building symbol index for package: {package}"):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+
+            try:
+                root = __import__(package)
+            except Exception as e:
+                aprint(f"Could not import package '{package}': {type(e).__name__}: {e}")
+                return None
+
+            symbols = {}
+            visited = set()
+            indexed_module_names = {package}
+            modules_to_visit = [(package, root)]
+
+            # Breadth-first, so that modules are indexed under their shortest path:
+            while modules_to_visit and len(visited) < _max_modules:
+                module_name, module = modules_to_visit.pop(0)
+                if id(module) in visited:
+                    continue
+                visited.add(id(module))
+                indexed_module_names.add(module_name)
+
+                for name in _public_names(module):
+                    try:
+                        obj = getattr(module, name)
+                    except Exception:
+                        continue
+
+                    qualified_name = f"{module_name}.{name}"
+
+                    if isinstance(obj, ModuleType):
+                        # Only submodules of the package are indexed:
+                        if obj.__name__ == package or obj.__name__.startswith(package + '.'):
+                            symbols[qualified_name] = ('module', '')
+                            modules_to_visit.append((qualified_name, obj))
+                    elif inspect.isclass(obj):
+                        symbols[qualified_name] = ('class', _signature(obj))
+                    elif inspect.isroutine(obj):
+                        symbols[qualified_name] = ('function', _signature(obj))
+                    elif callable(obj):
+                        symbols[qualified_name] = ('callable', _signature(obj))
+
+            # Other paths to already indexed modules, or modules beyond the limit, are not indexed:
+            for qualified_name, (kind, _) in symbols.items():
+                if kind == 'module' and qualified_name not in indexed_module_names:
+                    symbols[qualified_name] = ('module_alias', '')
+
+            aprint(f"Indexed {len(symbols)} symbols in {len(visited)} modules.")
+            return SymbolIndex(package=package, version=version, symbols=symbols)
+
+
+def _public_names(module: ModuleType) -> List[str]:
+    try:
+        # Lazily loaded packages list their submodules in __all__ or __dir__:
+        names = sorted(set(getattr(module, '__all__', None) or []) | set(dir(module)))
+        return [n for n in names if isinstance(n, str) and not n.startswith('_') and n not in ('test', 'tests', 'conftest')]
+    except Exception:
+        return []
+
+
+def _signature(obj) -> str:
+    try:
+        return str(inspect.signature(obj))
+    except Exception:
+        return ''
+
+
+def _load_or_build_symbol_index(package: str) -> Optional[SymbolIndex]:
+    version = _package_version(package)
+    if version is None:
+        return None
+
+    index_path = _symbol_index_path(package, version)
+
+    # Load persisted index if built for that version of the package:
+    try:
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as file:
+                symbol_index = SymbolIndex.from_dict(json.load(file))
+            aprint(f"Loaded symbol index for package '{package}' from: {index_path}")
+            return symbol_index
+    except Exception:
+        traceback.print_exc()
+
+    # Build index and persist it:
+    symbol_index = build_symbol_index(package, version=version)
+    if symbol_index is not None:
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path, 'w') as file:
+                json.dump(symbol_index.to_dict(), file)
+        except Exception:
+            traceback.print_exc()
+
+    return symbol_index
+
+
+def _package_version(package: str) -> Optional[str]:
+    from importlib.metadata import packages_distributions, version, PackageNotFoundError
+    import importlib.util
+
+    try:
+        if importlib.util.find_spec(package) is None:
+            return None
+    except (ImportError, ValueError):
+        return None
+
+    # Version of the distribution(s) that provide the package:
+    try:
+        distributions = packages_distributions().get(package, [])
+        versions = [f"{d}-{version(d)}" for d in sorted(set(distributions))]
+        if versions:
+            return '_'.join(versions)
+    except PackageNotFoundError:
+        pass
+    except Exception:
+        traceback.print_exc()
+
+    # Modules of the standard library and packages without metadata:
+    import sys
+    return f"python-{sys.version.split()[0]}"
+
+
+def _symbol_index_path(package: str, version: str) -> str:
+    file_name = re.sub(r'[^A-Za-z0-9_.\-]+', '_', f"{package}-{version}") + '.json'
+    return os.path.expanduser(os.path.join('~', '.omega', 'symbol_index', file_name))
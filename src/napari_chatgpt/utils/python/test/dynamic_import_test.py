@@ -55,3 +55,19 @@ def test_execute_as_module():
     pprint(result)
 
     assert result == '[15 18 21]'
+
+
+def test_dynamic_import_from_memory():
+    import inspect
+    from napari_chatgpt.utils.python.dynamic_import import _code_cache
+
+    # Loading the same code twice compiles it only once, but gives two fresh modules:
+    module_1 = dynamic_import(___module_code)
+    module_2 = dynamic_import(___module_code)
+    assert module_1 is not module_2
+    assert module_1.my_function.__code__ is module_2.my_function.__code__
+    assert module_1.__name__ == module_2.__name__
+    assert module_1.__name__ in [f"some_code_{digest}" for digest in _code_cache]
+
+    # Source code is available without any file on disk:
+    assert 'return x**2' in inspect.getsource(module_1.my_function)
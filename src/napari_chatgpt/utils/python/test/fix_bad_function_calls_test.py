@@ -1,9 +1,18 @@
+import os
+
 import pytest
 from arbol import aprint
 
 from napari_chatgpt.utils.api_keys.api_key import is_api_key_available
+from napari_chatgpt.utils.llm import llm_cache
+from napari_chatgpt.utils.llm.llm_cache import LLMCache
+from langchain_community.llms.fake import FakeListLLM
+
+from napari_chatgpt.utils.python import symbol_index
 from napari_chatgpt.utils.python.fix_bad_fun_calls import \
-    fix_all_bad_function_calls
+    fix_all_bad_function_calls, replace_function_calls, \
+    fix_function_call_locally, _fix_function_calls_with_llm
+from napari_chatgpt.utils.python.symbol_index import get_symbol_index
 
 _code_snippet_1 = \
 """
@@ -95,3 +104,52 @@ def test_fix_bad_call_3():
 
     assert did_something
     assert 'skimage.draw.line' in fixed_code
+
+
+def test_fix_bad_call_3_with_symbol_index():
+    # The symbol index, once ready, proposes the fix, no LLM needed:
+    get_symbol_index('skimage')
+    fixed_code, did_something, report = fix_all_bad_function_calls(_code_snippet_3, llm=object())
+    aprint(fixed_code)
+
+    assert did_something
+    assert 'skimage.draw.line' in fixed_code
+
+
+def test_fix_function_call_locally_waits_for_symbol_index(monkeypatch):
+    # Until the symbol index is ready, it is built in the background and no local fix is proposed:
+    builds = []
+    monkeypatch.setattr(symbol_index, '_symbol_indices', {})
+    monkeypatch.setattr(symbol_index, 'start_symbol_index_build', builds.append)
+    assert fix_function_call_locally('skimage.transform.line') is None
+    assert builds == [['skimage']]
+
+
+def test_replace_function_calls():
+    code = "rr, cc = transform.line(0, 0, 5, 5)  # transform.line\nname = 'transform.line'\nmytransform.line(1)\n"
+    fixed_code = replace_function_calls(code, {'transform.line': 'skimage.draw.line'})
+
+    # Only the actual call is rewritten:
+    assert fixed_code == "rr, cc = skimage.draw.line(0, 0, 5, 5)  # transform.line\nname = 'transform.line'\nmytransform.line(1)\n"
+
+
+def test_fix_function_calls_with_llm_single_request(tmp_path, monkeypatch):
+    # Fresh cache, so that the LLM is called whatever is cached in ~/.omega:
+    cache = LLMCache(path=os.path.join(tmp_path, 'cache.sqlite'))
+    monkeypatch.setattr(llm_cache, 'get_llm_cache', lambda: cache)
+
+    calls = []
+
+    class _FakeLLM(FakeListLLM):
+        def _call(self, *args, **kwargs):
+            calls.append(1)
+            return super()._call(*args, **kwargs)
+
+    llm = _FakeLLM(responses=["1. 'numpy.zeros'\n2. 'scipy.ndimage.convolve'"])
+    bad_function_calls = [('numpy.zeroz_foo_bar', 'np.zeroz_foo_bar'),
+                          ('scipy.nope.convolve_nope', 'nope.convolve_nope')]
+    fixes = _fix_function_calls_with_llm(bad_function_calls, llm=llm)
+
+    assert fixes == ['numpy.zeros', 'scipy.ndimage.convolve']
+    assert len(calls) == 1
+    assert len(cache) == 1
@@ -0,0 +1,76 @@
+from arbol import aprint
+
+from napari_chatgpt.utils.python.import_resolver import \
+    resolve_missing_imports, unbound_names, existing_imports
+
+_code_snippet = """
+import numpy as np
+from napari.types import ImageData
+
+@magicgui(call_button='Run')
+def smooth(layer: Image, sigma: float = 1.0) -> ImageData:
+    data = np.copy(layer.data).astype(float)
+    smoothed = ndi.gaussian_filter(data, sigma=sigma)
+    edges = scipy.signal.convolve2d(smoothed, np.ones((3, 3)), mode='same')
+    mask = edges > filters.threshold_otsu(edges)
+    labels = [l for l in measure.label(mask).ravel() if l > 0]
+    return smoothed * len(labels) * undefined_name
+"""
+
+
+def test_unbound_names():
+    names = unbound_names(_code_snippet)
+    aprint(names)
+
+    assert set(names.keys()) == {'magicgui', 'Image', 'ndi', 'scipy',
+                                 'filters', 'measure', 'undefined_name'}
+    assert 'scipy.signal.convolve2d' in names['scipy']
+    assert 'magicgui' in names['magicgui']
+    assert 'ndi' not in names['ndi']
+
+
+def test_resolve_missing_imports():
+    imports, unresolved = resolve_missing_imports(_code_snippet)
+    aprint(imports)
+
+    assert 'from magicgui import magicgui' in imports
+    assert 'from napari.layers import Image' in imports
+    assert 'from scipy import ndimage as ndi' in imports
+    assert 'import scipy.signal' in imports
+    assert 'from skimage import filters' in imports
+    assert 'from skimage import measure' in imports
+    assert unresolved == {'undefined_name'}
+
+
+def test_resolve_missing_imports_submodules():
+    # Submodules of scikit-image and SciPy, rather than standard library modules of the same name:
+    imports, unresolved = resolve_missing_imports('img = io.imread("cells.tif")\nr = signal.convolve2d(img, img)\n')
+    assert imports == ['from skimage import io', 'from scipy import signal']
+    assert unresolved == set()
+
+    # Standard library modules, when their attributes are used:
+    imports, _ = resolve_missing_imports('buffer = io.StringIO()\n')
+    assert imports == ['import io']
+
+    # Attributes that do not exist anywhere are left for the LLM to fix:
+    imports, unresolved = resolve_missing_imports('x = io.not_a_function()\n')
+    assert imports == []
+    assert unresolved == {'io'}
+
+
+def test_resolve_missing_imports_curated_symbols():
+    # Curated symbols, scikit-image's label rather than SciPy's:
+    imports, unresolved = resolve_missing_imports('labels = label(mask > threshold_otsu(mask))\n')
+    assert imports == ['from skimage.measure import label', 'from skimage.filters import threshold_otsu']
+    assert unresolved == {'mask'}
+
+    # Undefined variables are never bound to module level helpers or modules:
+    imports, unresolved = resolve_missing_imports('result = test + data\n')
+    assert imports == []
+    assert unresolved == {'test', 'data'}
+
+
+def test_existing_imports():
+    imports = existing_imports(_code_snippet)
+
+    assert imports == ['import numpy as np', 'from napari.types import ImageData']
@@ -1,3 +1,5 @@
+from importlib.metadata import version
+
 from arbol import aprint
 
 from napari_chatgpt.utils.python.installed_packages import \
@@ -17,3 +19,24 @@ def test_installed_packages():
 def test_is_package_installed():
     assert is_package_installed('numpy')
     assert not is_package_installed('grumpy')
+
+
+def test_package_index():
+    from napari_chatgpt.utils.python.package_index import get_package_index, \
+        invalidate_package_index
+
+    package_index = get_package_index()
+
+    # Distribution names, module names, and versions:
+    assert package_index.is_installed('scikit-image')
+    assert package_index.is_installed('scikit_image')
+    assert package_index.is_installed('skimage')
+    assert package_index.is_installed('numpy', version('numpy'))
+    assert not package_index.is_installed('numpy', '0.0.1')
+    assert not package_index.is_installed('grumpy')
+
+    # Index is cached, and rebuilt after invalidation:
+    assert get_package_index() is package_index
+    invalidate_package_index(rebuild=False)
+    assert get_package_index() is not package_index
+    assert get_package_index().is_installed('numpy')
@@ -1,7 +1,10 @@
 import pytest
 
 from napari_chatgpt.utils.api_keys.api_key import is_api_key_available
+from napari_chatgpt.utils.python import package_resolver
 from napari_chatgpt.utils.python.missing_packages import required_packages
+from napari_chatgpt.utils.python.package_resolver import \
+    resolve_missing_packages, imported_modules
 
 ___generated_python_code = """
 
@@ -23,13 +26,48 @@ def denoise_bilateral(image: ImageData, d: int = 15, sigmaColor: float = 75, sig
 """
 
 
+def test_imported_modules():
+    modules = imported_modules(___generated_python_code + "\nimport os.path\nfrom . import foo\n")
+
+    # Standard library modules and relative imports are excluded:
+    assert modules == ['magicgui', 'napari', 'numpy', 'cv2']
+
+
+def test_imported_modules_without_stdlib_module_names(monkeypatch):
+    # Python 3.9 has no sys.stdlib_module_names, standard library modules are found by location:
+    monkeypatch.delattr(package_resolver.sys, 'stdlib_module_names', raising=False)
+    package_resolver._is_standard_library_module.cache_clear()
+    try:
+        modules = imported_modules("import os\nimport json\nimport numpy\nimport sys\n")
+        assert modules == ['numpy']
+    finally:
+        package_resolver._is_standard_library_module.cache_clear()
+
+
+def test_resolve_missing_packages(monkeypatch):
+    # Pretend that OpenCV and some other modules are not installed:
+    missing = {'cv2', 'skimage', 'mahotas', 'some_unknown_module'}
+    monkeypatch.setattr(package_resolver, '_is_module_available', lambda name: name not in missing)
+
+    code = ___generated_python_code + "\nfrom skimage import filters\nimport mahotas\nimport some_unknown_module\n"
+    packages, unresolved = resolve_missing_packages(code)
+
+    assert packages == ['opencv-python', 'scikit-image', 'mahotas']
+    assert unresolved == {'some_unknown_module'}
+
+
+def test_required_packages_nothing_missing():
+    # All modules are installed, no need for the LLM:
+    assert required_packages("import numpy as np\nfrom magicgui import magicgui\n", llm=object()) == []
+
+
 @pytest.mark.skipif(not is_api_key_available('OpenAI'),
                     reason="requires OpenAI key to run")
 def test_missing_packages():
-    packages = required_packages(___generated_python_code)
+    packages = required_packages(___generated_python_code + "\nimport some_unknown_module\n")
     print(packages)
-    assert packages
-    assert 'magicgui' in packages
-    assert 'napari' in packages
-    assert 'numpy' in packages
-    assert any('opencv-python' in p for p in packages)
+
+    # Installed packages are not listed:
+    assert 'magicgui' not in packages
+    assert 'napari' not in packages
+    assert 'numpy' not in packages
@@ -0,0 +1,53 @@
+from arbol import aprint
+
+from napari_chatgpt.utils.python import symbol_index as symbol_index_module
+from napari_chatgpt.utils.python.python_lang_utils import function_exists
+from napari_chatgpt.utils.python.symbol_index import build_symbol_index, \
+    SymbolIndex, get_symbol_index, get_loaded_symbol_index
+
+
+def test_build_symbol_index():
+    symbol_index = build_symbol_index('skimage')
+
+    assert symbol_index.kind('skimage.draw.line') == 'function'
+    assert symbol_index.kind('skimage.draw') == 'module'
+    assert symbol_index.signature('skimage.draw.line') == '(r0, c0, r1, c1)'
+    assert symbol_index.is_indexed_module('skimage.transform')
+    assert 'skimage.transform.line' not in symbol_index
+
+    # Persistence round trip:
+    symbol_index = SymbolIndex.from_dict(symbol_index.to_dict())
+    assert symbol_index.kind('skimage.draw.line') == 'function'
+
+
+def test_symbol_index_fuzzy_matching():
+    symbol_index = get_symbol_index('skimage')
+
+    # Function moved to another module:
+    closest = symbol_index.closest('skimage.transform.line')
+    aprint(closest)
+    assert closest[0] == 'skimage.draw.line'
+
+    # Misspelled function:
+    closest = symbol_index.closest('skimage.filters.treshold_otsu')
+    aprint(closest)
+    assert closest[0] == 'skimage.filters.threshold_otsu'
+
+    # Function lookup restricted to a package:
+    assert 'skimage.filters.gaussian' in symbol_index.find('gaussian', module_prefix='skimage.filters')
+
+
+def test_symbol_index_missing_package():
+    assert get_symbol_index('some_package_that_does_not_exist') is None
+
+
+def test_symbol_index_only_on_demand(monkeypatch):
+    # Packages not in the allow-list are never indexed:
+    assert get_symbol_index('json') is None
+
+    # Checking that a function exists never loads nor builds an index:
+    monkeypatch.setattr(symbol_index_module, '_symbol_indices', {})
+    function_exists.cache_clear()
+    assert function_exists('scipy.ndimage.gaussian_filter')
+    assert not function_exists('scipy.ndimage.gaussian_filter_nope')
+    assert get_loaded_symbol_index('scipy') is None
@@ -0,0 +1,353 @@
+import multiprocessing
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import product
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+import numpy
+from arbol import aprint, asection
+
+# Tile of an array: the core is the part of the array that the tile is responsible for,
+# the halo extends the core on all sides so that local operators are exact within the core:
+_Tile = namedtuple('_Tile', ['core', 'read', 'core_in_read'])
+
+# Labels are returned as numpy arrays up to this size in bytes, and as compressed zarr arrays above:
+_max_in_memory_output_bytes = 2 ** 30
+
+
+def tiled_classic_segmentation(image,
+                               threshold_type: str = 'otsu',
+                               normalize: Optional[bool] = True,
+                               norm_range_low: Optional[float] = 1.0,
+                               norm_range_high: Optional[float] = 99.8,
+                               min_segment_size: int = 32,
+                               erosion_steps: int = 1,
+                               closing_steps: int = 1,
+                               opening_steps: int = 0,
+                               tile_size: Union[int, Sequence[int]] = 256,
+                               max_workers: Optional[int] = None,
+                               output=None,
+                               histogram_bins: int = 4096):
+    """
+    Classic segmentation of 2D or 3D images that do not fit in memory, tile by tile, on a pool of processes.
+    Gives the same segments as classic_segmentation (without watershed), up to the numbering of the segments
+    and to small differences in the normalisation percentiles and threshold, which are computed from histograms.
+
+    The image is processed in passes, only a few tiles are in memory at any time:
+    (i) histogram passes to compute the normalisation percentiles and the global threshold,
+    (ii) per-tile erosion, thresholding, closing, opening, and labelling, each tile is read with a halo
+    so that the morphological operators give the same result as on the whole image,
+    (iii) a stitching pass that merges segments touching across tile boundaries, and removes small segments.
+
+    Parameters
+    ----------
+    image: ArrayLike
+        2D or 3D image, a numpy, zarr, or dask array, or any array that can be sliced.
+
+    threshold_type: str
+        Algorithm to use for thresholding. Options include: 'otsu', 'yen', 'li', 'minimum', 'triangle', 'mean', 'isodata'.
+
+    normalize: Optional[bool]
+        If True, normalizes the image to a given percentile range.
+        If False, assumes that the image is already normalized to [0,1].
+
+    norm_range_low: Optional[float]
+        Lower percentile for normalization
+
+    norm_range_high: Optional[float]
+        Higher percentile for normalization
+
+    min_segment_size: Optional[int]
+        Minimum number of pixels in a segment. Segments smaller than this are removed.
+
+    erosion_steps: Optional[int]
+        Number of iterations of the erosion operator to apply to the image.
+
+    closing_steps: Optional[int]
+        Number of iterations of the closing operator to apply to the thresholded image.
+
+    opening_steps: Optional[int]
+        Number of iterations of the opening operator to apply to the thresholded image.
+
+    tile_size: Union[int, Sequence[int]]
+        Size of the tiles, for all dimensions or per dimension.
+
+    max_workers: Optional[int]
+        Number of processes, by default the number of CPUs, at most one per tile. If 1, tiles are processed in this process.
+
+    output: Optional[ArrayLike]
+        Array in which to write the labels, for example a zarr array stored on disk, of the same shape as the image,
+        and of an integer type. By default, a numpy array for numpy images and for labels that fit in memory,
+        and an in-memory compressed zarr array otherwise.
+
+    histogram_bins: int
+        Number of bins of the histograms used to compute the percentiles and threshold.
+
+    Returns
+    -------
+    Segmented image as a labels array that can be added to napari as a Labels layer.
+
+    """
+
+    if image.ndim not in (2, 3):
+        raise ValueError(f"Tiled segmentation requires a 2D or 3D image, got an image of shape: {image.shape}")
+
+    # Tiles, their halo covers the reach of the morphological operators:
+    halo = 2 * erosion_steps + 4 * closing_steps + 4 * opening_steps + 1
+    tiles = list(_tiles(image.shape, tile_size, halo))
+    tiles_without_halo = list(_tiles(image.shape, tile_size, 0))
+
+    if output is None:
+        output = _default_output(image, tiles[0])
+
+    max_workers = max_workers or min(os.cpu_count() or 1, len(tiles))
+
+    with asection(f"Tiled classic segmentation of an image of shape {image.shape} in {len(tiles)} tiles, with {max_workers} workers:"):
+
+        with _executor(max_workers) as executor:
+
+            # Range of values:
+            with asection("Computing the range of values..."):
+                min_maxs = [result for _, result in _map_tiles(executor, image, tiles_without_halo, _tile_min_max, max_in_flight=2 * max_workers)]
+                value_min = float(min(m for m, _ in min_maxs))
+                value_max = float(max(m for _, m in min_maxs))
+                aprint(f"Range of values: [{value_min}, {value_max}]")
+
+            # Constant images have nothing above threshold, as for the untiled segmentation:
+            if value_min == value_max:
+                aprint("Constant image, no segments.")
+                for tile in tiles_without_halo:
+                    output[tile.core] = 0
+                return output
+
+            # Normalisation percentiles, from the histogram of the image:
+            normalization = None
+            if normalize:
+                with asection("Computing normalisation percentiles..."):
+                    counts, edges = _histogram(executor, image, tiles_without_halo, (value_min, value_max), 16 * histogram_bins, max_workers)
+                    v_low = _histogram_percentile(counts, edges, norm_range_low)
+                    v_high = _histogram_percentile(counts, edges, norm_range_high)
+                    normalization = (v_low, v_high)
+                    aprint(f"Percentiles: {norm_range_low}% -> {v_low}, {norm_range_high}% -> {v_high}")
+
+            # Global threshold, from the histogram of the normalised and eroded image:
+            with asection("Computing the global threshold..."):
+                value_range = (0.0, 1.0) if normalize else (value_min, value_max)
+                counts, edges = _histogram(executor, image, tiles, value_range, histogram_bins, max_workers,
+                                           normalization=normalization, erosion_steps=erosion_steps)
+                threshold = _threshold_from_histogram(threshold_type, counts, edges)
+                aprint(f"Threshold ({threshold_type}): {threshold}")
+
+            # Per-tile morphology and labelling, each tile's labels are offset to be unique:
+            with asection("Labelling tiles..."):
+                label_sizes = [numpy.zeros(1, dtype=numpy.int64)]
+                number_of_labels = 0
+                for tile, (labels, sizes) in _map_tiles(executor, image, tiles, _tile_labels,
+                                                        normalization, erosion_steps, threshold, closing_steps, opening_steps,
+                                                        max_in_flight=2 * max_workers):
+                    if number_of_labels + len(sizes) >= 2 ** 32:
+                        raise OverflowError("Too many segments for 32 bit labels, try more erosion or a larger minimum segment size.")
+                    output[tile.core] = numpy.where(labels > 0, labels + numpy.uint32(number_of_labels), 0).astype(output.dtype)
+                    label_sizes.append(sizes)
+                    number_of_labels += len(sizes)
+                label_sizes = numpy.concatenate(label_sizes)
+                aprint(f"Found {number_of_labels} segments in tiles.")
+
+        # Merge segments touching across tile boundaries, and remove small segments:
+        with asection("Stitching tiles..."):
+            pairs = _boundary_label_pairs(output, tiles)
+            lut = _relabelling_lut(pairs, label_sizes, min_segment_size)
+            for tile in tiles_without_halo:
+                output[tile.core] = lut[numpy.asarray(output[tile.core])].astype(output.dtype)
+            aprint(f"Found {len(pairs)} pairs of touching segments across tiles, {int(lut.max())} segments after stitching.")
+
+    return output
+
+
+def _tiles(shape: Tuple[int, ...], tile_size: Union[int, Sequence[int]], halo: int) -> Iterator[_Tile]:
+    tile_size = (tile_size,) * len(shape) if isinstance(tile_size, int) else tuple(tile_size)
+    starts = [range(0, size, step) for size, step in zip(shape, tile_size)]
+    for start in product(*starts):
+        core = tuple(slice(s, min(s + t, size)) for s, t, size in zip(start, tile_size, shape))
+        read = tuple(slice(max(c.start - halo, 0), min(c.stop + halo, size)) for c, size in zip(core, shape))
+        core_in_read = tuple(slice(c.start - r.start, c.stop - r.start) for c, r in zip(core, read))
+        yield _Tile(core, read, core_in_read)
+
+
+def _map_tiles(executor, image, tiles, function, *args, max_in_flight: int = 8):
+    # Tiles are read here, and processed by the executor, at most max_in_flight tiles are in memory at any time.
+    # Results are returned in the order of the tiles:
+    pending = deque()
+    for tile in tiles:
+        # Lazy arrays (zarr, dask, ...) are only read here, one tile at a time:
+        data = numpy.asarray(image[tile.read])
+        pending.append((tile, executor.submit(function, data, tile.core_in_read, *args)))
+        if len(pending) >= max_in_flight:
+            tile, future = pending.popleft()
+            yield tile, future.result()
+    while pending:
+        tile, future = pending.popleft()
+        yield tile, future.result()
+
+
+def _executor(max_workers: int):
+    if max_workers <= 1:
+        return ThreadPoolExecutor(max_workers=1)
+    # Processes are spawned, forking a process that runs Qt and other threads is not safe:
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _default_output(image, tile: _Tile):
+    if isinstance(image, numpy.ndarray) or image.size * numpy.dtype(numpy.uint32).itemsize <= _max_in_memory_output_bytes:
+        return numpy.zeros(image.shape, dtype=numpy.uint32)
+    try:
+        # Labels compress very well, chunks match the tiles:
+        import zarr
+        return zarr.zeros(shape=image.shape, chunks=tuple(c.stop - c.start for c in tile.core), dtype='uint32')
+    except ImportError:
+        return numpy.zeros(image.shape, dtype=numpy.uint32)
+
+
+def _histogram(executor, image, tiles, value_range, bins: int, max_workers: int, normalization=None, erosion_steps: int = 0):
+    counts = numpy.zeros(bins, dtype=numpy.int64)
+    for _, tile_counts in _map_tiles(executor, image, tiles, _tile_histogram, value_range, bins, normalization, erosion_steps,
+                                     max_in_flight=2 * max_workers):
+        counts += tile_counts
+    edges = numpy.linspace(value_range[0], value_range[1], bins + 1)
+    return counts, edges
+
+
+def _histogram_percentile(counts: numpy.ndarray, edges: numpy.ndarray, percentile: float) -> float:
+    cumulative = numpy.cumsum(counts)
+    target = percentile / 100 * cumulative[-1]
+    index = min(int(numpy.searchsorted(cumulative, target)), len(counts) - 1)
+    # Linear interpolation within the bin:
+    previous = cumulative[index - 1] if index > 0 else 0
+    fraction = (target - previous) / counts[index] if counts[index] > 0 else 0
+    return float(edges[index] + fraction * (edges[index + 1] - edges[index]))
+
+
+def _threshold_from_histogram(threshold_type: str, counts: numpy.ndarray, edges: numpy.ndarray) -> float:
+    from skimage.filters import (threshold_otsu, threshold_yen, threshold_li,
+                                 threshold_minimum, threshold_triangle,
+                                 threshold_isodata)
+
+    # Only the range of values present in the image:
+    non_zero = numpy.nonzero(counts)[0]
+    if len(non_zero) == 0:
+        # No values, for example only NaNs, nothing is above threshold:
+        return float('inf')
+    if len(non_zero) == 1:
+        # All values in one bin, none is above it:
+        return float(edges[non_zero[0] + 1])
+    counts = counts[non_zero[0]:non_zero[-1] + 1]
+    centers = ((edges[:-1] + edges[1:]) / 2)[non_zero[0]:non_zero[-1] + 1]
+
+    histogram_functions = {
+        'otsu': threshold_otsu,
+        'yen': threshold_yen,
+        'minimum': threshold_minimum,
+        'isodata': threshold_isodata,
+    }
+    if threshold_type in histogram_functions:
+        return float(histogram_functions[threshold_type](hist=(counts, centers)))
+    elif threshold_type == 'mean':
+        return float(numpy.sum(counts * centers) / numpy.sum(counts))
+    elif threshold_type in ('li', 'triangle'):
+        # These need values, a sample of at most a million values drawn from the histogram is used:
+        repeats = numpy.round(counts * min(1.0, 1e6 / counts.sum())).astype(numpy.int64)
+        sample = numpy.repeat(centers, repeats)
+        return float(threshold_li(sample) if threshold_type == 'li' else threshold_triangle(sample))
+    else:
+        raise ValueError(
+            "threshold_type must be one of: 'otsu', 'yen', 'li', 'minimum', 'triangle', 'mean', 'isodata'.")
+
+
+def _tile_min_max(data: numpy.ndarray, core):
+    core_data = data[core]
+    return core_data.min(), core_data.max()
+
+
+def _tile_histogram(data: numpy.ndarray, core, value_range, bins: int, normalization, erosion_steps: int):
+    image = _preprocess(data, normalization, erosion_steps)
+    return numpy.histogram(image[core], bins=bins, range=value_range)[0]
+
+
+def _tile_labels(data: numpy.ndarray, core, normalization, erosion_steps: int, threshold: float,
+                 closing_steps: int, opening_steps: int):
+    from skimage.measure import label
+    from skimage.morphology import closing, opening
+
+    image = _preprocess(data, normalization, erosion_steps)
+
+    # Apply threshold, and the closing and opening operators a given number of steps:
+    footprint = _footprint(image.ndim)
+    binary_image = image > threshold
+    for _ in range(closing_steps):
+        binary_image = closing(binary_image, footprint=footprint)
+    for _ in range(opening_steps):
+        binary_image = opening(binary_image, footprint=footprint)
+
+    # Only the core is labelled, the halo belongs to other tiles:
+    labels = label(binary_image[core]).astype(numpy.uint32)
+    sizes = numpy.bincount(labels.ravel())[1:]
+    return labels, sizes
+
+
+def _preprocess(data: numpy.ndarray, normalization, erosion_steps: int) -> numpy.ndarray:
+    from skimage.morphology import erosion
+
+    image = data.astype(float, copy=False)
+    if normalization is not None:
+        v_low, v_high = normalization
+        image = numpy.clip((image - v_low) / (v_high - v_low + 1e-6), 0, 1)
+
+    footprint = _footprint(image.ndim)
+    for _ in range(erosion_steps):
+        image = erosion(image, footprint=footprint)
+    return image
+
+
+def _footprint(ndim: int):
+    from skimage.morphology import disk, ball
+    return disk(2) if ndim == 2 else ball(2)
+
+
+def _boundary_label_pairs(output, tiles) -> numpy.ndarray:
+    # Pairs of labels that touch across a tile boundary, with full connectivity, as for labelling:
+    ndim = output.ndim
+    pairs = [numpy.zeros((0, 2), dtype=numpy.int64)]
+    for axis in range(ndim):
+        boundaries = sorted({tile.core[axis].start for tile in tiles if tile.core[axis].start > 0})
+        for boundary in boundaries:
+            before = numpy.asarray(output[(slice(None),) * axis + (boundary - 1,)])
+            after = numpy.asarray(output[(slice(None),) * axis + (boundary,)])
+            for shift in product((-1, 0, 1), repeat=ndim - 1):
+                source = tuple(slice(max(0, -s), size - max(0, s)) for s, size in zip(shift, before.shape))
+                target = tuple(slice(max(0, s), size - max(0, -s)) for s, size in zip(shift, before.shape))
+                a, b = before[source], after[target]
+                touching = (a > 0) & (b > 0)
+                if touching.any():
+                    pairs.append(numpy.unique(numpy.stack([a[touching], b[touching]], axis=1).astype(numpy.int64), axis=0))
+    return numpy.unique(numpy.concatenate(pairs), axis=0)
+
+
+def _relabelling_lut(pairs: numpy.ndarray, label_sizes: numpy.ndarray, min_segment_size: int) -> numpy.ndarray:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    # Touching labels belong to the same segment:
+    number_of_labels = len(label_sizes)
+    graph = coo_matrix((numpy.ones(len(pairs), dtype=numpy.int8), (pairs[:, 0], pairs[:, 1])),
+                       shape=(number_of_labels, number_of_labels))
+    _, components = connected_components(graph, directed=False)
+
+    # Remove small segments, and the background:
+    component_sizes = numpy.bincount(components, weights=label_sizes)
+    keep = component_sizes >= min_segment_size
+    keep[components[0]] = False
+
+    # Consecutive labels for the segments kept:
+    new_labels = numpy.cumsum(keep) * keep
+    return new_labels[components].astype(numpy.uint32)
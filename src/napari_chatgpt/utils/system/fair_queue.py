@@ -0,0 +1,129 @@
+import time
+from collections import deque
+from threading import Condition
+from typing import Any, Dict, Hashable, Optional
+
+
+class FairQueue:
+    """
+    Blocking queue that interleaves items from several keys (for example chat sessions) in round-robin order,
+    so that a key with many queued items cannot starve the others. Items of a given key are served in FIFO order.
+
+    The queue keeps per-key metrics: current and maximal queue depth, number of items enqueued and dequeued,
+    and the time items spent waiting in the queue.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+
+        # Queued (enqueue time, item) pairs per key:
+        self._queues: Dict[Hashable, deque] = {}
+
+        # Keys that have queued items, in the order they will be served:
+        self._rotation = deque()
+
+        # Per-key metrics:
+        self._metrics: Dict[Hashable, Dict[str, float]] = {}
+
+        self._closed = False
+
+    def put(self, item: Any, key: Hashable = None):
+        """
+        Adds an item to the queue of the given key.
+        """
+        with self._condition:
+            queue = self._queues.setdefault(key, deque())
+            if not queue:
+                self._rotation.append(key)
+            queue.append((time.monotonic(), item))
+
+            metrics = self._key_metrics(key)
+            metrics['enqueued'] += 1
+            metrics['max_depth'] = max(metrics['max_depth'], len(queue))
+
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Removes and returns the next item, taking turns between keys.
+        Blocks until an item is available, returns None if the queue is closed or the timeout expires.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._rotation or self._closed, timeout=timeout):
+                return None
+            if self._closed:
+                return None
+
+            key = self._rotation.popleft()
+            queue = self._queues[key]
+            enqueue_time, item = queue.popleft()
+
+            # The key goes to the back of the line if it has more items:
+            if queue:
+                self._rotation.append(key)
+            else:
+                del self._queues[key]
+
+            wait_time = time.monotonic() - enqueue_time
+            metrics = self._key_metrics(key)
+            metrics['dequeued'] += 1
+            metrics['total_wait'] += wait_time
+            metrics['max_wait'] = max(metrics['max_wait'], wait_time)
+
+            return item
+
+    def close(self):
+        """
+        Closes the queue, wakes up all waiting consumers. Queued items are dropped.
+        """
+        with self._condition:
+            self._closed = True
+            self._queues.clear()
+            self._rotation.clear()
+            self._condition.notify_all()
+
+    def depth(self, key: Hashable = None) -> int:
+        """
+        Number of queued items for the given key.
+        """
+        with self._condition:
+            return len(self._queues.get(key, ()))
+
+    def depths(self) -> Dict[Hashable, int]:
+        """
+        Number of queued items per key, for keys that have queued items.
+        """
+        with self._condition:
+            return {key: len(queue) for key, queue in self._queues.items()}
+
+    def metrics(self) -> Dict[Hashable, Dict[str, float]]:
+        """
+        Metrics per key: 'depth', 'max_depth', 'enqueued', 'dequeued', 'mean_wait' and 'max_wait' (in seconds).
+        """
+        with self._condition:
+            return {key: dict(depth=len(self._queues.get(key, ())),
+                              max_depth=metrics['max_depth'],
+                              enqueued=metrics['enqueued'],
+                              dequeued=metrics['dequeued'],
+                              mean_wait=metrics['total_wait'] / metrics['dequeued'] if metrics['dequeued'] else 0.0,
+                              max_wait=metrics['max_wait'])
+                    for key, metrics in self._metrics.items()}
+
+    def forget(self, key: Hashable):
+        """
+        Forgets the metrics of a key that has no queued items, for example once a session has ended.
+        """
+        with self._condition:
+            if key not in self._queues:
+                self._metrics.pop(key, None)
+
+    def __len__(self):
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _key_metrics(self, key: Hashable) -> Dict[str, float]:
+        return self._metrics.setdefault(key, dict(max_depth=0,
+                                                  enqueued=0,
+                                                  dequeued=0,
+                                                  total_wait=0.0,
+                                                  max_wait=0.0))
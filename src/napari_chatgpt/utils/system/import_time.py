@@ -0,0 +1,89 @@
+import subprocess
+import sys
+from typing import Dict, Sequence
+
+from arbol import aprint, asection
+
+_marker = '__omega_import_time_marker__'
+
+
+def measure_import_time(module_name: str,
+                        baseline_modules: Sequence[str] = (),
+                        timeout: float = 120) -> Dict[str, int]:
+    """
+    Measures the cost of importing a module with 'python -X importtime', in a fresh interpreter.
+    Modules that are already imported by the baseline modules are not counted,
+    for example napari's own modules when measuring the cost of opening a napari plugin.
+
+    Parameters
+    ----------
+    module_name : str
+        Name of the module to import, for example: 'napari_chatgpt._widget'.
+    baseline_modules : Sequence[str]
+        Modules imported first, and not counted.
+    timeout : float
+        Timeout in seconds for the measurement.
+
+    Returns
+    -------
+    Dict[str, int]
+        Self import time in microseconds of each module imported because of the given module.
+
+    """
+
+    # Import the baseline, then mark the start of the measured imports on stderr:
+    code = ''.join(f'import {baseline_module}\n' for baseline_module in baseline_modules)
+    code += f'import sys\nsys.stderr.write("{_marker}\\n")\nsys.stderr.flush()\n'
+    code += f'import {module_name}\n'
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True,
+                            text=True,
+                            timeout=timeout)
+
+    if result.returncode != 0:
+        raise ImportError(f"Could not import module '{module_name}':\n{result.stderr}")
+
+    # Only keep the lines after the marker:
+    lines = result.stderr.split(_marker, 1)[-1].splitlines()
+
+    import_times = {}
+    for line in lines:
+        # Lines have the form: 'import time: self [us] | cumulative | imported package':
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        import_times[name.strip()] = int(self_time)
+
+    return import_times
+
+
+def report_import_time(module_name: str,
+                       baseline_modules: Sequence[str] = (),
+                       top: int = 20) -> float:
+    """
+    Prints the total and the most expensive imports of a module, and returns the total import time in seconds.
+    """
+    import_times = measure_import_time(module_name, baseline_modules)
+    total = sum(import_times.values()) / 1e6
+
+    with asection(f"Import time of '{module_name}': {total:.3f}s for {len(import_times)} modules"):
+
+        # Aggregate per top-level package:
+        package_times = {}
+        for name, self_time in import_times.items():
+            package = name.split('.')[0]
+            package_times[package] = package_times.get(package, 0) + self_time
+
+        for package, self_time in sorted(package_times.items(), key=lambda item: -item[1])[:top]:
+            aprint(f"{self_time / 1e3:8.1f}ms {package}")
+
+    return total
+
+
+# Modules that napari has already imported when a plugin's dock widget is opened:
+napari_baseline_modules = ('napari', 'napari.viewer', 'napari._qt.qt_main_window', 'qtpy.QtWidgets')
+
+if __name__ == '__main__':
+    # Benchmark of the plugin's entry point, see napari.yaml:
+    report_import_time('napari_chatgpt._widget', napari_baseline_modules)
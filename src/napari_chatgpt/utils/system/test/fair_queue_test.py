@@ -0,0 +1,44 @@
+from threading import Thread
+
+from napari_chatgpt.utils.system.fair_queue import FairQueue
+
+
+def test_fair_queue_round_robin():
+    queue = FairQueue()
+
+    # Session 'a' floods the queue before session 'b' submits anything:
+    for i in range(4):
+        queue.put(f'a{i}', key='a')
+    queue.put('b0', key='b')
+    queue.put('b1', key='b')
+
+    assert queue.depths() == {'a': 4, 'b': 2}
+    assert len(queue) == 6
+
+    # Sessions take turns, items of a session stay in order:
+    items = [queue.get() for _ in range(6)]
+    assert items == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+
+    metrics = queue.metrics()
+    assert metrics['a']['max_depth'] == 4
+    assert metrics['a']['enqueued'] == metrics['a']['dequeued'] == 4
+    assert metrics['b']['depth'] == 0
+
+    # Metrics of finished sessions can be dropped:
+    queue.forget('b')
+    assert 'b' not in queue.metrics()
+
+
+def test_fair_queue_blocking_and_close():
+    queue = FairQueue()
+
+    # Timeout when empty:
+    assert queue.get(timeout=0.01) is None
+
+    # Closing wakes up waiting consumers:
+    results = []
+    consumer = Thread(target=lambda: results.append(queue.get()))
+    consumer.start()
+    queue.close()
+    consumer.join(timeout=5)
+    assert results == [None]
@@ -0,0 +1,19 @@
+from napari_chatgpt.utils.system.import_time import measure_import_time, \
+    napari_baseline_modules
+
+
+def test_plugin_entry_point_import_time():
+    # Cost of opening Omega's dock widget on top of what napari has already imported:
+    import_times = measure_import_time('napari_chatgpt._widget', napari_baseline_modules)
+
+    imported_packages = {name.split('.')[0] for name in import_times}
+
+    # Heavy dependencies are only imported once Omega is started, or when needed:
+    for package in ['langchain', 'langchain_core', 'openai', 'anthropic', 'fastapi', 'uvicorn',
+                    'black', 'jedi', 'tensorflow', 'torch', 'cellpose', 'stardist']:
+        assert package not in imported_packages, f"'{package}' should not be imported when opening the dock widget"
+
+    # Import time budget:
+    total = sum(import_times.values()) / 1e6
+    print(f"Import time of the plugin's entry point: {total:.3f}s")
+    assert total < 1.0
@@ -0,0 +1,33 @@
+import time
+
+from napari_chatgpt.utils.system.ttl_cache import ttl_cache
+
+
+def test_ttl_cache():
+    calls = []
+
+    @ttl_cache(ttl_seconds=0.2)
+    def probe(x, none=False):
+        calls.append(x)
+        return None if none else x * 2
+
+    # Results are cached per arguments:
+    assert probe(1) == 2
+    assert probe(1) == 2
+    assert probe(2) == 4
+    assert calls == [1, 2]
+
+    # None results are not cached:
+    probe(3, none=True)
+    probe(3, none=True)
+    assert calls == [1, 2, 3, 3]
+
+    # Results expire:
+    time.sleep(0.3)
+    assert probe(1) == 2
+    assert calls == [1, 2, 3, 3, 1]
+
+    # Cache can be cleared:
+    probe.cache_clear()
+    probe(1)
+    assert calls == [1, 2, 3, 3, 1, 1]
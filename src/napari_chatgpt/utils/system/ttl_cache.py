@@ -0,0 +1,51 @@
+import time
+from functools import wraps
+from threading import Lock
+
+
+def ttl_cache(ttl_seconds: float = 3600):
+    """
+    Decorator that caches the results of a function for a given time-to-live.
+    Results are cached per arguments, None results and exceptions are not cached.
+    The cache can be cleared with the function's cache_clear() method.
+
+    Parameters
+    ----------
+    ttl_seconds : float
+        Time-to-live of cached results, in seconds.
+
+    Returns
+    -------
+    Decorator
+
+    """
+
+    def decorator(function):
+        cache = {}
+        lock = Lock()
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+
+            with lock:
+                entry = cache.get(key)
+            if entry is not None and now - entry[0] < ttl_seconds:
+                return entry[1]
+
+            result = function(*args, **kwargs)
+
+            if result is not None:
+                with lock:
+                    cache[key] = (now, result)
+            return result
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator